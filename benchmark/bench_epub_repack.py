@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+Compare the ways of rewriting an audio EPUB file
+after modifying its XHTML files:
+
+1. extracting it, and zipping it up again, deflating every file
+   (what icarus used to do);
+2. extracting it, and zipping it up again with
+   epub_zip_up_book_contents(), storing media files;
+3. rewriting it in place with EpubZip, copying the unchanged
+   members raw, and deflating the changed XHTML files,
+   sequentially and by a pool of threads.
+
+The synthetic EPUB file has the given total size of audio,
+made of random (i.e., incompressible) bytes,
+deflated like a naive packer would do.
+
+Usage:
+
+$ python benchmark/bench_epub_repack.py [AUDIO_MB] [TEXTS] [WORKERS] [LEVEL]
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "icarus"))
+
+from epub_utils import EpubZip
+from epub_utils import epub_zip_up_book_contents
+from epub_utils import unzip_epub_to_dir
+
+__author__ = "Alberto Pettarin"
+__copyright__ = "Copyright 2015-2016, Alberto Pettarin (www.albertopettarin.it)"
+__license__ = "MIT"
+__version__ = "0.0.3"
+__email__ = "alberto@albertopettarin.it"
+__status__ = "Production"
+
+AUDIO_FILES = 32
+CHUNK_SIZE = 1024 * 1024
+
+CONTAINER = b"""<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+XHTML_HEADER = """<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head>
+  <title>Chapter %d</title>
+</head>
+<body>
+"""
+XHTML_ROW = """  <p>Paragraph %d of chapter %d, with <i>some</i> <span lang="la">emphasis</span>.</p>
+"""
+XHTML_FOOTER = """</body>
+</html>
+"""
+
+def synthetic_xhtml(chapter, paragraphs=500):
+    rows = [XHTML_ROW % (i, chapter) for i in range(paragraphs)]
+    return ((XHTML_HEADER % chapter) + "".join(rows) + XHTML_FOOTER).encode("utf-8")
+
+def text_name(i):
+    return "OEBPS/Text/c%04d.xhtml" % (i)
+
+def audio_name(i):
+    return "OEBPS/Audio/c%04d.mp3" % (i)
+
+def create_epub(path, audio_mb, texts):
+    """
+    Create the synthetic EPUB file at path,
+    deflating every member but the mimetype.
+    """
+    zip_obj = zipfile.ZipFile(path, "w", allowZip64=True)
+    try:
+        zip_obj.writestr("mimetype", b"application/epub+zip", zipfile.ZIP_STORED)
+        zip_obj.writestr("META-INF/container.xml", CONTAINER, zipfile.ZIP_DEFLATED)
+        items = []
+        for i in range(texts):
+            zip_obj.writestr(text_name(i), synthetic_xhtml(i), zipfile.ZIP_DEFLATED)
+            items.append('<item href="Text/c%04d.xhtml" id="c%04d.xhtml" media-type="application/xhtml+xml"/>' % (i, i))
+        chunks = audio_mb // AUDIO_FILES
+        for i in range(AUDIO_FILES):
+            zinfo = zipfile.ZipInfo(audio_name(i), date_time=time.localtime(time.time())[:6])
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            with zip_obj.open(zinfo, "w", force_zip64=True) as dst:
+                for j in range(chunks):
+                    dst.write(os.urandom(CHUNK_SIZE))
+            items.append('<item href="Audio/c%04d.mp3" id="c%04d.mp3" media-type="audio/mpeg"/>' % (i, i))
+        opf = '<package xmlns="http://www.idpf.org/2007/opf" version="3.0"><manifest>%s</manifest></package>' % ("".join(items))
+        zip_obj.writestr("OEBPS/content.opf", opf.encode("utf-8"), zipfile.ZIP_DEFLATED)
+    finally:
+        zip_obj.close()
+
+def modify(data):
+    return data.replace(b"<p>", b'<p class="mo">')
+
+def rezip_deflate_all(ebook_path, epub_filepath):
+    outzip = zipfile.ZipFile(epub_filepath, "w", allowZip64=True)
+    try:
+        outzip.write(os.path.join(ebook_path, "mimetype"), "mimetype", zipfile.ZIP_STORED)
+        for root, dirs, files in os.walk(ebook_path):
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                arcname = os.path.relpath(path, ebook_path).replace(os.sep, "/")
+                if arcname != "mimetype":
+                    outzip.write(path, arcname, zipfile.ZIP_DEFLATED)
+    finally:
+        outzip.close()
+
+def run_extract(src_path, dst_path, tmp_directory, texts, rezip):
+    ebook_path = os.path.join(tmp_directory, "extracted")
+    os.makedirs(ebook_path)
+    try:
+        unzip_epub_to_dir(src_path, ebook_path)
+        for i in range(texts):
+            path = os.path.join(ebook_path, *text_name(i).split("/"))
+            with open(path, "rb") as file_obj:
+                data = file_obj.read()
+            with open(path, "wb") as file_obj:
+                file_obj.write(modify(data))
+        rezip(ebook_path, dst_path)
+    finally:
+        shutil.rmtree(ebook_path)
+
+def run_in_place(src_path, dst_path, texts, workers, level):
+    epub_zip = EpubZip(src_path)
+    try:
+        for i in range(texts):
+            epub_zip.write(text_name(i), modify(epub_zip.read(text_name(i))))
+        epub_zip.save(dst_path, compresslevel=level, workers=workers)
+    finally:
+        epub_zip.close()
+
+def check(src_path, dst_path, texts):
+    src = zipfile.ZipFile(src_path)
+    dst = zipfile.ZipFile(dst_path)
+    try:
+        assert dst.namelist()[0] == "mimetype"
+        assert sorted(src.namelist()) == sorted(dst.namelist())
+        for i in range(texts):
+            assert dst.read(text_name(i)) == modify(src.read(text_name(i)))
+        for i in range(AUDIO_FILES):
+            assert dst.getinfo(audio_name(i)).CRC == src.getinfo(audio_name(i)).CRC
+        # CRC of the stored/copied data, checked once by decompressing
+        assert dst.testzip() is None
+    finally:
+        src.close()
+        dst.close()
+
+def main():
+    audio_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    texts = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    level = int(sys.argv[4]) if len(sys.argv) > 4 else 6
+    audio_mb = max(audio_mb, AUDIO_FILES)
+    tmp_directory = tempfile.mkdtemp()
+    try:
+        src_path = os.path.join(tmp_directory, "book.epub")
+        print("Creating a synthetic EPUB file (%d MB of audio, %d XHTML files)..." % (audio_mb, texts))
+        create_epub(src_path, audio_mb, texts)
+        print("Size: %.1f MB" % (os.path.getsize(src_path) / 1048576.0))
+        print()
+        runs = [
+            ("extract + rezip, deflate all", lambda dst_path: run_extract(src_path, dst_path, tmp_directory, texts, rezip_deflate_all)),
+            ("extract + epub_zip_up_book_contents", lambda dst_path: run_extract(src_path, dst_path, tmp_directory, texts, epub_zip_up_book_contents)),
+            ("EpubZip, raw copy, 0 workers", lambda dst_path: run_in_place(src_path, dst_path, texts, 0, level)),
+            ("EpubZip, raw copy, %d workers" % (workers), lambda dst_path: run_in_place(src_path, dst_path, texts, workers, level)),
+        ]
+        for label, function in runs:
+            dst_path = os.path.join(tmp_directory, "out.epub")
+            start = time.time()
+            function(dst_path)
+            elapsed = time.time() - start
+            check(src_path, dst_path, texts)
+            print("%-40s %8.3f s  %8.1f MB" % (label, elapsed, os.path.getsize(dst_path) / 1048576.0))
+            os.remove(dst_path)
+    finally:
+        shutil.rmtree(tmp_directory)
+
+if __name__ == "__main__":
+    main()
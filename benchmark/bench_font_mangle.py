@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+Compare the per-byte font obfuscation functions of epub_utils
+(Adobe_mangle_fonts, Idpf_mangle_fonts) with the bulk ones
+(Adobe_mangle_fonts_bulk, Idpf_mangle_fonts_bulk),
+on synthetic fonts of random contents.
+
+Before timing, the results of the bulk functions are checked
+against the per-byte ones, including fonts shorter than
+the obfuscated block, and for the round trip.
+
+Usage:
+
+$ python benchmark/bench_font_mangle.py [FONTS] [REPETITIONS]
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import hashlib
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "icarus"))
+
+from epub_utils import Adobe_mangle_fonts
+from epub_utils import Adobe_mangle_fonts_bulk
+from epub_utils import Idpf_mangle_fonts
+from epub_utils import Idpf_mangle_fonts_bulk
+
+__author__ = "Alberto Pettarin"
+__copyright__ = "Copyright 2015-2016, Alberto Pettarin (www.albertopettarin.it)"
+__license__ = "MIT"
+__version__ = "0.0.3"
+__email__ = "alberto@albertopettarin.it"
+__status__ = "Production"
+
+# a 16 byte Adobe key, and a 20 byte (SHA-1) IDPF key
+ADOBE_KEY = hashlib.md5(b"urn:uuid:c2eab181-f356-4c49-bedc-1a61497ba3f6").digest()
+IDPF_KEY = hashlib.sha1(b"urn:uuid:c2eab181-f356-4c49-bedc-1a61497ba3f6").digest()
+
+def synthetic_fonts(count, seed=42):
+    """
+    Return count random fonts of 20-200 KB each.
+
+    :param count: the number of fonts
+    :type  count: int
+    :rtype: list of bytes
+    """
+    rnd = random.Random(seed)
+    return [os.urandom(rnd.randint(20 * 1024, 200 * 1024)) for i in range(count)]
+
+def check(per_byte, bulk, key, fonts):
+    edge = [b"", b"\x00", os.urandom(1023), os.urandom(1024), os.urandom(1039), os.urandom(1040), os.urandom(1041)]
+    for data in edge + fonts[:10]:
+        expected = per_byte(key, data)
+        assert bulk(key, [data]) == [expected]
+        assert bulk(key, bulk(key, [data])) == [data]
+    assert bulk(key, fonts) == [per_byte(key, data) for data in fonts]
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    repetitions = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    fonts = synthetic_fonts(count)
+    for label, per_byte, bulk, key in [
+        ("Adobe", Adobe_mangle_fonts, Adobe_mangle_fonts_bulk, ADOBE_KEY),
+        ("IDPF", Idpf_mangle_fonts, Idpf_mangle_fonts_bulk, IDPF_KEY),
+    ]:
+        check(per_byte, bulk, key, fonts)
+        t_per_byte = min(timeit.repeat(lambda: [per_byte(key, data) for data in fonts], number=1, repeat=repetitions))
+        t_bulk = min(timeit.repeat(lambda: bulk(key, fonts), number=1, repeat=repetitions))
+        print("%-6s %d fonts: per byte %.4f s (%.0f fonts/s), bulk %.4f s (%.0f fonts/s), speedup %.1fx" % (
+            label,
+            count,
+            t_per_byte,
+            count / t_per_byte,
+            t_bulk,
+            count / t_bulk,
+            t_per_byte / t_bulk
+        ))
+
+if __name__ == "__main__":
+    main()
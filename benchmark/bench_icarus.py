@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+Run the icarus benchmarks on a synthetic book (see synthetic.py),
+and write the results to a JSON file, so that
+the results of different versions can be compared.
+
+Benchmarks:
+
+* add_mo_attributes:    MOEdit.add_mo_attributes() on each chapter
+* remove_mo_attributes: MOEdit.remove_mo_attributes() on each chapter,
+                        after adding the MO attributes
+* create_aeneas_job:    Icarus.create_aeneas_job() on all the pairs
+* import_zip_file:      Icarus.import_zip_file() of a ZIP file
+                        with a SMIL file per chapter, into a fresh book
+* populate_pairs:       pairing the files and listing the pairs,
+                        as MainGUI.populate_pairs() does, without the GUI
+
+Each benchmark is run the given number of times,
+and its best and mean times are reported.
+Only the operation itself is timed, not the preparation
+of its input (e.g., the fresh copy of the book).
+The output of icarus is discarded.
+
+Usage:
+
+$ python benchmark/bench_icarus.py [--chapters N] [--paragraphs N] [--ids F] [--classes F]
+                                   [--audio-kb N] [--repetitions N] [--workers N] [--engine E]
+                                   [--only NAME [NAME ...]] [--output PATH] [--compare PATH]
+
+Example, comparing the current version with previous results:
+
+$ python benchmark/bench_icarus.py --output new.json --compare old.json
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import argparse
+import collections
+import io
+import json
+import os
+import platform
+import re
+import shutil
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ElementTree
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "icarus"))
+
+from aeneasjob import AeneasJob
+from core import Icarus
+from moedit import MOEdit
+from smilfile import build_smil
+from synthetic import generate_book
+
+__author__ = "Alberto Pettarin"
+__copyright__ = "Copyright 2015-2016, Alberto Pettarin (www.albertopettarin.it)"
+__license__ = "MIT"
+__version__ = "0.0.3"
+__email__ = "alberto@albertopettarin.it"
+__status__ = "Production"
+
+PLUGIN_XML = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "icarus", "plugin.xml")
+
+def get_icarus_version():
+    """
+    Return the version of icarus, as listed in plugin.xml.
+
+    :rtype: str
+    """
+    return ElementTree.parse(PLUGIN_XML).getroot().findtext("version")
+
+class Quiet(object):
+    """
+    Discard what is printed to stdout, within a with block.
+    """
+
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+
+
+class Context(object):
+    """
+    The inputs shared by the benchmarks:
+    the synthetic book, with and without MO attributes,
+    the preferences, and a temporary directory.
+
+    :param args: the command line arguments
+    :type  args: argparse.Namespace
+    :param directory: the temporary directory
+    :type  directory: str
+    """
+
+    def __init__(self, args, directory):
+        self.args = args
+        self.directory = directory
+        self.book = generate_book(
+            chapters=args.chapters,
+            paragraphs=args.paragraphs,
+            ids=args.ids,
+            classes=args.classes,
+            audio_size=args.audio_kb * 1024
+        )
+        self.prefs = Icarus.get_default_prefs()
+        self.prefs.update({
+            "engine": args.engine,
+            "workers": args.workers,
+            "cache_size": 0,
+            "save_directory": directory,
+        })
+        self.chapters = [(href, self.book.readfile(mid).encode("utf-8")) for mid, href in self.book.text_iter()]
+        self.moedit = MOEdit(
+            tags=self.prefs["tags"],
+            mo_class=self.prefs["mo_class"],
+            nomo_class=self.prefs["nomo_class"],
+            id_regex=self.prefs["id_regex"],
+            id_format=self.prefs["id_format"],
+            existing_ids_only=self.prefs["existing_ids_only"],
+            engine=self.prefs["engine"]
+        )
+        self.book_mo = self.book.copy()
+        with Quiet():
+            self.get_icarus(self.book_mo).add_remove(Icarus.OPERATION_ADD)
+
+    def get_icarus(self, bk):
+        return Icarus(bk, self.prefs, data_directory=self.directory)
+
+
+
+def bench_add_mo_attributes(context):
+    chapters = context.chapters
+    moedit = context.moedit
+    return lambda: [moedit.add_mo_attributes(data) for href, data in chapters]
+
+def bench_remove_mo_attributes(context):
+    chapters = [context.moedit.add_mo_attributes(data)[1].encode("utf-8") for href, data in context.chapters]
+    moedit = context.moedit
+    return lambda: [moedit.remove_mo_attributes(data) for data in chapters]
+
+def bench_create_aeneas_job(context):
+    icarus = context.get_icarus(context.book_mo)
+    with Quiet():
+        lines = ["%s <-> %s" % pair for pair in icarus.pair_files().pairs]
+    pairs = icarus.parse_pairs("\n".join(lines))
+    return lambda: icarus.create_aeneas_job(pairs)
+
+def bench_import_zip_file(context):
+    path = os.path.join(context.directory, "smil.zip")
+    if not os.path.exists(path):
+        pattern = re.compile(r'\bid="(%s)"' % (context.prefs["id_regex"]))
+        icarus = context.get_icarus(context.book_mo)
+        with Quiet():
+            pairs = icarus.pair_files().pairs
+        zip_obj = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+        try:
+            for t_href, a_href in pairs:
+                s_ids = pattern.findall(context.book_mo.readfile(context.book_mo.href_to_id(t_href)))
+                fragments = [(s_id, float(i), float(i + 1)) for i, s_id in enumerate(s_ids)]
+                zip_obj.writestr(AeneasJob.smil_name_from_t_href(t_href), build_smil(t_href, a_href, fragments))
+        finally:
+            zip_obj.close()
+    icarus = context.get_icarus(context.book_mo.copy())
+    return lambda: icarus.import_zip_file(path)
+
+def bench_populate_pairs(context):
+    icarus = context.get_icarus(context.book_mo)
+    def run():
+        pairing = icarus.pair_files()
+        lines = ["%s <-> %s" % (p[0], p[1]) for p in pairing.pairs]
+        lines.extend(["# %s" % (line) for line in pairing.get_report()])
+        return "\n".join(lines)
+    return run
+
+# each function returns the operation to be timed,
+# and is called again before each run
+BENCHMARKS = collections.OrderedDict([
+    ("add_mo_attributes", bench_add_mo_attributes),
+    ("remove_mo_attributes", bench_remove_mo_attributes),
+    ("create_aeneas_job", bench_create_aeneas_job),
+    ("import_zip_file", bench_import_zip_file),
+    ("populate_pairs", bench_populate_pairs),
+])
+
+def run_benchmark(function, context, repetitions):
+    """
+    Run the given benchmark the given number of times,
+    and return the list of the times, in seconds.
+
+    :rtype: list of float
+    """
+    times = []
+    for repetition in range(repetitions):
+        operation = function(context)
+        with Quiet():
+            start = time.time()
+            operation()
+            times.append(time.time() - start)
+    return times
+
+def compare(results, path):
+    """
+    Print the best times of the given results
+    against the ones in the JSON file at path.
+    """
+    with io.open(path, "rb") as file_obj:
+        old = json.loads(file_obj.read().decode("utf-8"))
+    print()
+    print("Compared with %s (icarus %s, %s)" % (path, old["version"], old["date"]))
+    if old["parameters"] != results["parameters"]:
+        print("WARNING: the parameters differ, the times might not be comparable")
+    for name, result in results["benchmarks"].items():
+        if name in old["benchmarks"]:
+            old_best = old["benchmarks"][name]["best"]
+            print("%-22s %10.3f ms -> %10.3f ms   %6.2fx" % (name, old_best * 1000, result["best"] * 1000, result["best"] / old_best))
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the icarus benchmarks on a synthetic book.")
+    parser.add_argument("--chapters", type=int, default=50, help="number of chapters (default: 50)")
+    parser.add_argument("--paragraphs", type=int, default=200, help="paragraphs per chapter (default: 200)")
+    parser.add_argument("--ids", type=float, default=0.0, help="fraction of elements with a pre-existing id (default: 0.0)")
+    parser.add_argument("--classes", type=float, default=0.0, help="fraction of elements with a pre-existing class (default: 0.0)")
+    parser.add_argument("--audio-kb", type=int, default=1024, help="size of each audio file, in KB (default: 1024)")
+    parser.add_argument("--repetitions", type=int, default=5, help="runs of each benchmark (default: 5)")
+    parser.add_argument("--workers", type=int, default=1, help="the workers preference (default: 1)")
+    parser.add_argument("--engine", default=MOEdit.ENGINE_STREAM, help="the MOEdit engine (default: %s)" % (MOEdit.ENGINE_STREAM))
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS.keys()), help="run only the given benchmarks")
+    parser.add_argument("--output", help="the JSON file of the results (default: icarus_benchmark_VERSION_DATE.json)")
+    parser.add_argument("--compare", help="a JSON file of previous results to compare with")
+    args = parser.parse_args()
+
+    results = collections.OrderedDict([
+        ("version", get_icarus_version()),
+        ("date", time.strftime("%Y%m%d_%H%M%S")),
+        ("python", platform.python_version()),
+        ("platform", platform.platform()),
+        ("parameters", collections.OrderedDict([
+            ("chapters", args.chapters),
+            ("paragraphs", args.paragraphs),
+            ("ids", args.ids),
+            ("classes", args.classes),
+            ("audio_kb", args.audio_kb),
+            ("repetitions", args.repetitions),
+            ("workers", args.workers),
+            ("engine", args.engine),
+        ])),
+        ("benchmarks", collections.OrderedDict()),
+    ])
+    directory = tempfile.mkdtemp()
+    try:
+        print("INFO: creating a synthetic book (%d chapters, %d paragraphs each)..." % (args.chapters, args.paragraphs))
+        context = Context(args, directory)
+        for name, function in BENCHMARKS.items():
+            if (args.only is not None) and (name not in args.only):
+                continue
+            times = run_benchmark(function, context, args.repetitions)
+            results["benchmarks"][name] = collections.OrderedDict([
+                ("best", min(times)),
+                ("mean", sum(times) / len(times)),
+                ("runs", times),
+            ])
+            print("%-22s best %10.3f ms   mean %10.3f ms" % (name, min(times) * 1000, sum(times) * 1000 / len(times)))
+    finally:
+        shutil.rmtree(directory)
+
+    output = args.output or "icarus_benchmark_%s_%s.json" % (results["version"], results["date"])
+    with io.open(output, "wb") as file_obj:
+        file_obj.write(json.dumps(results, indent=1).encode("utf-8"))
+    print("INFO: results written to '%s'" % (output))
+    if args.compare is not None:
+        compare(results, args.compare)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+Compare the soup and stream engines of MOEdit
+on a synthetic XHTML file.
+
+Usage:
+
+$ python benchmark/bench_moedit_engines.py [PARAGRAPHS] [REPETITIONS]
+
+The soup engine needs the sigil_gumbo_bs4_adapter module
+(e.g., run it with Sigil's bundled Python interpreter);
+if it is not available, only the stream engine is timed.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "icarus"))
+
+from moedit import MOEdit
+
+__author__ = "Alberto Pettarin"
+__copyright__ = "Copyright 2015-2016, Alberto Pettarin (www.albertopettarin.it)"
+__license__ = "MIT"
+__version__ = "0.0.3"
+__email__ = "alberto@albertopettarin.it"
+__status__ = "Production"
+
+XHTML_HEADER = """<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head>
+  <title>Chapter</title>
+  <link href="../Styles/style.css" type="text/css" rel="stylesheet"/>
+</head>
+<body>
+  <h1 class="chapter">Chapter</h1>
+"""
+XHTML_ROW = """  <p class="text">Paragraph %d, with <i>some</i> <span lang="la">emphasis</span><br/>and a line break.</p>
+"""
+XHTML_FOOTER = """</body>
+</html>
+"""
+
+def synthetic_xhtml(paragraphs):
+    """
+    Return a synthetic XHTML file with the given number of paragraphs,
+    encoded as UTF-8 bytes.
+
+    :param paragraphs: the number of paragraphs
+    :type  paragraphs: int
+    :rtype: bytes
+    """
+    rows = [XHTML_ROW % (i) for i in range(paragraphs)]
+    return (XHTML_HEADER + "".join(rows) + XHTML_FOOTER).encode("utf-8")
+
+def get_moedit(engine):
+    return MOEdit(
+        tags=["h1", "h2", "h3", "h4", "h5", "h6", "li", "p", "q"],
+        mo_class="mo",
+        nomo_class="nomo",
+        id_regex=r"f[0-9]{6}",
+        id_format="f%06d",
+        existing_ids_only=0,
+        engine=engine
+    )
+
+def main():
+    paragraphs = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repetitions = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    data = synthetic_xhtml(paragraphs)
+    engines = [MOEdit.ENGINE_STREAM]
+    try:
+        import sigil_gumbo_bs4_adapter
+        engines.append(MOEdit.ENGINE_SOUP)
+    except ImportError:
+        print("INFO: sigil_gumbo_bs4_adapter not available, skipping the soup engine")
+    print("INFO: %d paragraphs, %d bytes, best of %d runs" % (paragraphs, len(data), repetitions))
+    for engine in engines:
+        moedit = get_moedit(engine)
+        added = moedit.add_mo_attributes(data)[1].encode("utf-8")
+        add_time = min(timeit.repeat(lambda: moedit.add_mo_attributes(data), number=1, repeat=repetitions))
+        remove_time = min(timeit.repeat(lambda: moedit.remove_mo_attributes(added), number=1, repeat=repetitions))
+        print("%-8s add: %8.3f ms   remove: %8.3f ms" % (engine, add_time * 1000, remove_time * 1000))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+Measure MOEdit.add_mo_attributes() on a synthetic XHTML file,
+with the compiled MORules and with the set-based
+element checks used before MORules
+(tag name lookup in a list, a new set of classes
+for each "MO"/"no MO" class check).
+
+Both variants run the real MOEdit code, with the stream engine:
+the set-based one only replaces the rules of the MOEdit object,
+so the difference is the cost of the element checks.
+
+Usage:
+
+$ python benchmark/bench_moedit_rules.py [PARAGRAPHS] [REPETITIONS]
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "icarus"))
+
+from bench_moedit_engines import synthetic_xhtml
+from moedit import MOEdit
+
+__author__ = "Alberto Pettarin"
+__copyright__ = "Copyright 2015-2016, Alberto Pettarin (www.albertopettarin.it)"
+__license__ = "MIT"
+__version__ = "0.0.3"
+__email__ = "alberto@albertopettarin.it"
+__status__ = "Production"
+
+TAGS = ["h1", "h2", "h3", "h4", "h5", "h6", "li", "p", "q"]
+MO_CLASS = "mo"
+NOMO_CLASS = "nomo"
+ID_REGEX = r"f[0-9]{6}"
+ID_FORMAT = "f%06d"
+
+class SetRules(object):
+    """
+    The same interface of MORules, implemented
+    with the set-based checks used before MORules.
+    """
+
+    def __init__(self, tags, mo_class, nomo_class, id_regex):
+        self.tags = list(tags)
+        self.mo_class = mo_class
+        self.nomo_class = nomo_class
+        self.id_pattern = re.compile(id_regex)
+
+    @classmethod
+    def get_classes(cls, elem):
+        classes = []
+        if "class" in elem.attrs:
+            classes = elem.attrs["class"]
+            if not isinstance(classes, list):
+                classes = [classes]
+        return set(classes)
+
+    def classify(self, elem):
+        # one set per check, as has_mo_class() and has_nomo_class() did
+        has_mo = self.mo_class in self.get_classes(elem)
+        has_nomo = self.nomo_class in self.get_classes(elem)
+        return (list(self.get_classes(elem)), has_mo, has_nomo)
+
+
+
+def get_moedit(rules):
+    moedit = MOEdit(TAGS, MO_CLASS, NOMO_CLASS, ID_REGEX, ID_FORMAT, 0, engine=MOEdit.ENGINE_STREAM)
+    if rules == "sets":
+        moedit.rules = SetRules(TAGS, MO_CLASS, NOMO_CLASS, ID_REGEX)
+    return moedit
+
+def best_time(rules, data, repetitions):
+    best = None
+    for repetition in range(repetitions):
+        moedit = get_moedit(rules)
+        start = time.time()
+        moedit.add_mo_attributes(data)
+        elapsed = time.time() - start
+        if (best is None) or (elapsed < best):
+            best = elapsed
+    return (best, moedit.touched)
+
+def main():
+    paragraphs = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    repetitions = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    data = synthetic_xhtml(paragraphs)
+    print("INFO: %d paragraphs, best of %d runs" % (paragraphs, repetitions))
+    for rules in ["sets", "rules"]:
+        elapsed, count = best_time(rules, data, repetitions)
+        print("%-6s %8.3f ms   %6.3f us/element" % (rules, elapsed * 1000, elapsed * 1000000 / count))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
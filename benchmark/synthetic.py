@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+Synthetic books for the benchmarks, so that icarus
+can be measured without a real Sigil book.
+
+generate_book() returns a MemoryBookContainer,
+that is, an in-memory replacement for the Sigil BookContainer,
+holding a book with the given number of chapters,
+paragraphs per chapter, pre-existing id/class attributes,
+and size of the (dummy) audio file paired with each chapter.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import hashlib
+import io
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "icarus"))
+
+from bookcontainer import EpubBookContainer
+
+__author__ = "Alberto Pettarin"
+__copyright__ = "Copyright 2015-2016, Alberto Pettarin (www.albertopettarin.it)"
+__license__ = "MIT"
+__version__ = "0.0.3"
+__email__ = "alberto@albertopettarin.it"
+__status__ = "Production"
+
+CONTAINER = b"""<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+OPF = """<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" unique-identifier="BookId" version="3.0">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:identifier id="BookId">%s</dc:identifier>
+    <dc:title>Synthetic Book</dc:title>
+    <dc:language>en</dc:language>
+    <meta property="dcterms:modified">2016-01-01T00:00:00Z</meta>
+  </metadata>
+  <manifest>
+%s
+  </manifest>
+  <spine>
+%s
+  </spine>
+</package>
+"""
+OPF_ITEM = """    <item href="%s" id="%s" media-type="%s"/>"""
+OPF_ITEMREF = """    <itemref idref="%s"/>"""
+
+XHTML_HEADER = """<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">
+<head>
+  <title>Chapter %d</title>
+  <link href="../Styles/style.css" type="text/css" rel="stylesheet"/>
+</head>
+<body>
+  <h1%s>Chapter %d</h1>
+"""
+XHTML_ROW = """  <p%s>Paragraph %d of chapter %d, with <i>some</i> <span lang="la">emphasis</span><br/>and a line break.</p>
+"""
+XHTML_FOOTER = """</body>
+</html>
+"""
+
+# the pre-existing class values, one of which is
+# given to the elements with a pre-existing class
+CLASSES = ["text", "text mo", "nomo"]
+
+# the format of the pre-existing id values,
+# matching the default id regex of icarus
+ID_FORMAT = "f%06d"
+
+AUDIO_BLOCK_SIZE = 64 * 1024
+
+def text_href(chapter):
+    return "Text/c%04d.xhtml" % (chapter)
+
+def audio_href(chapter):
+    return "Audio/c%04d.mp3" % (chapter)
+
+class MemoryBookContainer(EpubBookContainer):
+    """
+    An EpubBookContainer holding the files of the book in memory,
+    as a dict mapping each book path to its contents,
+    so that the benchmarks measure icarus, not the disk.
+
+    As the files are not on disk, the book has no root directory.
+
+    :param files: the files of the book, by book path
+    :type  files: dict
+    """
+
+    def __init__(self, files):
+        self.files = files
+        super(MemoryBookContainer, self).__init__(None)
+
+    def copy(self):
+        """
+        Return a copy of this book,
+        with the changes saved so far.
+
+        :rtype: MemoryBookContainer
+        """
+        self.save()
+        return MemoryBookContainer(dict(self.files))
+
+    def get_path(self, bookpath):
+        return None
+
+    def read_bookpath(self, bookpath):
+        return self.files[bookpath]
+
+    def open_bookpath(self, bookpath):
+        return io.BytesIO(self.files[bookpath])
+
+    def write_bookpath(self, bookpath, data):
+        self.files[bookpath] = data
+
+    def delete_bookpath(self, bookpath):
+        self.files.pop(bookpath, None)
+
+
+
+def synthetic_xhtml(chapter, paragraphs, ids, classes, rnd, counter):
+    """
+    Return a synthetic XHTML file with a heading
+    and the given number of paragraphs, encoded as UTF-8 bytes.
+
+    Each element has a pre-existing id with probability ids,
+    and a pre-existing class with probability classes.
+
+    :param chapter: the number of the chapter
+    :type  chapter: int
+    :param paragraphs: the number of paragraphs
+    :type  paragraphs: int
+    :param ids: the fraction of elements with an id
+    :type  ids: float
+    :param classes: the fraction of elements with a class
+    :type  classes: float
+    :param rnd: the random generator
+    :type  rnd: random.Random
+    :param counter: the next id value, in a one-element list,
+                    so that id values are unique in the book
+    :type  counter: list of int
+    :rtype: bytes
+    """
+    def attributes():
+        attrs = ""
+        if rnd.random() < ids:
+            attrs += ' id="%s"' % (ID_FORMAT % (counter[0]))
+            counter[0] += 1
+        if rnd.random() < classes:
+            attrs += ' class="%s"' % (rnd.choice(CLASSES))
+        return attrs
+
+    rows = [XHTML_HEADER % (chapter, attributes(), chapter)]
+    for i in range(paragraphs):
+        rows.append(XHTML_ROW % (attributes(), i, chapter))
+    rows.append(XHTML_FOOTER)
+    return "".join(rows).encode("utf-8")
+
+def synthetic_audio(size, rnd):
+    """
+    Return size bytes of dummy (random) audio data.
+
+    :param size: the size, in bytes
+    :type  size: int
+    :param rnd: the random generator
+    :type  rnd: random.Random
+    :rtype: bytes
+    """
+    block = bytearray(rnd.getrandbits(8) for i in range(min(size, AUDIO_BLOCK_SIZE)))
+    return bytes((block * (size // AUDIO_BLOCK_SIZE + 1))[:size])
+
+def generate_book(chapters=50, paragraphs=200, ids=0.0, classes=0.0, audio_size=1024 * 1024, seed=42):
+    """
+    Return a synthetic book, with one XHTML file per chapter,
+    each paired (by name) with an MP3 file of audio_size bytes.
+
+    The book is fully determined by the arguments,
+    including its dc:identifier.
+
+    :param chapters: the number of chapters
+    :type  chapters: int
+    :param paragraphs: the number of paragraphs per chapter
+    :type  paragraphs: int
+    :param ids: the fraction of elements with a pre-existing id
+    :type  ids: float
+    :param classes: the fraction of elements with a pre-existing class
+    :type  classes: float
+    :param audio_size: the size of each audio file, in bytes
+    :type  audio_size: int
+    :param seed: the seed of the random generator
+    :type  seed: int
+    :rtype: MemoryBookContainer
+    """
+    rnd = random.Random(seed)
+    counter = [1]
+    files = {
+        "mimetype": b"application/epub+zip",
+        "META-INF/container.xml": CONTAINER,
+        "OEBPS/Styles/style.css": b"p { text-indent: 1em; }\n",
+    }
+    items = [OPF_ITEM % ("Styles/style.css", "style.css", "text/css")]
+    itemrefs = []
+    audio = synthetic_audio(audio_size, rnd)
+    for chapter in range(1, chapters + 1):
+        t_href = text_href(chapter)
+        a_href = audio_href(chapter)
+        files["OEBPS/" + t_href] = synthetic_xhtml(chapter, paragraphs, ids, classes, rnd, counter)
+        files["OEBPS/" + a_href] = audio
+        items.append(OPF_ITEM % (t_href, t_href.split("/")[-1], "application/xhtml+xml"))
+        items.append(OPF_ITEM % (a_href, a_href.split("/")[-1], "audio/mpeg"))
+        itemrefs.append(OPF_ITEMREF % (t_href.split("/")[-1]))
+    key = "%d-%d-%s-%s-%d-%d" % (chapters, paragraphs, ids, classes, audio_size, seed)
+    identifier = "urn:sha1:%s" % (hashlib.sha1(key.encode("utf-8")).hexdigest())
+    opf = OPF % (identifier, "\n".join(items), "\n".join(itemrefs))
+    files["OEBPS/content.opf"] = opf.encode("utf-8")
+    return MemoryBookContainer(files)
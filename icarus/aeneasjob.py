@@ -0,0 +1,562 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+from __future__ import absolute_import
+from __future__ import print_function
+import collections
+import hashlib
+import io
+import json
+import os
+import shutil
+import time
+import zipfile
+from multiprocessing.pool import ThreadPool
+
+from epub_utils import compress_type_for
+from epub_utils import zip_compress
+from epub_utils import zip_write_raw
+
+__author__ = "Alberto Pettarin"
+__copyright__ = "Copyright 2015-2016, Alberto Pettarin (www.albertopettarin.it)"
+__license__ = "MIT"
+__version__ = "0.0.3"
+__email__ = "alberto@albertopettarin.it"
+__status__ = "Production"
+
+# size of the chunks used to copy audio files into the ZIP file
+CHUNK_SIZE = 1024 * 1024
+
+def file_extension(href):
+    """
+    Return the file extension (including the leading ".")
+    of the file pointed by the given href path,
+    or "" if the given href does not have an extension.
+    For example, "audio.mp3" produces ".mp3",
+    while "audio" returns "".
+
+    :param href: a file path
+    :type  href: str
+    :rtype: str
+    """
+    base = os.path.basename(href)
+    if "." in base:
+        return ".%s" % base.split(".")[-1]
+    return ""
+
+def get_file_path(bk, mid):
+    """
+    Return the path on disk of the book file with the given
+    manifest id, or None if it cannot be determined.
+
+    The Sigil plugin API does not expose it directly,
+    so this relies on the book root directory of the wrapper.
+
+    :param bk: the book container
+    :type  bk: BookContainer
+    :param mid: the manifest id
+    :type  mid: str
+    :rtype: str
+    """
+    root = getattr(getattr(bk, "_w", None), "ebook_root", None)
+    if root is None:
+        return None
+    if hasattr(bk, "id_to_bookpath"):
+        path = os.path.join(root, bk.id_to_bookpath(mid))
+    else:
+        path = os.path.join(root, "OEBPS", bk.id_to_href(mid))
+    if os.path.isfile(path):
+        return path
+    return None
+
+def open_file(bk, mid):
+    """
+    Return a binary file object reading the book file
+    with the given manifest id, or None if the book
+    container can only return its contents as a whole.
+
+    The file is opened from disk, if its path is known,
+    otherwise through the openfile() method of the book
+    container, which is not part of the Sigil plugin API,
+    but is provided by the containers of bookcontainer.py.
+
+    :param bk: the book container
+    :type  bk: BookContainer
+    :param mid: the manifest id
+    :type  mid: str
+    :rtype: file
+    """
+    path = get_file_path(bk, mid)
+    if path is not None:
+        return open(path, "rb")
+    if hasattr(bk, "openfile"):
+        return bk.openfile(mid)
+    return None
+
+class HashingReader(object):
+    """
+    A binary file object wrapper, updating the given
+    hash object with the bytes read from it.
+
+    :param file_obj: the binary file object
+    :type  file_obj: file
+    :param ctx: the hash object (e.g., hashlib.sha1())
+    :type  ctx: object
+    """
+
+    def __init__(self, file_obj, ctx):
+        self.file_obj = file_obj
+        self.ctx = ctx
+
+    def read(self, size=-1):
+        data = self.file_obj.read(size)
+        self.ctx.update(data)
+        return data
+
+
+
+def write_file_chunked(zip_obj, arcname, path, compress_type, chunk_size=CHUNK_SIZE, ctx=None):
+    """
+    Copy the file at path into zip_obj, as arcname,
+    reading it in chunks of chunk_size bytes.
+    If ctx is not None, it is updated with the contents of the file.
+
+    :param zip_obj: the ZIP file, open for writing
+    :type  zip_obj: zipfile.ZipFile
+    :param arcname: the name of the entry
+    :type  arcname: str
+    :param path: the path of the file to be copied
+    :type  path: str
+    :param compress_type: the ZIP compression method
+    :type  compress_type: int
+    :param chunk_size: the size of the chunks, in bytes
+    :type  chunk_size: int
+    :param ctx: the hash object to be updated, if any
+    :type  ctx: object
+    """
+    try:
+        zinfo = zipfile.ZipInfo.from_file(path, arcname)
+    except AttributeError:
+        # Python < 3.6: ZipFile.write() copies in (smaller) chunks as well
+        zip_obj.write(path, arcname, compress_type)
+        if ctx is not None:
+            with open(path, "rb") as src:
+                src = HashingReader(src, ctx)
+                while len(src.read(chunk_size)) > 0:
+                    pass
+        return
+    zinfo.compress_type = compress_type
+    with open(path, "rb") as src:
+        if ctx is not None:
+            src = HashingReader(src, ctx)
+        with zip_obj.open(zinfo, "w", force_zip64=True) as dst:
+            shutil.copyfileobj(src, dst, chunk_size)
+
+def write_fileobj_chunked(zip_obj, arcname, file_obj, compress_type, chunk_size=CHUNK_SIZE, ctx=None):
+    """
+    Copy the contents of file_obj into zip_obj, as arcname,
+    reading it in chunks of chunk_size bytes.
+    If ctx is not None, it is updated with the contents of file_obj.
+
+    :param zip_obj: the ZIP file, open for writing
+    :type  zip_obj: zipfile.ZipFile
+    :param arcname: the name of the entry
+    :type  arcname: str
+    :param file_obj: the binary file object to be copied
+    :type  file_obj: file
+    :param compress_type: the ZIP compression method
+    :type  compress_type: int
+    :param chunk_size: the size of the chunks, in bytes
+    :type  chunk_size: int
+    :param ctx: the hash object to be updated, if any
+    :type  ctx: object
+    """
+    if ctx is not None:
+        file_obj = HashingReader(file_obj, ctx)
+    if not hasattr(zipfile.ZipInfo, "from_file"):
+        # Python < 3.6: ZipFile.open() cannot write
+        zip_obj.writestr(arcname, file_obj.read(), compress_type)
+        return
+    zinfo = zipfile.ZipInfo(arcname, date_time=time.localtime(time.time())[:6])
+    zinfo.compress_type = compress_type
+    with zip_obj.open(zinfo, "w", force_zip64=True) as dst:
+        shutil.copyfileobj(file_obj, dst, chunk_size)
+
+
+
+class JobManifest(object):
+    """
+    The content hashes of the (text, audio) pairs
+    of the previous exports of a book,
+    stored as a JSON file at the given path.
+
+    :param path: the path of the manifest file
+    :type  path: str
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hashes = {}
+        try:
+            with io.open(self.path, "r", encoding="utf-8") as file_obj:
+                self.hashes = json.load(file_obj)
+        except (IOError, OSError, ValueError):
+            pass
+
+    @classmethod
+    def get_key(cls, task):
+        """
+        Return the manifest key of the given task.
+
+        :param task: the task
+        :type  task: dict
+        :rtype: str
+        """
+        return "%s <-> %s" % (task["t_href"], task["a_href"])
+
+    def is_changed(self, task, pair_hash):
+        """
+        Return True if the given task has a hash
+        different from the one recorded in the manifest,
+        or if it was not exported before.
+
+        :param task: the task
+        :type  task: dict
+        :param pair_hash: the current hash of the task files
+        :type  pair_hash: str
+        :rtype: bool
+        """
+        return self.hashes.get(self.get_key(task)) != pair_hash
+
+    def update(self, task, pair_hash):
+        """
+        Record the hash of the given task.
+
+        :param task: the task
+        :type  task: dict
+        :param pair_hash: the current hash of the task files
+        :type  pair_hash: str
+        """
+        self.hashes[self.get_key(task)] = pair_hash
+
+    def save(self):
+        """
+        Save the manifest to its file.
+        """
+        directory = os.path.dirname(self.path)
+        if (len(directory) > 0) and (not os.path.isdir(directory)):
+            os.makedirs(directory)
+        with io.open(self.path, "wb") as file_obj:
+            file_obj.write(json.dumps(self.hashes, indent=1, sort_keys=True).encode("utf-8"))
+
+
+
+class AeneasJob(object):
+    """
+    An aeneas job, built from (text, audio) pairs of a book.
+
+    :param bk: the book container
+    :type  bk: BookContainer
+    :param pairs: the list of ((t_href, t_mid), (a_href, a_mid)) pairs
+    :type  pairs: list
+    :param language: the language of the job and of its tasks
+    :type  language: str
+    :param mo_class: the value of the MO class
+    :type  mo_class: str
+    :param smil_directory: the directory of the SMIL files in the book
+    :type  smil_directory: str
+    """
+
+    CONFIG_NAME = "config.xml"
+
+    def __init__(self, bk, pairs, language, mo_class, smil_directory):
+        self.bk = bk
+        self.pairs = pairs
+        self.language = language
+        self.mo_class = mo_class
+        self.smil_directory = smil_directory
+
+    @classmethod
+    def smil_name_from_t_href(cls, t_href):
+        """
+        Return the name for the SMIL file associated with
+        a text file with path t_href.
+
+        :param t_href: the path of the text file
+        :type  t_href: str
+        :rtype: str
+        """
+        return os.path.basename(t_href).replace(".xhtml", "") + ".smil"
+
+    def get_tasks(self):
+        """
+        Return the list of tasks of the job,
+        each being a dict with the names of its files
+        in the ZIP file and in the book.
+
+        :rtype: list of dict
+        """
+        tasks = []
+        i = 1
+        for pair in self.pairs:
+            (t_href, t_mid), (a_href, a_mid) = pair
+            tasks.append({
+                "t_href": t_href,
+                "t_mid": t_mid,
+                "t_name": "t%06d.xhtml" % (i),
+                "a_href": a_href,
+                "a_mid": a_mid,
+                "a_name": "a%06d%s" % (i, file_extension(a_href)),
+                "s_name": self.smil_name_from_t_href(t_href),
+            })
+            i += 1
+        return tasks
+
+    def get_config(self, tasks, output_name):
+        """
+        Return the contents of the config.xml file
+        for the given tasks, as UTF-8 bytes.
+
+        :param tasks: the tasks, as returned by get_tasks()
+        :type  tasks: list of dict
+        :param output_name: the name of the output ZIP file computed by aeneas
+        :type  output_name: str
+        :rtype: bytes
+        """
+        config = []
+        config.append('<?xml version = "1.0" encoding="UTF-8" standalone="no"?>')
+        config.append('<job>')
+        config.append(' <job_language>%s</job_language>' % (self.language))
+        config.append(' <job_description>Job from Sigil</job_description>')
+        config.append(' <os_job_file_name>%s</os_job_file_name>' % (output_name))
+        config.append(' <os_job_file_container>zip</os_job_file_container>')
+        config.append(' <os_job_file_hierarchy_type>flat</os_job_file_hierarchy_type>')
+        config.append(' <os_job_file_hierarchy_prefix>OEBPS/%s</os_job_file_hierarchy_prefix>' % (self.smil_directory))
+        config.append(' <tasks>')
+        for task in tasks:
+            config.append('  <task>')
+            config.append('   <task_language>%s</task_language>' % (self.language))
+            config.append('   <task_description>Task %s</task_description>' % (task["t_name"]))
+            config.append('   <task_custom_id>%s</task_custom_id>' % (task["t_name"]))
+            config.append('   <is_text_file>%s</is_text_file>' % (task["t_name"]))
+            config.append('   <is_text_type>unparsed</is_text_type>')
+            # NOTE not specifying the id regex, to allow pre-existing ids
+            #      aeneas will select fragments using the MO class alone
+            #config.append('   <is_text_unparsed_id_regex>%s</is_text_unparsed_id_regex>' % (self.prefs["id_regex"]))
+            # NOTE elements with multiple classes (with one of them being the MO class)
+            #      are handled by aeneas as well
+            config.append('   <is_text_unparsed_class_regex>%s</is_text_unparsed_class_regex>' % (self.mo_class))
+            # NOTE specifying unsorted to allow pre-existing ids
+            #      that might be get shuffled by numeric or lexicographic
+            config.append('   <is_text_unparsed_id_sort>unsorted</is_text_unparsed_id_sort>')
+            config.append('   <is_audio_file>%s</is_audio_file>' % (task["a_name"]))
+            config.append('   <os_task_file_name>%s</os_task_file_name>' % (task["s_name"]))
+            config.append('   <os_task_file_format>smil</os_task_file_format>')
+            config.append('   <os_task_file_smil_page_ref>../%s</os_task_file_smil_page_ref>' % (task["t_href"]))
+            config.append('   <os_task_file_smil_audio_ref>../%s</os_task_file_smil_audio_ref>' % (task["a_href"]))
+            config.append('  </task>')
+        config.append(' </tasks>')
+        config.append('</job>')
+        return "\n".join(config).encode("utf-8")
+
+    def read_task(self, task):
+        """
+        Read the files of the given task from the book,
+        deflate the text file,
+        and return a (task, t_data, t_member, a_path, a_data, elapsed) tuple,
+        where t_data is the text file encoded as UTF-8,
+        t_member is the (zinfo, compressed) tuple of the text file,
+        as returned by zip_compress(),
+        a_path is the path of the audio file on disk (if known),
+        a_data is the contents of the audio file (only if a_path
+        is None and the book container cannot stream it),
+        and elapsed is the time spent reading and deflating, in seconds.
+
+        This method can be called from a reader thread,
+        so that the text files are deflated in parallel.
+
+        :param task: the task
+        :type  task: dict
+        :rtype: tuple
+        """
+        start = time.time()
+        t_data = self.bk.readfile(task["t_mid"]).encode("utf-8")
+        t_member = zip_compress((task["t_name"], t_data, zipfile.ZIP_DEFLATED, None))
+        a_path = get_file_path(self.bk, task["a_mid"])
+        a_data = None
+        if (a_path is None) and (not hasattr(self.bk, "openfile")):
+            a_data = self.bk.readfile(task["a_mid"])
+        return (task, t_data, t_member, a_path, a_data, time.time() - start)
+
+    def new_hash(self, t_data):
+        """
+        Return a SHA-1 hash object, updated with
+        the job parameters affecting the output of a task
+        and with the given text file, to be updated
+        with the contents of its audio file.
+
+        :param t_data: the text file, encoded as UTF-8
+        :type  t_data: bytes
+        :rtype: object
+        """
+        ctx = hashlib.sha1()
+        ctx.update(("%s\n%s\n" % (self.language, self.mo_class)).encode("utf-8"))
+        ctx.update(t_data)
+        ctx.update(b"\x00")
+        return ctx
+
+    def hash_task(self, task):
+        """
+        Return the SHA-1 hex digest of the files of the given task,
+        and of the job parameters affecting its output.
+
+        This method can be called from a reader thread.
+
+        :param task: the task
+        :type  task: dict
+        :rtype: str
+        """
+        ctx = self.new_hash(self.bk.readfile(task["t_mid"]).encode("utf-8"))
+        file_obj = open_file(self.bk, task["a_mid"])
+        if file_obj is not None:
+            with file_obj:
+                while True:
+                    chunk = file_obj.read(CHUNK_SIZE)
+                    if len(chunk) == 0:
+                        break
+                    ctx.update(chunk)
+        else:
+            ctx.update(self.bk.readfile(task["a_mid"]))
+        return ctx.hexdigest()
+
+    def hash_tasks(self, tasks, readers=0):
+        """
+        Return the list of the hashes of the given tasks,
+        computed by hash_task(), by a pool of reader threads
+        if readers is positive.
+
+        :param tasks: the tasks
+        :type  tasks: list of dict
+        :param readers: the number of reader threads
+        :type  readers: int
+        :rtype: list of str
+        """
+        if readers <= 0:
+            return [self.hash_task(task) for task in tasks]
+        pool = ThreadPool(processes=readers)
+        try:
+            return pool.map(self.hash_task, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    def iter_read_tasks(self, tasks, readers):
+        """
+        Yield the result of read_task() for each of the given tasks,
+        in order.
+
+        If readers is positive, the tasks are read
+        by a pool of reader threads, at most
+        2 * readers tasks ahead of the consumer,
+        so that reading overlaps with writing
+        while keeping memory usage bounded.
+
+        :param tasks: the tasks
+        :type  tasks: list of dict
+        :param readers: the number of reader threads
+        :type  readers: int
+        :rtype: generator of tuple
+        """
+        if readers <= 0:
+            for task in tasks:
+                yield self.read_task(task)
+            return
+        pool = ThreadPool(processes=readers)
+        try:
+            pending = collections.deque()
+            for task in tasks:
+                pending.append(pool.apply_async(self.read_task, (task,)))
+                if len(pending) > 2 * readers:
+                    yield pending.popleft().get()
+            while len(pending) > 0:
+                yield pending.popleft().get()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def write_zip(self, zip_path, output_name, readers=0, tasks=None, hashes=None):
+        """
+        Write the job ZIP file to zip_path,
+        and return a dict with the time spent
+        in each export stage, in seconds:
+        "read" (reading the book files and deflating the text files,
+        summed over the readers),
+        "wait" (the writer waiting for the readers),
+        "write_text", "write_audio", "write_config"
+        (writing the entries into the ZIP file), and "total".
+
+        The text files are deflated by read_task(),
+        hence by the reader threads, if any,
+        and appended to the ZIP file as they are.
+        Already compressed media are stored, not deflated.
+        Audio files that can be located on disk, or streamed
+        by the book container, are copied in chunks,
+        the others are read through the book container.
+
+        If hashes is not None, the hash of each task,
+        as returned by hash_task(), is appended to it,
+        computed from the data written into the ZIP file,
+        so that the files are read only once.
+
+        :param zip_path: the path of the ZIP file to be created
+        :type  zip_path: str
+        :param output_name: the name of the output ZIP file computed by aeneas
+        :type  output_name: str
+        :param readers: the number of reader threads
+                        (if 0, read the files in the writer thread)
+        :type  readers: int
+        :param tasks: the tasks to be included in the job,
+                      as returned by get_tasks() (default: all)
+        :type  tasks: list of dict
+        :param hashes: if not None, the list the task hashes are appended to
+        :type  hashes: list of str
+        :rtype: dict
+        """
+        timings = dict((stage, 0.0) for stage in ["read", "wait", "write_text", "write_audio", "write_config", "total"])
+        total_start = time.time()
+        if tasks is None:
+            tasks = self.get_tasks()
+        zip_obj = zipfile.ZipFile(zip_path, mode="w", allowZip64=True)
+        try:
+            start = time.time()
+            for task, t_data, t_member, a_path, a_data, elapsed in self.iter_read_tasks(tasks, readers):
+                timings["wait"] += time.time() - start
+                timings["read"] += elapsed
+                start = time.time()
+                zinfo, compressed = t_member
+                zip_write_raw(zip_obj, zinfo, [compressed])
+                timings["write_text"] += time.time() - start
+                start = time.time()
+                ctx = self.new_hash(t_data) if hashes is not None else None
+                compress_type = compress_type_for(task["a_href"])
+                if a_path is not None:
+                    write_file_chunked(zip_obj, task["a_name"], a_path, compress_type, ctx=ctx)
+                elif a_data is None:
+                    with self.bk.openfile(task["a_mid"]) as file_obj:
+                        write_fileobj_chunked(zip_obj, task["a_name"], file_obj, compress_type, ctx=ctx)
+                else:
+                    zip_obj.writestr(task["a_name"], a_data, compress_type)
+                    if ctx is not None:
+                        ctx.update(a_data)
+                if ctx is not None:
+                    hashes.append(ctx.hexdigest())
+                timings["write_audio"] += time.time() - start
+                start = time.time()
+            start = time.time()
+            zip_obj.writestr(self.CONFIG_NAME, self.get_config(tasks, output_name), zipfile.ZIP_DEFLATED)
+            timings["write_config"] += time.time() - start
+        finally:
+            zip_obj.close()
+        timings["total"] = time.time() - total_start
+        return timings
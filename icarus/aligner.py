@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+
+from compatibility_utils import unicode_str
+from smilfile import build_smil
+from tagscanner import iter_start_tags
+
+__author__ = "Alberto Pettarin"
+__copyright__ = "Copyright 2015-2016, Alberto Pettarin (www.albertopettarin.it)"
+__license__ = "MIT"
+__version__ = "0.0.3"
+__email__ = "alberto@albertopettarin.it"
+__status__ = "Production"
+
+class Aligner(object):
+    """
+    A forced aligner, computing the time interval
+    of each MO element of a text file in an audio file.
+
+    Subclasses must set NAME and implement align().
+    """
+
+    NAME = None
+
+    def align(self, task):
+        """
+        Align the given task, and return the list
+        of (identifier, begin, end) fragments,
+        with begin and end in seconds, in document order.
+
+        task is a dict with keys:
+        "language", "mo_class",
+        "ids" (the ids of the MO elements, in document order),
+        "t_data" (the XHTML code, as str),
+        "a_path" (the path of the audio file, or None)
+        and "a_data" (the audio bytes, if a_path is None).
+
+        :param task: the task
+        :type  task: dict
+        :rtype: list of tuple
+        """
+        raise NotImplementedError()
+
+
+
+class StubAligner(Aligner):
+    """
+    An aligner which does not look at the audio,
+    and gives each MO element a clip of fixed duration.
+    Useful to test the alignment workflow.
+
+    :param duration: the duration of each clip, in seconds
+    :type  duration: float
+    """
+
+    NAME = "stub"
+
+    def __init__(self, duration=1.0):
+        self.duration = duration
+
+    def align(self, task):
+        return [(identifier, i * self.duration, (i + 1) * self.duration) for i, identifier in enumerate(task["ids"])]
+
+
+
+class AeneasAligner(Aligner):
+    """
+    An aligner calling the aeneas library in this process,
+    with the same settings used in the aeneas job ZIP file.
+
+    The audio file is read in place, if the book is unpacked
+    on disk, instead of being copied to a job ZIP file
+    and back; the XHTML code is written to a temporary file,
+    as aeneas reads text from files only.
+    """
+
+    NAME = "aeneas"
+
+    def align(self, task):
+        from aeneas.executetask import ExecuteTask
+        from aeneas.task import Task
+        config_string = "|".join([
+            "task_language=%s" % (task["language"]),
+            "is_text_type=unparsed",
+            "is_text_unparsed_class_regex=%s" % (task["mo_class"]),
+            "is_text_unparsed_id_sort=unsorted",
+            "os_task_file_format=smil",
+        ])
+        tmp_directory = tempfile.mkdtemp()
+        try:
+            t_path = os.path.join(tmp_directory, "text.xhtml")
+            with open(t_path, "wb") as file_obj:
+                file_obj.write(task["t_data"].encode("utf-8"))
+            a_path = task["a_path"]
+            if a_path is None:
+                a_path = os.path.join(tmp_directory, "audio")
+                with open(a_path, "wb") as file_obj:
+                    file_obj.write(task["a_data"])
+            aeneas_task = Task(config_string=config_string)
+            aeneas_task.text_file_path_absolute = t_path
+            aeneas_task.audio_file_path_absolute = a_path
+            ExecuteTask(aeneas_task).execute()
+            if hasattr(aeneas_task, "sync_map_leaves"):
+                leaves = aeneas_task.sync_map_leaves()
+            else:
+                leaves = aeneas_task.sync_map.fragments
+            ids = set(task["ids"])
+            fragments = []
+            for leaf in leaves:
+                identifier = leaf.text_fragment.identifier
+                if identifier in ids:
+                    fragments.append((identifier, float(leaf.begin), float(leaf.end)))
+            return fragments
+        finally:
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+
+
+
+ALIGNERS = dict((cls.NAME, cls) for cls in [AeneasAligner, StubAligner])
+
+def get_aligner(name):
+    """
+    Return a new instance of the aligner with the given name,
+    or None if there is no such aligner.
+
+    :param name: the name of the aligner
+    :type  name: str
+    :rtype: Aligner
+    """
+    cls = ALIGNERS.get(name)
+    if cls is None:
+        return None
+    return cls()
+
+
+def get_mo_ids(data, mo_class):
+    """
+    Return the list of the id values of the elements
+    having the given MO class, in document order.
+
+    :param data: the XHTML code
+    :type  data: str
+    :param mo_class: the value of the MO class
+    :type  mo_class: str
+    :rtype: list of str
+    """
+    ids = []
+    for tag in iter_start_tags(unicode_str(data)):
+        if ("id" in tag.attrs) and (mo_class in tag.attrs.get("class", [])):
+            ids.append(tag.attrs["id"])
+    return ids
+
+
+def align_pair(job):
+    """
+    Align a (text, audio) pair, as described by job,
+    and return the resulting (msgs, s_name, smil_data) tuple,
+    where smil_data is None if the alignment failed.
+
+    This function is defined at module level, so that it can be
+    sent to the worker processes of a multiprocessing pool.
+    It does not access the Sigil book container.
+
+    :param job: an (aligner_name, task) tuple, where task is
+                a dict as described in Aligner.align(),
+                plus the "t_href", "a_href" and "s_name" keys
+    :type  job: tuple
+    :rtype: tuple
+    """
+    aligner_name, task = job
+    msgs = []
+    aligner = get_aligner(aligner_name)
+    if aligner is None:
+        msgs.append(("ERROR", "unknown aligner '%s'" % (aligner_name)))
+        return (msgs, task["s_name"], None)
+    task = dict(task)
+    task["ids"] = get_mo_ids(task["t_data"], task["mo_class"])
+    if len(task["ids"]) == 0:
+        msgs.append(("ERROR", "no MO elements in file '%s'" % (task["t_href"])))
+        return (msgs, task["s_name"], None)
+    try:
+        fragments = aligner.align(task)
+    except Exception as exc:
+        msgs.append(("ERROR", "unable to align file '%s' with '%s': %s" % (task["t_href"], task["a_href"], exc)))
+        return (msgs, task["s_name"], None)
+    if len(fragments) < len(task["ids"]):
+        msgs.append(("WARNING", "%d of %d MO elements were not aligned" % (len(task["ids"]) - len(fragments), len(task["ids"]))))
+    msgs.append(("INFO", "aligned %d MO elements" % (len(fragments))))
+    return (msgs, task["s_name"], build_smil(task["t_href"], task["a_href"], fragments))
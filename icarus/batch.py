@@ -0,0 +1,441 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+"""
+Add the MO attributes to a catalogue of EPUB files,
+and export the aeneas job ZIP file of each one,
+in a pool of worker processes, without Sigil.
+
+The soup engine of MOEdit needs the sigil_gumbo_bs4_adapter module,
+bundled with Sigil: if it cannot be imported,
+the stream engine is used instead.
+
+Examples:
+
+$ python icarus/batch.py /tmp/out /data/catalogue --pref engine=stream
+$ python icarus/batch.py /tmp/out --list books.txt --processes 8
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import argparse
+import codecs
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+from bookcontainer import EpubBook
+from cli import add_zip_arguments
+from cli import get_prefs
+from cli import parse_pref
+from core import Icarus
+from moedit import MOEdit
+
+__author__ = "Alberto Pettarin"
+__copyright__ = "Copyright 2015-2016, Alberto Pettarin (www.albertopettarin.it)"
+__license__ = "MIT"
+__version__ = "0.0.3"
+__email__ = "alberto@albertopettarin.it"
+__status__ = "Production"
+
+BOOK_EXTENSION = ".epub"
+LOG_NAME = "icarus.log"
+SUMMARY_NAME = "summary.json"
+
+STATUS_ERROR = "error"
+STATUS_OK = "ok"
+
+
+def is_unpacked_book(path):
+    """
+    Return True if path is an unpacked EPUB directory.
+
+    :param path: the path
+    :type  path: str
+    :rtype: bool
+    """
+    return os.path.isfile(os.path.join(path, "META-INF", "container.xml"))
+
+
+def iter_books(paths, list_path=None):
+    """
+    Yield the paths of the books found in the given paths,
+    which are EPUB files, unpacked EPUB directories,
+    or directories searched recursively for them,
+    and then the paths listed in the file at list_path,
+    one per line, if given.
+
+    The paths are yielded as they are found,
+    so that a catalogue is never listed in memory as a whole.
+
+    :param paths: the paths of the books or directories
+    :type  paths: list of str
+    :param list_path: the path of a file listing books
+    :type  list_path: str
+    :rtype: generator of str
+    """
+    for path in paths:
+        if os.path.isdir(path) and (not is_unpacked_book(path)):
+            for root, dirs, files in os.walk(path):
+                unpacked = [d for d in dirs if is_unpacked_book(os.path.join(root, d))]
+                dirs[:] = sorted([d for d in dirs if d not in unpacked])
+                for name in sorted(files + unpacked):
+                    if (name in unpacked) or name.lower().endswith(BOOK_EXTENSION):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+    if list_path is not None:
+        with io.open(list_path, "r", encoding="utf-8") as file_obj:
+            for line in file_obj:
+                line = line.strip()
+                if (len(line) > 0) and (not line.startswith("#")):
+                    yield line
+
+
+def get_book_directory(output_directory, book_path):
+    """
+    Return the output directory of the given book:
+    a subdirectory of output_directory, named after the book
+    and a hash of its absolute path, so that books
+    with the same name in different directories do not clash.
+
+    :param output_directory: the output directory of the batch
+    :type  output_directory: str
+    :param book_path: the path of the book
+    :type  book_path: str
+    :rtype: str
+    """
+    abs_path = os.path.abspath(book_path)
+    name = os.path.basename(abs_path.rstrip(os.sep))
+    if name.lower().endswith(BOOK_EXTENSION):
+        name = name[:-len(BOOK_EXTENSION)]
+    digest = hashlib.sha1(abs_path.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(output_directory, "%s.%s" % (name, digest))
+
+
+def read_summary(book_directory):
+    """
+    Return the summary of the book written in book_directory,
+    or None if there is none, or it cannot be read.
+
+    :param book_directory: the output directory of the book
+    :type  book_directory: str
+    :rtype: dict
+    """
+    try:
+        with io.open(os.path.join(book_directory, SUMMARY_NAME), "r", encoding="utf-8") as file_obj:
+            return json.load(file_obj)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_summary(book_directory, summary):
+    """
+    Write the summary of the book to book_directory,
+    replacing the previous one atomically, so that
+    a crash never leaves a partial summary behind.
+
+    :param book_directory: the output directory of the book
+    :type  book_directory: str
+    :param summary: the summary
+    :type  summary: dict
+    """
+    path = os.path.join(book_directory, SUMMARY_NAME)
+    tmp_path = path + ".tmp"
+    with io.open(tmp_path, "wb") as file_obj:
+        file_obj.write(json.dumps(summary, indent=1, sort_keys=True).encode("utf-8"))
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+
+def process_book(job):
+    """
+    Add the MO attributes to the XHTML files of a book,
+    pair its text and audio files, export its aeneas job ZIP file,
+    and save it; then write its summary, and return it.
+
+    The output of the operations is written to a log file
+    in the output directory of the book.
+    The book is processed in this process only,
+    as worker processes cannot start a pool of their own.
+
+    This function is defined at module level, so that it can be
+    sent to the worker processes of a multiprocessing pool.
+
+    :param job: a (book_path, book_directory, prefs, data_directory, zip_options) tuple,
+                where zip_options is a dict of keyword arguments for EpubBook
+    :type  job: tuple
+    :rtype: dict
+    """
+    book_path, book_directory, prefs, data_directory, zip_options = job
+    if not os.path.isdir(book_directory):
+        os.makedirs(book_directory)
+    prefs = dict(prefs)
+    prefs["save_directory"] = book_directory
+    prefs["workers"] = 1
+    summary = {
+        "book": book_path,
+        "status": STATUS_ERROR,
+        "error": None,
+        "output": None,
+        "files_scanned": 0,
+        "files_modified": 0,
+        "elements_touched": 0,
+        "warnings": 0,
+        "issues": [],
+        "pairs": 0,
+        "unmatched": 0,
+        "job": None,
+        "timings": {},
+    }
+    timings = summary["timings"]
+    output_path = None
+    if not os.path.isdir(book_path):
+        output_path = os.path.join(book_directory, os.path.basename(book_path))
+    stdout = sys.stdout
+    log_obj = codecs.open(os.path.join(book_directory, LOG_NAME), "w", "utf-8")
+    sys.stdout = log_obj
+    start = time.time()
+    try:
+        book = EpubBook(book_path, output_path=output_path, **zip_options)
+        bk = book.open()
+        timings["open"] = time.time() - start
+        saved = False
+        try:
+            icarus = Icarus(bk, prefs, data_directory=data_directory)
+            phase = time.time()
+            result = icarus.add_remove(Icarus.OPERATION_ADD)
+            timings["add"] = time.time() - phase
+            summary["files_scanned"] = result["files_scanned"]
+            summary["files_modified"] = result["files_modified"]
+            summary["elements_touched"] = result["elements_touched"]
+            summary["warnings"] = result["warnings"]
+            summary["issues"] = [list(issue) for issue in result["issues"]]
+            phase = time.time()
+            pairing = icarus.pair_files()
+            pairs = [((t_href, bk.href_to_id(t_href)), (a_href, bk.href_to_id(a_href))) for t_href, a_href in pairing.pairs]
+            summary["pairs"] = len(pairs)
+            summary["unmatched"] = len(pairing.unmatched)
+            if len(pairs) > 0:
+                summary["job"] = icarus.create_aeneas_job(pairs)
+            timings["export"] = time.time() - phase
+            phase = time.time()
+            book.close(save=True)
+            saved = True
+            timings["close"] = time.time() - phase
+        finally:
+            if not saved:
+                book.close(save=False)
+        summary["output"] = output_path or book_path
+        summary["status"] = STATUS_OK
+    except Exception as exc:
+        summary["error"] = "%s: %s" % (type(exc).__name__, exc)
+        traceback.print_exc(file=log_obj)
+    finally:
+        sys.stdout = stdout
+        log_obj.close()
+    timings["total"] = time.time() - start
+    write_summary(book_directory, summary)
+    return summary
+
+
+class BatchRunner(object):
+    """
+    Process a catalogue of books, one book per job,
+    in a pool of worker processes.
+
+    Each book gets its own output directory, holding
+    its summary, its log, its aeneas job ZIP file and,
+    for EPUB files, the modified EPUB file;
+    unpacked EPUB directories are modified in place.
+
+    A book whose summary says it was processed successfully
+    is skipped, so that an interrupted batch can be resumed
+    by running it again; books which failed are retried.
+
+    Only one book per worker is in memory at any time,
+    and the worker processes are replaced after
+    max_books_per_process books, to bound their memory usage.
+
+    :param prefs: the preferences
+    :type  prefs: dict
+    :param output_directory: the output directory of the batch
+    :type  output_directory: str
+    :param data_directory: the directory of the cache and export manifests
+    :type  data_directory: str
+    :param processes: the number of worker processes (0 meaning one per CPU)
+    :type  processes: int
+    :param force: if True, process the books already processed, too
+    :type  force: bool
+    :param max_books_per_process: the number of books processed
+                                  by a worker process before it is replaced
+    :type  max_books_per_process: int
+    :param zip_options: the keyword arguments for EpubBook
+                        controlling how EPUB files are written
+    :type  zip_options: dict
+    """
+
+    DEFAULT_MAX_BOOKS_PER_PROCESS = 50
+
+    def __init__(
+            self,
+            prefs,
+            output_directory,
+            data_directory=None,
+            processes=0,
+            force=False,
+            max_books_per_process=DEFAULT_MAX_BOOKS_PER_PROCESS,
+            zip_options=None
+    ):
+        self.prefs = prefs
+        self.output_directory = output_directory
+        self.data_directory = data_directory
+        self.processes = processes
+        self.force = force
+        self.max_books_per_process = max_books_per_process
+        self.zip_options = zip_options or {}
+        self.skipped = 0
+
+    def iter_jobs(self, books):
+        """
+        Yield the process_book() jobs of the given books,
+        skipping the books already processed successfully,
+        unless force is True.
+
+        :param books: the paths of the books
+        :type  books: iterable of str
+        :rtype: generator of tuple
+        """
+        for book_path in books:
+            book_directory = get_book_directory(self.output_directory, book_path)
+            if not self.force:
+                summary = read_summary(book_directory)
+                if (summary is not None) and (summary.get("status") == STATUS_OK):
+                    self.skipped += 1
+                    continue
+            yield (book_path, book_directory, self.prefs, self.data_directory, self.zip_options)
+
+    def run(self, books):
+        """
+        Process the given books, printing one line per book
+        as soon as it is done, and return a dict with the totals.
+
+        :param books: the paths of the books
+        :type  books: iterable of str
+        :rtype: dict
+        """
+        if not os.path.isdir(self.output_directory):
+            os.makedirs(self.output_directory)
+        processes = self.processes
+        if processes == 0:
+            processes = multiprocessing.cpu_count()
+        totals = {
+            "books_processed": 0,
+            "books_failed": 0,
+            "books_skipped": 0,
+            "elements_touched": 0,
+            "warnings": 0,
+            "time": 0.0,
+        }
+        start = time.time()
+        jobs = self.iter_jobs(books)
+        if processes > 1:
+            pool = multiprocessing.Pool(processes=processes, maxtasksperchild=self.max_books_per_process)
+            try:
+                summaries = pool.imap_unordered(process_book, jobs, chunksize=1)
+                for summary in summaries:
+                    self.report(summary, totals)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for job in jobs:
+                self.report(process_book(job), totals)
+        totals["books_skipped"] = self.skipped
+        totals["time"] = time.time() - start
+        return totals
+
+    def report(self, summary, totals):
+        """
+        Print the outcome of a book, and add it to the totals.
+
+        :param summary: the summary of the book
+        :type  summary: dict
+        :param totals: the totals
+        :type  totals: dict
+        """
+        if summary["status"] == STATUS_OK:
+            totals["books_processed"] += 1
+            totals["elements_touched"] += summary["elements_touched"]
+            totals["warnings"] += summary["warnings"]
+            print("OK    %s (%d elements, %d warnings, %d pairs, %.3f s)" % (
+                summary["book"],
+                summary["elements_touched"],
+                summary["warnings"],
+                summary["pairs"],
+                summary["timings"]["total"]
+            ))
+        else:
+            totals["books_failed"] += 1
+            print("ERROR %s (%s)" % (summary["book"], summary["error"]))
+        sys.stdout.flush()
+
+
+def main(argv=None):
+    """
+    Command line entry point.
+
+    :param argv: the command line arguments (default: sys.argv[1:])
+    :type  argv: list of str
+    :rtype: int
+    """
+    parser = argparse.ArgumentParser(description="icarus: process a catalogue of EPUB files, without Sigil.")
+    parser.add_argument("output", help="the output directory")
+    parser.add_argument("books", nargs="*", default=[], help="the EPUB files, unpacked EPUB directories, or directories containing them")
+    parser.add_argument("--list", default=None, help="a file listing the books, one path per line")
+    parser.add_argument("--processes", type=int, default=0, help="the number of worker processes (default: one per CPU)")
+    parser.add_argument("--max-books-per-process", type=int, default=BatchRunner.DEFAULT_MAX_BOOKS_PER_PROCESS, help="replace each worker process after this many books")
+    parser.add_argument("--force", action="store_true", help="process the books already processed, too")
+    parser.add_argument("--prefs", default=None, help="a JSON file with the preferences")
+    parser.add_argument("--pref", action="append", default=[], type=parse_pref, metavar="KEY=VALUE", help="set a preference (repeatable)")
+    parser.add_argument("--data-directory", default=None, help="the directory of the cache and export manifests (default: the output directory)")
+    add_zip_arguments(parser)
+    args = parser.parse_args(argv)
+    if (len(args.books) == 0) and (args.list is None):
+        parser.error("no books given")
+    prefs = get_prefs(args)
+    # checked once here, instead of by each book (see Icarus.get_engine())
+    if (prefs["engine"] == MOEdit.ENGINE_SOUP) and (not MOEdit.soup_engine_available()):
+        print("WARNING: the soup engine needs the sigil_gumbo_bs4_adapter module (bundled with Sigil), using the stream engine instead")
+        prefs["engine"] = MOEdit.ENGINE_STREAM
+    runner = BatchRunner(
+        prefs=prefs,
+        output_directory=args.output,
+        data_directory=args.data_directory or args.output,
+        processes=args.processes,
+        force=args.force,
+        max_books_per_process=args.max_books_per_process,
+        zip_options={"compresslevel": args.zip_level, "zip_workers": args.zip_workers}
+    )
+    totals = runner.run(iter_books(args.books, args.list))
+    print()
+    print("Books processed:  %d" % (totals["books_processed"]))
+    print("Books failed:     %d" % (totals["books_failed"]))
+    print("Books skipped:    %d" % (totals["books_skipped"]))
+    print("Elements touched: %d" % (totals["elements_touched"]))
+    print("Warnings:         %d" % (totals["warnings"]))
+    print("Time (s):         %.3f" % (totals["time"]))
+    if totals["books_failed"] > 0:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
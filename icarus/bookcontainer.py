@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+from __future__ import absolute_import
+from __future__ import print_function
+import io
+import os
+import posixpath
+import re
+import xml.etree.ElementTree as ElementTree
+
+from compatibility_utils import quoteurl
+from compatibility_utils import unquoteurl
+from compatibility_utils import unicode_str
+from epub_utils import EpubZip
+
+__author__ = "Alberto Pettarin"
+__copyright__ = "Copyright 2015-2016, Alberto Pettarin (www.albertopettarin.it)"
+__license__ = "MIT"
+__version__ = "0.0.3"
+__email__ = "alberto@albertopettarin.it"
+__status__ = "Production"
+
+CONTAINER_NS = "urn:oasis:names:tc:opendocument:xmlns:container"
+OPF_NS = "http://www.idpf.org/2007/opf"
+
+# the metadata element of the OPF file
+METADATA_PATTERN = re.compile(r"<(?:[A-Za-z_][\w.-]*:)?metadata\b.*?</(?:[A-Za-z_][\w.-]*:)?metadata\s*>", re.DOTALL)
+
+# the start tag of the package element of the OPF file
+PACKAGE_TAG_PATTERN = re.compile(r"<(?:[A-Za-z_][\w.-]*:)?package\b[^>]*>")
+
+# the end of the manifest element of the OPF file
+MANIFEST_END_PATTERN = re.compile(r"</(?:[A-Za-z_][\w.-]*:)?manifest\s*>")
+
+# the directory of the files added to the book, by media type, as Sigil does
+ADDED_FILE_DIRECTORIES = [
+    ("application/xhtml+xml", "Text"),
+    ("text/css", "Styles"),
+    ("image/", "Images"),
+    ("application/font", "Fonts"),
+    ("application/vnd.ms-opentype", "Fonts"),
+    ("application/x-font", "Fonts"),
+    ("audio/", "Audio"),
+    ("video/", "Video"),
+]
+
+class _Wrapper(object):
+    """
+    The subset of the Sigil wrapper accessed by icarus.
+    """
+
+    def __init__(self, ebook_root):
+        self.ebook_root = ebook_root
+
+
+
+class EpubBookContainer(object):
+    """
+    A replacement for the Sigil BookContainer object,
+    operating on an unpacked EPUB directory, so that the
+    icarus operations can run without Sigil.
+
+    Only the subset of the BookContainer interface
+    used by icarus is implemented.
+    Files are read from and written to the directory directly;
+    the changes to the manifest (added or deleted files)
+    are written to the OPF file by save().
+
+    :param ebook_root: the path of the unpacked EPUB directory
+    :type  ebook_root: str
+    """
+
+    def __init__(self, ebook_root):
+        self._w = _Wrapper(ebook_root)
+        self.ebook_root = ebook_root
+        self.opf_bookpath = self.get_opf_bookpath()
+        self.opf_dir = posixpath.dirname(self.opf_bookpath)
+        self.opf_data = self.read_bookpath(self.opf_bookpath).decode("utf-8")
+        self.manifest = []
+        self.id_to_item = {}
+        self.href_to_item_id = {}
+        self.spine = []
+        self.parse_opf()
+        self.added = []
+        self.deleted = []
+        self.selected = None
+
+    def get_opf_bookpath(self):
+        """
+        Return the path of the OPF file, relative to the book root,
+        as listed in META-INF/container.xml.
+
+        :rtype: str
+        """
+        root = ElementTree.fromstring(self.read_bookpath("META-INF/container.xml"))
+        for rootfile in root.iter("{%s}rootfile" % (CONTAINER_NS)):
+            if rootfile.get("media-type") == "application/oebps-package+xml":
+                return rootfile.get("full-path")
+        raise ValueError("no OPF file listed in META-INF/container.xml")
+
+    def parse_opf(self):
+        """
+        Parse the manifest and the spine of the OPF file.
+        """
+        root = ElementTree.fromstring(self.opf_data.encode("utf-8"))
+        for item in root.iter("{%s}item" % (OPF_NS)):
+            mid = item.get("id")
+            href = unquoteurl(item.get("href"))
+            mime = item.get("media-type")
+            self.manifest.append(mid)
+            self.id_to_item[mid] = (href, mime, item.get("properties"))
+            self.href_to_item_id[href] = mid
+        for itemref in root.iter("{%s}itemref" % (OPF_NS)):
+            self.spine.append(itemref.get("idref"))
+
+    def get_path(self, bookpath):
+        """
+        Return the path on disk of the given book path.
+
+        :param bookpath: the path relative to the book root
+        :type  bookpath: str
+        :rtype: str
+        """
+        return os.path.join(self.ebook_root, *bookpath.split("/"))
+
+    def read_bookpath(self, bookpath):
+        """
+        Return the contents of the file at the given book path.
+
+        :param bookpath: the path relative to the book root
+        :type  bookpath: str
+        :rtype: bytes
+        """
+        with io.open(self.get_path(bookpath), "rb") as file_obj:
+            return file_obj.read()
+
+    def open_bookpath(self, bookpath):
+        """
+        Return a binary file object reading
+        the file at the given book path.
+
+        :param bookpath: the path relative to the book root
+        :type  bookpath: str
+        :rtype: file
+        """
+        return io.open(self.get_path(bookpath), "rb")
+
+    def write_bookpath(self, bookpath, data):
+        """
+        Write the given data to the file at the given book path,
+        creating its directory if needed.
+
+        :param bookpath: the path relative to the book root
+        :type  bookpath: str
+        :param data: the file contents
+        :type  data: bytes
+        """
+        path = self.get_path(bookpath)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with io.open(path, "wb") as file_obj:
+            file_obj.write(data)
+
+    def delete_bookpath(self, bookpath):
+        """
+        Delete the file at the given book path, if it exists.
+
+        :param bookpath: the path relative to the book root
+        :type  bookpath: str
+        """
+        path = self.get_path(bookpath)
+        if os.path.exists(path):
+            os.remove(path)
+
+    @classmethod
+    def is_text_mime(cls, mime):
+        """
+        Return True if files with the given media type
+        are read as text, as Sigil does.
+
+        :param mime: the media type
+        :type  mime: str
+        :rtype: bool
+        """
+        return mime.startswith("text/") or mime.endswith("+xml") or mime.endswith("/xml") or (mime == "application/x-dtbncx+xml")
+
+    # BookContainer interface
+
+    def getPrefs(self):
+        return {}
+
+    def savePrefs(self, prefs):
+        pass
+
+    def getmetadataxml(self):
+        match = METADATA_PATTERN.search(self.opf_data)
+        if match is None:
+            return ""
+        return match.group(0)
+
+    def getpackagetag(self):
+        match = PACKAGE_TAG_PATTERN.search(self.opf_data)
+        if match is None:
+            return ""
+        return match.group(0)
+
+    def manifest_iter(self):
+        for mid in self.manifest:
+            href, mime, properties = self.id_to_item[mid]
+            yield (mid, href, mime)
+
+    def text_iter(self):
+        for mid in self.manifest:
+            href, mime, properties = self.id_to_item[mid]
+            if mime == "application/xhtml+xml":
+                yield (mid, href)
+
+    def media_iter(self):
+        for mid in self.manifest:
+            href, mime, properties = self.id_to_item[mid]
+            if mime.startswith("audio/") or mime.startswith("video/"):
+                yield (mid, href, mime)
+
+    def selected_iter(self):
+        if self.selected is None:
+            for mid, href in self.text_iter():
+                yield ("manifest", mid)
+        else:
+            for mid in self.selected:
+                yield ("manifest", mid)
+
+    def id_to_href(self, mid, ow=None):
+        if mid not in self.id_to_item:
+            return ow
+        return self.id_to_item[mid][0]
+
+    def id_to_mime(self, mid, ow=None):
+        if mid not in self.id_to_item:
+            return ow
+        return self.id_to_item[mid][1]
+
+    def href_to_id(self, href, ow=None):
+        return self.href_to_item_id.get(href, ow)
+
+    def id_to_bookpath(self, mid, ow=None):
+        if mid not in self.id_to_item:
+            return ow
+        return posixpath.join(self.opf_dir, self.id_to_item[mid][0])
+
+    def readfile(self, mid):
+        data = self.read_bookpath(self.id_to_bookpath(mid))
+        if self.is_text_mime(self.id_to_mime(mid)):
+            return data.decode("utf-8")
+        return data
+
+    def openfile(self, mid):
+        # not in the Sigil interface: stream a (large) file
+        return self.open_bookpath(self.id_to_bookpath(mid))
+
+    def writefile(self, mid, data):
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        self.write_bookpath(self.id_to_bookpath(mid), data)
+
+    def addfile(self, uniqueid, basename, data, mime=None, properties=None):
+        if uniqueid in self.id_to_item:
+            raise ValueError("manifest id '%s' already exists" % (uniqueid))
+        directory = "Misc"
+        for prefix, candidate in ADDED_FILE_DIRECTORIES:
+            if (mime is not None) and mime.startswith(prefix):
+                directory = candidate
+                break
+        href = "%s/%s" % (directory, basename)
+        if href in self.href_to_item_id:
+            raise ValueError("file '%s' already exists" % (href))
+        self.manifest.append(uniqueid)
+        self.id_to_item[uniqueid] = (href, mime, properties)
+        self.href_to_item_id[href] = uniqueid
+        self.added.append(uniqueid)
+        self.writefile(uniqueid, data)
+
+    def deletefile(self, mid):
+        bookpath = self.id_to_bookpath(mid)
+        href = self.id_to_item[mid][0]
+        del self.id_to_item[mid]
+        del self.href_to_item_id[href]
+        self.manifest.remove(mid)
+        if mid in self.added:
+            self.added.remove(mid)
+        else:
+            self.deleted.append(mid)
+        self.delete_bookpath(bookpath)
+
+    # end of the BookContainer interface
+
+    def save(self):
+        """
+        Write the changes to the manifest to the OPF file, if any.
+        """
+        if (len(self.added) == 0) and (len(self.deleted) == 0):
+            return
+        data = self.opf_data
+        for mid in self.deleted:
+            pattern = re.compile(r"""\s*<(?:[A-Za-z_][\w.-]*:)?item\s[^>]*\bid\s*=\s*["']%s["'][^>]*>""" % (re.escape(mid)))
+            data = pattern.sub("", data, count=1)
+        items = []
+        for mid in self.added:
+            href, mime, properties = self.id_to_item[mid]
+            item = '    <item href="%s" id="%s" media-type="%s"' % (quoteurl(href), mid, mime)
+            if properties is not None:
+                item += ' properties="%s"' % (properties)
+            items.append(item + "/>\n")
+        match = MANIFEST_END_PATTERN.search(data)
+        data = data[:match.start()].rstrip(" \t") + "".join(items) + "  " + data[match.start():]
+        self.opf_data = data
+        self.write_bookpath(self.opf_bookpath, unicode_str(data).encode("utf-8"))
+        self.added = []
+        self.deleted = []
+
+
+
+class EpubZipBookContainer(EpubBookContainer):
+    """
+    An EpubBookContainer operating on an EPUB file in place,
+    through an EpubZip object, without extracting it.
+
+    Files are read from the ZIP file when needed,
+    and written files are kept in memory until
+    the EpubZip object is saved.
+    As the files are not on disk, the book has no root directory.
+
+    :param epub_zip: the EPUB file
+    :type  epub_zip: EpubZip
+    """
+
+    def __init__(self, epub_zip):
+        self.epub_zip = epub_zip
+        super(EpubZipBookContainer, self).__init__(None)
+
+    def get_path(self, bookpath):
+        return None
+
+    def read_bookpath(self, bookpath):
+        return self.epub_zip.read(bookpath)
+
+    def open_bookpath(self, bookpath):
+        return self.epub_zip.open(bookpath)
+
+    def write_bookpath(self, bookpath, data):
+        self.epub_zip.write(bookpath, data)
+
+    def delete_bookpath(self, bookpath):
+        self.epub_zip.remove(bookpath)
+
+
+
+class EpubBook(object):
+    """
+    An EPUB file or unpacked EPUB directory,
+    opened for processing through an EpubBookContainer.
+
+    An EPUB file is accessed in place, through an EpubZip object,
+    and close() writes a new EPUB file, to output_path
+    or over the original file, where only the changed files
+    are compressed again, the others being copied raw.
+
+    :param path: the path of the EPUB file or directory
+    :type  path: str
+    :param output_path: the path of the output EPUB file;
+                        if None, the original file is overwritten
+    :type  output_path: str
+    :param compresslevel: the zlib compression level (0-9)
+                          of the changed files, or None for the default
+    :type  compresslevel: int
+    :param zip_workers: the number of threads compressing the changed files
+    :type  zip_workers: int
+    """
+
+    def __init__(self, path, output_path=None, compresslevel=None, zip_workers=0):
+        self.path = path
+        self.output_path = output_path
+        self.compresslevel = compresslevel
+        self.zip_workers = zip_workers
+        self.epub_zip = None
+        self.bk = None
+
+    def open(self):
+        """
+        Open the book, and return its EpubBookContainer.
+
+        :rtype: EpubBookContainer
+        """
+        if os.path.isdir(self.path):
+            self.bk = EpubBookContainer(self.path)
+        else:
+            self.epub_zip = EpubZip(self.path)
+            self.bk = EpubZipBookContainer(self.epub_zip)
+        return self.bk
+
+    def close(self, save=True):
+        """
+        Close the book, saving the changes if save is True.
+
+        :param save: if True, save the changes
+        :type  save: bool
+        """
+        try:
+            if save and (self.bk is not None):
+                self.bk.save()
+                if self.epub_zip is not None:
+                    output_path = self.output_path or self.path
+                    if self.epub_zip.is_modified() or (output_path != self.path):
+                        tmp_path = output_path + ".tmp"
+                        try:
+                            self.epub_zip.save(tmp_path, compresslevel=self.compresslevel, workers=self.zip_workers)
+                        except:
+                            if os.path.exists(tmp_path):
+                                os.remove(tmp_path)
+                            raise
+                        self.epub_zip.close()
+                        if os.path.exists(output_path):
+                            os.remove(output_path)
+                        os.rename(tmp_path, output_path)
+        finally:
+            if self.epub_zip is not None:
+                self.epub_zip.close()
+                self.epub_zip = None
+            self.bk = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(save=(exc_type is None))
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+"""
+Run the icarus operations on an EPUB file or unpacked EPUB directory,
+without Sigil and without a display.
+
+The soup engine of MOEdit needs the sigil_gumbo_bs4_adapter module,
+bundled with Sigil: if it cannot be imported,
+the stream engine is used instead.
+
+Examples:
+
+$ python icarus/cli.py add book.epub -o out.epub
+$ python icarus/cli.py export book.epub --pref save_directory=/tmp/jobs
+$ python icarus/cli.py import book.epub /tmp/jobs/20160212_180203_aeneas_job.output.zip
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import argparse
+import io
+import json
+import os
+import sys
+
+from bookcontainer import EpubBook
+from core import Icarus
+
+__author__ = "Alberto Pettarin"
+__copyright__ = "Copyright 2015-2016, Alberto Pettarin (www.albertopettarin.it)"
+__license__ = "MIT"
+__version__ = "0.0.3"
+__email__ = "alberto@albertopettarin.it"
+__status__ = "Production"
+
+COMMANDS = {
+    "add": "add MO class and id attributes",
+    "remove": "remove MO class and id attributes",
+    "remove-class": "remove the MO class only",
+    "pair": "print the (text, audio) pairs",
+    "export": "export the aeneas job ZIP file",
+    "align": "align locally and import the SMIL files",
+    "import": "import a SMIL file or an aeneas output ZIP file",
+    "shift": "shift and/or rescale the clips of all the SMIL files",
+}
+
+OPERATIONS = {
+    "add": Icarus.OPERATION_ADD,
+    "remove": Icarus.OPERATION_REMOVE,
+    "remove-class": Icarus.OPERATION_REMOVE_MO_CLASS,
+}
+
+
+def parse_pref(value):
+    """
+    Parse a "key=value" command line argument
+    into a (key, value) pair, where value is decoded
+    as JSON if possible (e.g., numbers),
+    and "tags" are split on whitespace and commas.
+
+    :param value: the argument
+    :type  value: str
+    :rtype: tuple
+    """
+    if "=" not in value:
+        raise argparse.ArgumentTypeError("preferences must be given as key=value")
+    key, value = value.split("=", 1)
+    key = key.strip()
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+    if (key == "tags") and (not isinstance(value, list)):
+        value = [tag for tag in value.replace(",", " ").split(" ") if len(tag) > 0]
+    return (key, value)
+
+
+def add_zip_arguments(parser):
+    """
+    Add the options controlling how EPUB files are written
+    to the given parser.
+
+    :param parser: the parser
+    :type  parser: argparse.ArgumentParser
+    """
+    parser.add_argument("--zip-level", type=int, default=None, choices=range(10), metavar="LEVEL", help="the compression level (0-9) of the changed files of EPUB files")
+    parser.add_argument("--zip-workers", type=int, default=0, help="the number of threads compressing the changed files of EPUB files")
+
+
+def get_parser():
+    """
+    Return the command line argument parser.
+
+    :rtype: argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(
+        description="icarus: create EPUB 3 Audio-eBooks, without Sigil.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="\n".join(["commands:"] + ["  %-13s %s" % (name, COMMANDS[name]) for name in sorted(COMMANDS)])
+    )
+    parser.add_argument("command", choices=sorted(COMMANDS), metavar="command", help="the operation to run (see below)")
+    parser.add_argument("book", help="the EPUB file or unpacked EPUB directory")
+    parser.add_argument("source", nargs="?", default=None, help="the SMIL or ZIP file to import (import only)")
+    parser.add_argument("-o", "--output", default=None, help="write the modified EPUB file here, instead of overwriting it")
+    parser.add_argument("--prefs", default=None, help="a JSON file with the preferences")
+    parser.add_argument("--pref", action="append", default=[], type=parse_pref, metavar="KEY=VALUE", help="set a preference (repeatable)")
+    parser.add_argument("--files", nargs="+", default=None, metavar="HREF", help="process only these XHTML files (add/remove)")
+    parser.add_argument("--pairs", default=None, help="a file with one 'text <-> audio' pair per line (export/align)")
+    parser.add_argument("--offset", type=float, default=0.0, help="the clip offset, in seconds (shift)")
+    parser.add_argument("--scale", type=float, default=1.0, help="the clip scale factor (shift)")
+    parser.add_argument("--data-directory", default=None, help="the directory of the cache and export manifests")
+    add_zip_arguments(parser)
+    return parser
+
+
+def get_prefs(args):
+    """
+    Return the preferences, built from the defaults,
+    the JSON file and the --pref arguments, in this order.
+
+    :param args: the parsed arguments
+    :type  args: argparse.Namespace
+    :rtype: dict
+    """
+    prefs = Icarus.get_default_prefs()
+    prefs["save_directory"] = os.getcwd()
+    if args.prefs is not None:
+        with io.open(args.prefs, "r", encoding="utf-8") as file_obj:
+            prefs.update(json.load(file_obj))
+    for key, value in args.pref:
+        prefs[key] = value
+    return prefs
+
+
+def run_command(icarus, args):
+    """
+    Run the requested command on the given Icarus object,
+    and return the exit code.
+
+    :param icarus: the Icarus object
+    :type  icarus: Icarus
+    :param args: the parsed arguments
+    :type  args: argparse.Namespace
+    :rtype: int
+    """
+    bk = icarus.bk
+    if args.command in OPERATIONS:
+        if args.files is not None:
+            bk.selected = []
+            for href in args.files:
+                mid = bk.href_to_id(href, ow=None)
+                if mid is None:
+                    print("ERROR: file '%s' not in the book" % (href))
+                    return 1
+                bk.selected.append(mid)
+        icarus.add_remove(OPERATIONS[args.command])
+        return 0
+    if args.command in ["pair", "export", "align"]:
+        if args.pairs is not None:
+            with io.open(args.pairs, "r", encoding="utf-8") as file_obj:
+                pairs = icarus.parse_pairs(file_obj.read())
+        else:
+            pairs = [((t_href, bk.href_to_id(t_href)), (a_href, bk.href_to_id(a_href))) for t_href, a_href in icarus.pair_files().pairs]
+        if args.command == "pair":
+            for (t_href, t_mid), (a_href, a_mid) in pairs:
+                print("%s <-> %s" % (t_href, a_href))
+            return 0
+        if len(pairs) == 0:
+            print("ERROR: no (text, audio) files found.")
+            return 1
+        if args.command == "export":
+            icarus.create_aeneas_job(pairs)
+        else:
+            icarus.align_pairs(pairs)
+        return 0
+    if args.command == "import":
+        if (args.source is None) or (not os.path.isfile(args.source)):
+            print("ERROR: the import command needs an existing SMIL or ZIP file")
+            return 1
+        if args.source.lower().endswith(".zip"):
+            icarus.import_zip_file(args.source)
+        else:
+            icarus.import_smil_file(args.source)
+        return 0
+    if args.command == "shift":
+        if args.scale <= 0:
+            print("ERROR: the clip scale must be positive. No SMIL file was modified.")
+            return 1
+        icarus.shift_smil_files(args.offset, args.scale)
+        return 0
+    return 1
+
+
+def main(argv=None):
+    """
+    Command line entry point.
+
+    :param argv: the command line arguments (default: sys.argv[1:])
+    :type  argv: list of str
+    :rtype: int
+    """
+    args = get_parser().parse_args(argv)
+    prefs = get_prefs(args)
+    book = EpubBook(args.book, output_path=args.output, compresslevel=args.zip_level, zip_workers=args.zip_workers)
+    bk = book.open()
+    ret = 1
+    try:
+        icarus = Icarus(bk, prefs, data_directory=args.data_directory)
+        ret = run_command(icarus, args)
+    finally:
+        book.close(save=(ret == 0) and (args.command not in ["pair", "export"]))
+    return ret
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1060 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+from __future__ import absolute_import
+from __future__ import print_function
+import cProfile
+import collections
+import datetime
+import hashlib
+import itertools
+import multiprocessing
+import os
+import re
+import tempfile
+import zipfile
+import xml.etree.ElementTree as ElementTree
+
+from aeneasjob import AeneasJob
+from aeneasjob import JobManifest
+from aeneasjob import get_file_path
+from aligner import ALIGNERS
+from aligner import align_pair
+from diagnostics import Diagnostics
+from mocache import MOCache
+from moedit import IdAllocator
+from moedit import MOEdit
+from moedit import process_xhtml_timed
+from opfmetadata import MetadataIndex
+from pairing import PAIR_SEPARATOR
+from pairing import Pairing
+from pairing import PairingEngine
+from smilfile import SMIL_FOOTER
+from smilfile import SMIL_HEADER
+from smilfile import SMIL_MIME
+from smilfile import SMIL_ROW
+from smilfile import SmilTimings
+from smilfile import build_smil
+from smilfile import check_smil
+from smilfile import read_smil_source
+from tagscanner import collect_ids
+from timing import PhaseTimer
+from timing import TimingReport
+
+__author__ = "Alberto Pettarin"
+__copyright__ = "Copyright 2015-2016, Alberto Pettarin (www.albertopettarin.it)"
+__license__ = "MIT"
+__version__ = "0.0.3"
+__email__ = "alberto@albertopettarin.it"
+__status__ = "Production"
+
+class Icarus(object):
+    """
+    The operations of icarus on a book, independent of the GUI:
+    the Sigil plugin (MainGUI) and the command line interface
+    both drive an object of this class.
+
+    :param bk: the book container, or an object with the same interface
+    :type  bk: BookContainer
+    :param prefs: the preferences
+    :type  prefs: dict
+    :param data_directory: the directory where data is kept across runs;
+                           if None, see get_data_directory()
+    :type  data_directory: str
+    """
+
+    DEFAULT_ID_FORMAT = "f%06d"
+    DEFAULT_ID_REGEX = r"f[0-9]{6}"
+    DEFAULT_MO_CLASS = "mo"
+    DEFAULT_NOMO_CLASS = "nomo"
+    DEFAULT_EXISTING_IDS_ONLY = 0
+    DEFAULT_SAVE_DIRECTORY = os.path.expanduser("~")
+    DEFAULT_TAGS = ["h1", "h2", "h3", "h4", "h5", "h6", "li", "p", "q"]
+    DEFAULT_WORKERS = 1
+    DEFAULT_ENGINE = MOEdit.ENGINE_SOUP
+    DEFAULT_CACHE_SIZE = 64
+    DEFAULT_ID_SCOPE = "file"
+    DEFAULT_EXPORT_READERS = 2
+    DEFAULT_EXPORT_MODE = "full"
+    DEFAULT_ALIGNER = "aeneas"
+    DEFAULT_PAIRING = PairingEngine.STRATEGY_FIRST_NUMBER
+    DEFAULT_PAIRING_FILE = ""
+    DEFAULT_PROFILE = 0
+    DEFAULT_TIMING_REPORT = 0
+    DEFAULT_VERBOSITY = "summary"
+
+    OPERATION_ADD = MOEdit.OPERATION_ADD
+    OPERATION_REMOVE = MOEdit.OPERATION_REMOVE
+    OPERATION_REMOVE_MO_CLASS = MOEdit.OPERATION_REMOVE_MO_CLASS
+
+    EXPORT_MODE_DELTA = "delta"
+    EXPORT_MODE_FULL = "full"
+
+    ID_SCOPE_BOOK = "book"
+    ID_SCOPE_FILE = "file"
+
+    VERBOSITY_FULL = "full"
+    VERBOSITY_SUMMARY = "summary"
+    VERBOSITY_WARNINGS = "warnings"
+    VERBOSITIES = [VERBOSITY_SUMMARY, VERBOSITY_WARNINGS, VERBOSITY_FULL]
+
+    REQUIRED_PREF_KEYS = [
+        "aligner",
+        "cache_size",
+        "engine",
+        "id_format",
+        "id_regex",
+        "id_scope",
+        "mo_class",
+        "nomo_class",
+        "pairing",
+        "pairing_file",
+        "profile",
+        "existing_ids_only",
+        "export_mode",
+        "export_readers",
+        "save_directory",
+        "tags",
+        "timing_report",
+        "verbosity",
+        "workers"
+    ]
+    SMIL_DIRECTORY = "Misc"
+    CACHE_DIRECTORY = "icarus_cache"
+    MANIFEST_DIRECTORY = "icarus_manifests"
+    MAX_REPORTED_ISSUES = 20
+
+    SMIL_HEADER = SMIL_HEADER
+    SMIL_ROW = SMIL_ROW
+    SMIL_FOOTER = SMIL_FOOTER
+
+    def __init__(self, bk, prefs, data_directory=None):
+        self.bk = bk
+        self.prefs = prefs
+        self.data_directory = data_directory
+        self.metadata_index = None
+
+    @classmethod
+    def get_default_prefs(cls):
+        """
+        Return a dict with the default value of each preference.
+
+        :rtype: dict
+        """
+        return {
+            "tags": list(cls.DEFAULT_TAGS),
+            "mo_class": cls.DEFAULT_MO_CLASS,
+            "nomo_class": cls.DEFAULT_NOMO_CLASS,
+            "id_regex": cls.DEFAULT_ID_REGEX,
+            "id_format": cls.DEFAULT_ID_FORMAT,
+            "id_scope": cls.DEFAULT_ID_SCOPE,
+            "existing_ids_only": cls.DEFAULT_EXISTING_IDS_ONLY,
+            "save_directory": cls.DEFAULT_SAVE_DIRECTORY,
+            "workers": cls.DEFAULT_WORKERS,
+            "engine": cls.DEFAULT_ENGINE,
+            "cache_size": cls.DEFAULT_CACHE_SIZE,
+            "export_readers": cls.DEFAULT_EXPORT_READERS,
+            "export_mode": cls.DEFAULT_EXPORT_MODE,
+            "aligner": cls.DEFAULT_ALIGNER,
+            "pairing": cls.DEFAULT_PAIRING,
+            "pairing_file": cls.DEFAULT_PAIRING_FILE,
+            "profile": cls.DEFAULT_PROFILE,
+            "timing_report": cls.DEFAULT_TIMING_REPORT,
+            "verbosity": cls.DEFAULT_VERBOSITY,
+        }
+
+    def has_all_required_pref_keys(self):
+        """
+        Return True if and only if the preferences
+        have all the required keys.
+
+        :rtype: bool
+        """
+        for key in self.REQUIRED_PREF_KEYS:
+            if not key in self.prefs:
+                return False
+        return True
+
+    def apply_missing_defaults(self):
+        """
+        Set the default value of each preference
+        missing from the preferences (e.g., added by a newer version),
+        leaving the stored ones alone.
+        """
+        for key, value in self.get_default_prefs().items():
+            self.prefs.setdefault(key, value)
+
+    def pair_files(self):
+        """
+        Pair the text files with the audio files of the book,
+        as specified by the "pairing" and "pairing_file" preferences,
+        report the unmatched and ambiguous files,
+        and return the resulting Pairing object.
+
+        The unmatched files are listed only if the "verbosity"
+        preference is "full", the ambiguous ones only if it is
+        "warnings" or "full", otherwise only their counts are printed.
+
+        :rtype: Pairing
+        """
+        t_hrefs = [href for mid, href in self.bk.text_iter()]
+        a_hrefs = [href for mid, href, mediatype in self.bk.media_iter() if mediatype.startswith("audio/")]
+        try:
+            engine = PairingEngine(self.prefs["pairing"], self.prefs["pairing_file"])
+            pairing = engine.pair(t_hrefs, a_hrefs)
+        except (IOError, OSError, ValueError) as exc:
+            print("ERROR: unable to pair the (text, audio) files (%s)" % (exc))
+            pairing = Pairing([], [], [])
+        verbosity = self.get_verbosity()
+        if verbosity == self.VERBOSITY_FULL:
+            for href in pairing.unmatched:
+                print("INFO: file '%s' not paired" % (href))
+        elif len(pairing.unmatched) > 0:
+            print("INFO: files not paired: %d (set the verbosity to '%s' to list them)" % (len(pairing.unmatched), self.VERBOSITY_FULL))
+        if verbosity != self.VERBOSITY_SUMMARY:
+            for hrefs in pairing.ambiguous:
+                print("WARNING: files with the same pairing key, not paired: %s" % (", ".join(hrefs)))
+        elif len(pairing.ambiguous) > 0:
+            print("WARNING: groups of files with the same pairing key, not paired: %d (set the verbosity to '%s' to list them)" % (len(pairing.ambiguous), self.VERBOSITY_WARNINGS))
+        return pairing
+
+    def parse_pairs(self, data):
+        """
+        Return the list of ((t_href, t_mid), (a_href, a_mid)) pairs
+        listed in data, one "t_href <-> a_href" pair per line,
+        skipping the lines not referring to files in the book.
+
+        :param data: the pairs
+        :type  data: str
+        :rtype: list
+        """
+        pairs = []
+        for line in data.split("\n"):
+            if PAIR_SEPARATOR in line:
+                arr = line.split(PAIR_SEPARATOR)
+                if len(arr) == 2:
+                    t_href = arr[0].strip()
+                    a_href = arr[1].strip()
+                    t_mid = self.bk.href_to_id(t_href, ow=None)
+                    a_mid = self.bk.href_to_id(a_href, ow=None)
+                    if (t_mid is not None) and (a_mid is not None):
+                        pairs.append(((t_href, t_mid), (a_href, a_mid)))
+        return pairs
+
+    def add_remove(self, operation):
+        """
+        Add or remove MO class and/or id attributes
+        to the XHTML files selected in the Book View panel.
+
+        The files are read from and written to the book
+        in the main process, while parsing, editing and
+        serializing them might happen in a pool of
+        worker processes (see the "workers" preference).
+        If the "id_scope" preference is "book",
+        new id values are allocated across the whole book,
+        hence the files are processed sequentially.
+
+        The time spent reading, parsing, mutating, serializing
+        and writing each file is recorded in a timing report,
+        written if the "timing_report" preference is 1
+        (see finish_timing()).
+
+        The diagnostics of each element are collected
+        in a Diagnostics object, and printed according to
+        the "verbosity" preference: only their counts
+        by category ("summary"), the warnings of each file
+        ("warnings"), or all of them ("full").
+
+        Return a dict with the number of files scanned and modified,
+        the number of elements touched, the number of warnings,
+        the list of the first (href, msg_type, msg_text) warnings
+        (at most MAX_REPORTED_ISSUES), and the Diagnostics object.
+
+        :param operation: the requested operation 
+        :type  operation: str
+        :rtype: dict
+        """
+        settings = {
+            "tags": self.prefs["tags"],
+            "mo_class": self.prefs["mo_class"],
+            "nomo_class": self.prefs["nomo_class"],
+            "id_regex": self.prefs["id_regex"],
+            "id_format": self.prefs["id_format"],
+            "existing_ids_only": self.prefs["existing_ids_only"],
+            "engine": self.get_engine(),
+        }
+        report, profiler = self.start_timing(operation)
+        files = []
+        timers = []
+        for (id_type, mid) in self.bk.selected_iter():
+            if id_type == "manifest":
+                href = self.bk.id_to_href(mid, ow=None)
+                mime = self.bk.id_to_mime(mid, ow=None)
+                if mime == "application/xhtml+xml":
+                    timer = report.get_file_timer(href)
+                    timer.reset()
+                    data = self.bk.readfile(mid).encode("utf-8")
+                    timer.lap("bk_read")
+                    files.append((mid, href, data))
+                    timers.append(timer)
+
+        jobs = [(settings, operation, data) for (mid, href, data) in files]
+        if (operation == self.OPERATION_ADD) and (self.prefs["id_scope"] == self.ID_SCOPE_BOOK):
+            # the allocator is shared by all the files,
+            # so they are processed in order, in this process,
+            # and their results cannot be cached
+            cache = None
+            id_allocator = IdAllocator.from_book(self.bk, self.prefs["id_format"])
+            results = []
+            for job, timer in zip(jobs, timers):
+                result, phases = process_xhtml_timed(job, id_allocator)
+                results.append(result)
+                timer.update(phases)
+        else:
+            cache = self.get_mo_cache()
+            results = self.process_jobs(jobs, cache, timers)
+
+        verbosity = self.get_verbosity()
+        # in "warnings" mode, only the files with warnings are listed
+        msg_type = "WARN" if verbosity == self.VERBOSITY_WARNINGS else None
+        diagnostics = Diagnostics()
+        files_modified = 0
+        elements_touched = 0
+        for (mid, href, data), (file_diagnostics, data, touched), timer in zip(files, results, timers):
+            written = (data is not None) and (touched > 0)
+            if written:
+                timer.reset()
+                self.bk.writefile(mid, data)
+                timer.lap("bk_write")
+                files_modified += 1
+                elements_touched += touched
+            diagnostics.merge(file_diagnostics, href)
+
+            if (verbosity == self.VERBOSITY_FULL) or ((msg_type is not None) and (file_diagnostics.count_file(msg_type) > 0)):
+                print("File %s\n" % href)
+                if (verbosity == self.VERBOSITY_FULL) and (not written):
+                    print("    INFO: no changes, file not written")
+                for file_index, file_msg_type, msg_text in file_diagnostics.iter_messages(msg_type):
+                    print("    %s: %s" % (file_msg_type, msg_text))
+                print("\n=====================\n")
+
+        warnings = diagnostics.count("WARN")
+        if warnings == 0:
+            print("NO ISSUES FOUND")
+        elif verbosity == self.VERBOSITY_FULL:
+            # print issues only
+            print("ISSUES FOUND:\n")
+            for file_index, file_msg_type, msg_text in diagnostics.iter_messages("WARN"):
+                print("File %s : %s : %s" % (diagnostics.hrefs[file_index], file_msg_type, msg_text))
+        elif verbosity == self.VERBOSITY_SUMMARY:
+            print("ISSUES FOUND: %d (set the verbosity to '%s' to list them)" % (warnings, self.VERBOSITY_WARNINGS))
+        print()
+        print("Files scanned:    %d" % (len(files)))
+        print("Files modified:   %d" % (files_modified))
+        print("Elements touched: %d" % (elements_touched))
+        if cache is not None:
+            print("Cached results:   %d" % (cache.hits))
+        for count_msg_type, category, count in diagnostics.get_counts():
+            print("    %s: %s: %d" % (count_msg_type, category, count))
+        self.finish_timing(report, profiler)
+        issues = [
+            (diagnostics.hrefs[file_index], file_msg_type, msg_text)
+            for file_index, file_msg_type, msg_text in itertools.islice(diagnostics.iter_messages("WARN"), self.MAX_REPORTED_ISSUES)
+        ]
+        return {
+            "files_scanned": len(files),
+            "files_modified": files_modified,
+            "elements_touched": elements_touched,
+            "warnings": warnings,
+            "issues": issues,
+            "diagnostics": diagnostics,
+        }
+
+    def process_jobs(self, jobs, cache, timers):
+        """
+        Process the given MOEdit jobs, and return the list
+        of their (diagnostics, out_data, touched) results.
+        Cached results are reused, the other jobs are
+        processed by map_jobs() and their results cached.
+        The time spent on each job is added to its timer.
+
+        :param jobs: the (settings, operation, data) jobs
+        :type  jobs: list of tuple
+        :param cache: the cache, or None
+        :type  cache: MOCache
+        :param timers: the timers of the jobs
+        :type  timers: list of PhaseTimer
+        :rtype: list of tuple
+        """
+        results = [None] * len(jobs)
+        keys = [None] * len(jobs)
+        if cache is not None:
+            for index, job in enumerate(jobs):
+                timers[index].reset()
+                keys[index] = cache.get_key(*job)
+                results[index] = cache.get(keys[index])
+                timers[index].lap("cache_read")
+        missing = [index for index in range(len(jobs)) if results[index] is None]
+        for index, (result, phases) in zip(missing, self.map_jobs(process_xhtml_timed, [jobs[index] for index in missing])):
+            results[index] = result
+            timers[index].update(phases)
+            if cache is not None:
+                timers[index].reset()
+                cache.put(keys[index], result)
+                timers[index].lap("cache_write")
+        if cache is not None:
+            cache.trim()
+        return results
+
+    def start_timing(self, operation):
+        """
+        Return a (report, profiler) tuple for the given operation,
+        where report is a new TimingReport, and profiler
+        is a running cProfile profiler, if the "profile"
+        preference is 1, or None.
+
+        Only this process is profiled, not the worker processes
+        (see the "workers" preference).
+
+        :param operation: the name of the operation
+        :type  operation: str
+        :rtype: tuple
+        """
+        report = TimingReport(operation)
+        profiler = None
+        if self.prefs["profile"] == 1:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return (report, profiler)
+
+    def finish_timing(self, report, profiler):
+        """
+        Stop the given profiler, if any, and write its statistics
+        to the save directory, then write the given timing report
+        there, if the "timing_report" preference is 1.
+        Both are off by default, so that the save directory
+        does not fill up with files for each operation.
+        Failures are reported, but do not stop the operation.
+
+        :param report: the timing report
+        :type  report: TimingReport
+        :param profiler: the profiler, or None
+        :type  profiler: cProfile.Profile
+        """
+        directory = self.prefs["save_directory"]
+        if profiler is not None:
+            profiler.disable()
+            try:
+                report.profile_path = report.get_path(directory, ".prof")
+                profiler.dump_stats(report.profile_path)
+                print("INFO: profile written to '%s'" % (report.profile_path))
+            except (IOError, OSError) as exc:
+                report.profile_path = None
+                print("WARNING: unable to write the profile to '%s' (%s)" % (directory, exc))
+        if self.prefs["timing_report"] != 1:
+            return
+        try:
+            path = report.write(directory)
+            print("INFO: timing report written to '%s'" % (path))
+        except (IOError, OSError) as exc:
+            print("WARNING: unable to write the timing report to '%s' (%s)" % (directory, exc))
+
+    def get_data_directory(self):
+        """
+        Return the directory where the plugin keeps
+        its data across runs: the data directory
+        given to the constructor, if any, or the directory
+        of the plugin preferences file, if known,
+        otherwise the temporary directory.
+
+        :rtype: str
+        """
+        if self.data_directory is not None:
+            return self.data_directory
+        prefs_path = getattr(self.prefs, "file_path", None)
+        if prefs_path is not None:
+            return os.path.dirname(prefs_path)
+        return tempfile.gettempdir()
+
+    def get_manifest_path(self):
+        """
+        Return the path of the export manifest of the current book,
+        which is identified by its dc:identifier metadatum,
+        or None if the book has no (non-empty) identifier.
+
+        Neither the OPF path nor the directory of the unpacked book
+        (a new temporary directory at each Sigil run)
+        can replace it, so books without an identifier
+        do not have a manifest, instead of sharing one.
+
+        :rtype: str
+        """
+        identifier = self.get_metadatum_value(name="identifier", default=None)
+        if (identifier is None) or (len(identifier.strip()) == 0):
+            return None
+        name = hashlib.sha1(identifier.encode("utf-8")).hexdigest() + ".json"
+        return os.path.join(self.get_data_directory(), self.MANIFEST_DIRECTORY, name)
+
+    def get_mo_cache(self):
+        """
+        Return the MOCache object storing the MOEdit results,
+        in a directory next to the plugin preferences file,
+        or None if the cache is disabled or cannot be created.
+
+        :rtype: MOCache
+        """
+        if self.prefs["cache_size"] <= 0:
+            return None
+        directory = os.path.join(self.get_data_directory(), self.CACHE_DIRECTORY)
+        try:
+            return MOCache(directory, self.prefs["cache_size"] * 1024 * 1024)
+        except (IOError, OSError):
+            print("WARNING: unable to use the cache directory '%s'" % (directory))
+            return None
+
+    def map_jobs(self, function, jobs):
+        """
+        Apply function to each job, and return the list of results,
+        in the same order as jobs.
+
+        If the "workers" preference is 0 or greater than 1,
+        the jobs are distributed over a pool of worker processes
+        (0 meaning one process per CPU); otherwise, or if the pool
+        cannot be created, they are processed sequentially.
+
+        :param function: a module-level function, taking a single job
+        :type  function: function
+        :param jobs: the jobs to be processed
+        :type  jobs: list
+        :rtype: list
+        """
+        workers = self.prefs["workers"]
+        if workers == 0:
+            workers = multiprocessing.cpu_count()
+        workers = min(workers, len(jobs))
+        if workers > 1:
+            try:
+                pool = multiprocessing.Pool(processes=workers)
+            except (OSError, ImportError) as exc:
+                print("WARNING: unable to start %d worker processes (%s), processing files sequentially" % (workers, exc))
+            else:
+                try:
+                    return pool.map(function, jobs, chunksize=1)
+                finally:
+                    pool.close()
+                    pool.join()
+        return [function(job) for job in jobs]
+
+
+    def create_aeneas_job(self, pairs):
+        """
+        Export the given (text, audio) pairs
+        to an aeneas job ZIP file in the save directory,
+        and return its path, or None if no file was created.
+
+        The time spent hashing the pairs and writing
+        the ZIP file is recorded in a timing report,
+        written if the "timing_report" preference is 1
+        (see finish_timing()).
+
+        :param pairs: the list of ((t_href, t_mid), (a_href, a_mid)) pairs
+        :type  pairs: list
+        :rtype: str
+        """
+        report, profiler = self.start_timing("export")
+        try:
+            return self.write_aeneas_job(pairs, report)
+        finally:
+            self.finish_timing(report, profiler)
+
+    def write_aeneas_job(self, pairs, report):
+        """
+        Export the given (text, audio) pairs
+        to an aeneas job ZIP file in the save directory,
+        recording the time spent in report,
+        and return its path, or None if no file was created.
+
+        :param pairs: the list of ((t_href, t_mid), (a_href, a_mid)) pairs
+        :type  pairs: list
+        :param report: the timing report
+        :type  report: TimingReport
+        :rtype: str
+        """
+        def now_str():
+            """
+            Return a string with the current date/time,
+            formatted like this: "20151216_180203".
+
+            :rtype: str
+            """
+            now = datetime.datetime.now()
+            return "%d%02d%02d_%02d%02d%02d" % (
+                now.year,
+                now.month,
+                now.day,
+                now.hour,
+                now.minute,
+                now.second
+            )
+        
+        now = now_str()
+        zip_name = "%s_aeneas_job.zip" % (now)
+        zip_name_proc = "%s_aeneas_job.output.zip" % (now)
+        zip_path = os.path.join(self.prefs["save_directory"], zip_name)
+
+        config_language = self.get_metadatum_value(name="language", default=None)
+        if config_language is None:
+            config_language = "en"
+            print("WARNING: unable to determine the language from the OPF file, using '%s' instead" % (config_language))
+        else:
+            print("INFO: detected language '%s' in the OPF file" % (config_language))
+        job = AeneasJob(
+            bk=self.bk,
+            pairs=pairs,
+            language=config_language,
+            mo_class=self.prefs["mo_class"],
+            smil_directory=self.SMIL_DIRECTORY
+        )
+        tasks = job.get_tasks()
+        manifest_path = self.get_manifest_path()
+        manifest = None
+        if manifest_path is not None:
+            manifest = JobManifest(manifest_path)
+        elif self.prefs["export_mode"] == self.EXPORT_MODE_DELTA:
+            print("WARNING: the book has no dc:identifier, exporting all the (text, audio) pairs")
+        if (self.prefs["export_mode"] == self.EXPORT_MODE_DELTA) and (manifest is not None):
+            report.timer.reset()
+            hashes = job.hash_tasks(tasks, readers=self.prefs["export_readers"])
+            report.timer.lap("hash")
+            job_tasks = [task for task, pair_hash in zip(tasks, hashes) if manifest.is_changed(task, pair_hash)]
+            print("INFO: %d of %d (text, audio) pairs changed since the last export" % (len(job_tasks), len(tasks)))
+            if len(job_tasks) == 0:
+                print("INFO: nothing to export, no aeneas job file was created")
+                return None
+            written_hashes = None
+        else:
+            # all the tasks are written, so they are hashed while writing them
+            job_tasks = tasks
+            hashes = []
+            written_hashes = hashes
+        report.timer.reset()
+        timings = job.write_zip(zip_path, zip_name_proc, readers=self.prefs["export_readers"], tasks=job_tasks, hashes=written_hashes)
+        report.timer.lap("zip_write")
+        report.details["zip_write_stages"] = timings
+        if manifest is not None:
+            for task, pair_hash in zip(tasks, hashes):
+                manifest.update(task, pair_hash)
+            try:
+                manifest.save()
+            except (IOError, OSError):
+                print("WARNING: unable to save the export manifest '%s'" % (manifest.path))
+        print("INFO: created aeneas job file '%s'" % (zip_path))
+        print("INFO: export times (s): read %.3f, wait %.3f, write text %.3f, write audio %.3f, write config %.3f, total %.3f" % (
+            timings["read"],
+            timings["wait"],
+            timings["write_text"],
+            timings["write_audio"],
+            timings["write_config"],
+            timings["total"]
+        ))
+        print("INFO: you can upload it to http://aeneasweb.org or process it locally:")
+        print()
+        print("$ python -m aeneas.tools.execute_job %s %s" % (zip_path, self.prefs["save_directory"]))
+        print()
+        return zip_path
+
+
+    def align_pairs(self, pairs):
+        """
+        Align the given (text, audio) pairs with the local aligner
+        selected by the "aligner" preference, and add the resulting
+        SMIL files to the book, without going through
+        the aeneas job ZIP file.
+
+        The files are read from and written to the book
+        in the main process, while the alignment might happen
+        in a pool of worker processes (see the "workers" preference).
+        Audio files are passed by path, if the book is unpacked on disk.
+
+        :param pairs: the list of ((t_href, t_mid), (a_href, a_mid)) pairs
+        :type  pairs: list
+        """
+        if self.prefs["aligner"] not in ALIGNERS:
+            print("ERROR: unknown aligner '%s', use one of: %s" % (self.prefs["aligner"], ", ".join(sorted(ALIGNERS))))
+            return
+        language = self.get_metadatum_value(name="language", default=None)
+        if language is None:
+            language = "en"
+            print("WARNING: unable to determine the language from the OPF file, using '%s' instead" % (language))
+        job = AeneasJob(
+            bk=self.bk,
+            pairs=pairs,
+            language=language,
+            mo_class=self.prefs["mo_class"],
+            smil_directory=self.SMIL_DIRECTORY
+        )
+        jobs = []
+        for task in job.get_tasks():
+            a_path = get_file_path(self.bk, task["a_mid"])
+            jobs.append((self.prefs["aligner"], {
+                "language": language,
+                "mo_class": self.prefs["mo_class"],
+                "t_href": task["t_href"],
+                "t_data": self.bk.readfile(task["t_mid"]),
+                "a_href": task["a_href"],
+                "a_path": a_path,
+                "a_data": self.bk.readfile(task["a_mid"]) if a_path is None else None,
+                "s_name": task["s_name"],
+            }))
+        aligned = 0
+        smil_index = self.get_smil_index()
+        results = self.map_jobs(align_pair, jobs)
+        for (aligner_name, task), (msgs, s_name, data) in zip(jobs, results):
+            print("File %s\n" % task["t_href"])
+            for msg_type, msg_text in msgs:
+                print("    %s: %s" % (msg_type, msg_text))
+            if data is not None:
+                self.store_smil_file(s_name, data, smil_index)
+                aligned += 1
+            print("\n=====================\n")
+        print("Pairs aligned: %d of %d" % (aligned, len(pairs)))
+
+    def get_smil_index(self):
+        """
+        Return a dict mapping the name of each SMIL file
+        in the book to its (manifest id, href) pair.
+
+        Build it once per run, and pass it to store_smil_file(),
+        which keeps it up to date.
+
+        :rtype: dict
+        """
+        smil_index = {}
+        for mid, href, mime in self.bk.manifest_iter():
+            if mime == SMIL_MIME:
+                smil_index.setdefault(os.path.basename(href), (mid, href))
+        return smil_index
+
+    def store_smil_file(self, basename, data, smil_index):
+        """
+        Store the given SMIL code in the book,
+        in the SMIL file with the given name.
+
+        If such a file exists, wherever it is in the book,
+        it is overwritten in place, unless its contents
+        are the same as data, in which case it is not written;
+        otherwise, a new file is added to the SMIL directory.
+
+        Return "added", "replaced" or "unchanged".
+
+        :param basename: the name of the SMIL file
+        :type  basename: str
+        :param data: the SMIL code
+        :type  data: bytes
+        :param smil_index: the index returned by get_smil_index()
+        :type  smil_index: dict
+        :rtype: str
+        """
+        if basename in smil_index:
+            smil_mid, s_href = smil_index[basename]
+            old_data = self.bk.readfile(smil_mid)
+            if not isinstance(old_data, bytes):
+                old_data = old_data.encode("utf-8")
+            if old_data == data:
+                print("INFO: file '%s' unchanged, not written" % (s_href))
+                return "unchanged"
+            self.bk.writefile(smil_mid, data)
+            print("INFO: file '%s' replaced" % (s_href))
+            return "replaced"
+        smil_mid = "smil.%s" % basename
+        s_href = "%s/%s" % (self.SMIL_DIRECTORY, basename)
+        self.bk.addfile(smil_mid, basename, data, mime=SMIL_MIME, properties=None)
+        smil_index[basename] = (smil_mid, s_href)
+        print("INFO: file '%s' added" % (s_href))
+        return "added"
+
+    def create_dummy_smil_file(self, t_href, t_mid, a_href, smil_mid):
+        """
+        This function is not currently used.
+        """
+        import sigil_gumbo_bs4_adapter as gumbo_bs4
+        ret = None
+        xhtml_data = self.bk.readfile(t_mid).encode("utf-8")
+        soup = gumbo_bs4.parse(xhtml_data)
+        attributes = {
+            "class": re.compile(r".*\b" + self.prefs["mo_class"] + r"\b.*"),
+            "id": re.compile(r".*\b" + self.prefs["id_regex"] + r"\b.*")
+        }
+        s_ids = [node.attrs["id"] for node in soup.find_all(attrs=attributes)]
+        if len(s_ids) > 0:
+            s_name = self.smil_name_from_t_href(t_href)
+            s_href = os.path.join(self.SMIL_DIRECTORY, s_name)
+            mid = self.bk.href_to_id(s_href)
+            if mid is not None:
+                print("INFO: file '%s' exists, removing it" % (s_href))
+                self.bk.deletefile(mid)
+            data = build_smil(t_href, a_href, [(s_id, 0.0, 0.0) for s_id in s_ids])
+            self.bk.addfile(smil_mid, s_name, data, mime="application/smil+xml", properties=None)
+            print("INFO: created file '%s'" % (s_href))
+            ret = s_href
+        else:
+            print("ERROR: no SMIL elements in file '%s'" % (t_href))
+            ret = None
+        print()
+        return ret
+
+
+    def import_zip_file(self, path):
+        """
+        Import SMIL files from a ZIP file at path.
+        The SMIL files are matched if their name inside the ZIP container
+        ends with ".smil" (after being lowercased).
+
+        :param path: the path to the ZIP file
+        :type  path: str
+        """
+        try:
+            zip_obj = zipfile.ZipFile(path, "r")
+            try:
+                smils = sorted([name for name in zip_obj.namelist() if name.lower().endswith(".smil")])
+            finally:
+                zip_obj.close()
+        except (IOError, OSError, zipfile.BadZipfile) as exc:
+            print("ERROR: unable to import SMIL files from '%s' (%s)" % (path, exc))
+            return
+        if len(smils) > 0:
+            self.import_smil_sources([(path, name) for name in smils])
+        else:
+            print("WARNING: no SMIL files found in '%s'" % (path))
+
+
+    def import_smil_file(self, path):
+        """
+        Import a single SMIL file, located at path.
+        """
+        self.import_smil_sources([(path, None)])
+
+
+    def import_smil_sources(self, sources):
+        """
+        Import the given SMIL files into the book.
+
+        The SMIL files are read and scanned in a pool of worker
+        processes (see the "workers" preference), then checked
+        against the ids of the text files of the book,
+        indexed once per run. The files passing all the checks
+        are stored in the book, the others are skipped,
+        and a report is printed for each file.
+
+        :param sources: the (path, member) pairs of the SMIL files,
+                        where member is the name of the SMIL file
+                        inside the ZIP file at path, or None
+        :type  sources: list of tuple
+        """
+        jobs = [(path, member, self.SMIL_DIRECTORY) for (path, member) in sources]
+        results = self.map_jobs(read_smil_source, jobs)
+
+        # index the ids of the text files referenced by the SMIL files
+        id_index = {}
+        for msgs, name, data, pars in results:
+            for t_href in set([par[0] for par in pars]):
+                if t_href not in id_index:
+                    t_mid = self.bk.href_to_id(t_href, ow=None)
+                    if t_mid is not None:
+                        id_index[t_href] = collect_ids(self.bk.readfile(t_mid))
+
+        valid = []
+        for msgs, name, data, pars in results:
+            print("File %s\n" % name)
+            if data is not None:
+                msgs = msgs + check_smil(pars, id_index)
+            errors = len([msg for msg in msgs if msg[0] == "ERROR"])
+            for msg_type, msg_text in msgs[:self.MAX_REPORTED_ISSUES]:
+                print("    %s: %s" % (msg_type, msg_text))
+            if len(msgs) > self.MAX_REPORTED_ISSUES:
+                print("    ... and %d more issues" % (len(msgs) - self.MAX_REPORTED_ISSUES))
+            if (data is not None) and (errors == 0):
+                print("    INFO: %d par elements checked" % (len(pars)))
+                valid.append((name, data))
+            else:
+                print("    ERROR: file skipped")
+            print("\n=====================\n")
+
+        smil_index = self.get_smil_index()
+        stored = collections.Counter(self.store_smil_file(name, data, smil_index) for name, data in valid)
+        print()
+        print("SMIL files read:      %d" % (len(results)))
+        print("SMIL files added:     %d" % (stored["added"]))
+        print("SMIL files replaced:  %d" % (stored["replaced"]))
+        print("SMIL files unchanged: %d" % (stored["unchanged"]))
+        print("SMIL files skipped:   %d" % (len(results) - len(valid)))
+
+
+    def shift_smil_files(self, offset, scale):
+        """
+        Rescale and shift the clips of all the SMIL files in the book,
+        mapping each clip value t to t * scale + offset.
+
+        The time spent parsing, shifting, serializing
+        and writing each file is recorded in a timing report,
+        written if the "timing_report" preference is 1
+        (see finish_timing()).
+
+        :param offset: the offset, in seconds
+        :type  offset: float
+        :param scale: the scale factor
+        :type  scale: float
+        """
+        report, profiler = self.start_timing("shift")
+        try:
+            self.shift_smil_clips(offset, scale, report)
+        finally:
+            self.finish_timing(report, profiler)
+
+    def shift_smil_clips(self, offset, scale, report):
+        """
+        Rescale and shift the clips of all the SMIL files in the book,
+        recording the time spent in report.
+
+        All the files are parsed into SmilTimings objects first,
+        so that the arithmetic runs over their arrays in bulk,
+        and the files are rewritten only if all of them
+        could be parsed. Only the clip attributes
+        of each file are rewritten.
+
+        :param offset: the offset, in seconds
+        :type  offset: float
+        :param scale: the scale factor
+        :type  scale: float
+        :param report: the timing report
+        :type  report: TimingReport
+        """
+        files = []
+        for mid, href, mime in self.bk.manifest_iter():
+            if mime != SMIL_MIME:
+                continue
+            timer = report.get_file_timer(href)
+            timer.reset()
+            data = self.bk.readfile(mid)
+            timer.lap("bk_read")
+            try:
+                timings = SmilTimings.parse(data, os.path.dirname(href))
+            except ValueError as exc:
+                print("ERROR: unable to parse file '%s' (%s). No SMIL file was modified." % (href, exc))
+                return
+            timer.lap("parse")
+            if len(timings) == 0:
+                print("WARNING: file '%s' has no par elements, skipped" % (href))
+                continue
+            files.append((mid, href, timings, timer))
+
+        for mid, href, timings, timer in files:
+            timer.reset()
+            timings.shift(offset, scale)
+            timer.lap("shift")
+
+        clips = 0
+        for mid, href, timings, timer in files:
+            timer.reset()
+            data = timings.serialize()
+            timer.lap("serialize")
+            self.bk.writefile(mid, data)
+            timer.lap("bk_write")
+            clips += len(timings)
+            print("INFO: file '%s' shifted (%d clips)" % (href, len(timings)))
+        total = PhaseTimer()
+        for timer in report.files.values():
+            total.update(timer.to_dict())
+        phases = dict((name, wall) for name, (wall, cpu) in total.phases.items())
+        print()
+        print("SMIL files shifted: %d" % (len(files)))
+        print("Clips shifted:      %d" % (clips))
+        print("Time (s):           parse %.3f, shift %.3f, serialize %.3f" % (
+            phases.get("parse", 0.0),
+            phases.get("shift", 0.0),
+            phases.get("serialize", 0.0)
+        ))
+
+
+    def smil_name_from_t_href(self, t_href):
+        """
+        Return the name for the SMIL file associated with
+        a text file with path t_href.
+
+        :param t_href: the path of the text file
+        :type  t_href: str
+        :rtype: str
+        """
+        return AeneasJob.smil_name_from_t_href(t_href)
+
+
+    def get_verbosity(self):
+        """
+        Return the verbosity selected by the "verbosity" preference,
+        or the default one if the preference is not a known verbosity.
+
+        :rtype: str
+        """
+        verbosity = self.prefs["verbosity"]
+        if verbosity not in self.VERBOSITIES:
+            print("WARNING: unknown verbosity '%s', using '%s' instead" % (verbosity, self.DEFAULT_VERBOSITY))
+            verbosity = self.DEFAULT_VERBOSITY
+        return verbosity
+
+
+    def get_engine(self):
+        """
+        Return the MOEdit engine selected by the "engine" preference,
+        or the stream engine if the soup engine is selected
+        but its module (bundled with Sigil) cannot be imported,
+        e.g. when running without Sigil.
+
+        :rtype: str
+        """
+        engine = self.prefs["engine"]
+        if (engine == MOEdit.ENGINE_SOUP) and (not MOEdit.soup_engine_available()):
+            print("WARNING: the soup engine needs the sigil_gumbo_bs4_adapter module (bundled with Sigil), using the stream engine instead")
+            engine = MOEdit.ENGINE_STREAM
+        return engine
+
+    def get_metadata_index(self):
+        """
+        Return the index of the metadata of the book,
+        building it on the first call.
+
+        :rtype: MetadataIndex
+        """
+        if self.metadata_index is None:
+            try:
+                self.metadata_index = MetadataIndex.from_book(self.bk)
+            except ElementTree.ParseError as exc:
+                print("WARNING: unable to parse the metadata of the OPF file (%s), scanning it instead" % (exc))
+                self.metadata_index = MetadataIndex.scan(self.bk.getmetadataxml())
+        return self.metadata_index
+
+    def get_metadatum_value(self, name, default="", first=True):
+        """
+        Return the value of the metadatum name, if present in the OPF,
+        otherwise return the specified default value.
+        If first is True, return only the first value found;
+        otherwise, return the list of values found.
+
+        The values are looked up in the metadata index,
+        see MetadataIndex.get_all() for the supported names.
+
+        :param name: the name of the metadatum to look for
+        :type  name: str
+        :param default: the default value to be returned if the search fails
+        :type  default: str or None
+        :param first: if True, return only the first value found; otherwise,
+                      return the list of values found
+        :type  first: bool
+        :rtype: str or list of str
+        """
+        ret = self.get_metadata_index().get_all(name)
+        if len(ret) == 0:
+            return default
+        elif first:
+            return ret[0]
+        return ret
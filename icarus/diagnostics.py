@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+from __future__ import absolute_import
+from __future__ import print_function
+import array
+
+__author__ = "Alberto Pettarin"
+__copyright__ = "Copyright 2015-2016, Alberto Pettarin (www.albertopettarin.it)"
+__license__ = "MIT"
+__version__ = "0.0.3"
+__email__ = "alberto@albertopettarin.it"
+__status__ = "Production"
+
+class Diagnostics(object):
+    """
+    A compact collector of the diagnostics of MOEdit,
+    one per processed element.
+
+    Each diagnostic is held as a code (see Diagnostics.CODES)
+    and the index of the element name in a table of names,
+    in arrays, and its id value
+    and other value (if any) in lists, so that the strings
+    already computed by MOEdit are referenced, not copied.
+    The messages are formatted only when requested,
+    by format() and iter_messages().
+
+    The diagnostics of a single file, collected by MOEdit,
+    are added to the diagnostics of the whole operation
+    by merge(), which also records the index of their file
+    and counts them by code (see get_counts()).
+    """
+
+    # the diagnostic codes
+    ID_SET = 0
+    MO_ID_KEPT = 1
+    CLASS_ADDED_TO_MO_ID = 2
+    NOMO_IGNORED = 3
+    NO_MO_ID = 4
+    ID_NOT_MO_NOT_CHANGED = 5
+    CLASS_REMOVED = 6
+    ID_REMOVED = 7
+    MO_ID_NOT_REMOVED = 8
+    ID_NOT_MO_NOT_REMOVED = 9
+    MO_ID_REPLACED = 10
+
+    # the (msg_type, category, template) of each code,
+    # where the template is formatted with the name of the element,
+    # its id value and another value (e.g., the id it would get)
+    CODES = [
+        ("INFO", "id set", "element '%(name)s' => setting id '%(value)s'"),
+        ("INFO", "MO id kept", "element '%(name)s' with MO id '%(value)s' => keeping it"),
+        ("INFO", "MO class added to MO id", "element '%(name)s' with MO id '%(value)s' => adding class '%(other)s'"),
+        ("WARN", "ignored, with 'no MO' class", "element '%(name)s' with class 'nomo' => ignoring (it would be '%(other)s')"),
+        ("WARN", "ignored, without MO id", "element '%(name)s' without MO id => not adding class '%(other)s'"),
+        ("WARN", "not changed, with non-MO id", "element '%(name)s' with id '%(value)s' => not changing (it would be '%(other)s')"),
+        ("INFO", "MO class removed", "removed class 'mo' from element '%(name)s'"),
+        ("INFO", "MO id removed", "removed id '%(value)s' from element '%(name)s'"),
+        ("WARN", "MO id not removed", "element '%(name)s' with MO id '%(value)s' => not removing"),
+        ("WARN", "not removed, with non-MO id", "element '%(name)s' with id '%(value)s' => not removing"),
+        ("WARN", "duplicate MO id replaced", "element '%(name)s' with MO id '%(value)s' already used => setting id '%(other)s'"),
+    ]
+
+    def __init__(self):
+        self.codes = array.array("B")
+        self.file_indices = array.array("l")
+        self.names = array.array("l")
+        self.values = []
+        self.others = []
+        self.name_table = []
+        self.name_index = {}
+        self.counts = [0] * len(self.CODES)
+        self.hrefs = []
+
+    def __len__(self):
+        return len(self.codes)
+
+    def get_name_index(self, name):
+        """
+        Return the index of the given element name
+        in the table of names, adding it if needed.
+
+        :param name: the element name
+        :type  name: str
+        :rtype: int
+        """
+        index = self.name_index.get(name)
+        if index is None:
+            index = len(self.name_table)
+            self.name_table.append(name)
+            self.name_index[name] = index
+        return index
+
+    def add(self, code, name, value=None, other=None):
+        """
+        Add a diagnostic of the (single) file.
+
+        :param code: the code (see Diagnostics.CODES)
+        :type  code: int
+        :param name: the name of the element
+        :type  name: str
+        :param value: the id value of the element, if any
+        :type  value: str
+        :param other: the other value in the message, if any
+        :type  other: str
+        """
+        self.codes.append(code)
+        try:
+            self.names.append(self.name_index[name])
+        except KeyError:
+            self.names.append(self.get_name_index(name))
+        self.values.append(value)
+        self.others.append(other)
+
+    def merge(self, other, href):
+        """
+        Add the diagnostics of a single file,
+        with the given href.
+
+        :param other: the diagnostics of the file
+        :type  other: Diagnostics
+        :param href: the href of the file
+        :type  href: str
+        """
+        file_index = len(self.hrefs)
+        self.hrefs.append(href)
+        mapping = [self.get_name_index(name) for name in other.name_table]
+        self.codes.extend(other.codes)
+        self.file_indices.extend(array.array("l", [file_index]) * len(other))
+        self.names.extend(array.array("l", [mapping[index] for index in other.names]))
+        self.values.extend(other.values)
+        self.others.extend(other.others)
+        for code in range(len(self.CODES)):
+            self.counts[code] += other.codes.count(code)
+
+    def count(self, msg_type=None):
+        """
+        Return the number of merged diagnostics of the given type
+        ("INFO" or "WARN"), or of any type if msg_type is None.
+
+        :param msg_type: the message type
+        :type  msg_type: str
+        :rtype: int
+        """
+        return sum(count for code, count in enumerate(self.counts) if (msg_type is None) or (self.CODES[code][0] == msg_type))
+
+    def count_file(self, msg_type=None):
+        """
+        Return the number of diagnostics of a single file
+        of the given type, or of any type if msg_type is None.
+
+        :param msg_type: the message type
+        :type  msg_type: str
+        :rtype: int
+        """
+        return sum(self.codes.count(code) for code in range(len(self.CODES)) if (msg_type is None) or (self.CODES[code][0] == msg_type))
+
+    def get_counts(self):
+        """
+        Return the list of the (msg_type, category, count) tuples
+        of the codes with at least one merged diagnostic.
+
+        :rtype: list of tuple
+        """
+        return [(self.CODES[code][0], self.CODES[code][1], count) for code, count in enumerate(self.counts) if count > 0]
+
+    def format(self, i):
+        """
+        Return the (msg_type, msg_text) message of the i-th diagnostic.
+
+        :param i: the index of the diagnostic
+        :type  i: int
+        :rtype: tuple
+        """
+        msg_type, category, template = self.CODES[self.codes[i]]
+        return (msg_type, template % {
+            "name": self.name_table[self.names[i]],
+            "value": self.values[i] or "",
+            "other": self.others[i] or "",
+        })
+
+    def iter_messages(self, msg_type=None):
+        """
+        Yield the (file_index, msg_type, msg_text) messages
+        of the diagnostics of the given type, if not None,
+        in order. The file index of the diagnostics
+        of a single file is 0.
+
+        :param msg_type: the message type
+        :type  msg_type: str
+        :rtype: generator of tuple
+        """
+        merged = len(self.hrefs) > 0
+        for i in range(len(self.codes)):
+            if (msg_type is not None) and (self.CODES[self.codes[i]][0] != msg_type):
+                continue
+            yield (self.file_indices[i] if merged else 0,) + self.format(i)
+
+    def to_dict(self):
+        """
+        Return the diagnostics of a single file, as a dict
+        which can be serialized as JSON.
+
+        :rtype: dict
+        """
+        return {
+            "codes": self.codes.tolist(),
+            "names": [self.name_table[index] for index in self.names],
+            "values": self.values,
+            "others": self.others,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Return the diagnostics of a single file,
+        from a dict returned by to_dict().
+
+        :param data: the dict
+        :type  data: dict
+        :rtype: Diagnostics
+        """
+        diagnostics = cls()
+        for code, name, value, other in zip(data["codes"], data["names"], data["values"], data["others"]):
+            diagnostics.add(code, name, value, other)
+        return diagnostics
@@ -33,8 +33,12 @@ import struct, array, binascii, re
 
 from itertools import cycle
 
+import copy
+import io
+import time
 import zlib
 import zipfile
+from multiprocessing.pool import ThreadPool
 from zipfile import ZipFile
 
 import unipath
@@ -49,6 +53,42 @@ def SHA1(message):
 
 epub_mimetype = b'application/epub+zip'
 
+# extensions of already compressed media, stored without deflating them
+STORED_EXTENSIONS = frozenset([
+    '.aac',
+    '.flac',
+    '.gif',
+    '.jpeg',
+    '.jpg',
+    '.m4a',
+    '.m4v',
+    '.mp3',
+    '.mp4',
+    '.oga',
+    '.ogg',
+    '.opus',
+    '.png',
+    '.webm',
+    '.webp',
+    '.woff',
+    '.woff2',
+])
+
+
+def compress_type_for(name):
+    """
+    Return the ZIP compression method for the file
+    with the given name: ZIP_STORED for already
+    compressed media, ZIP_DEFLATED otherwise.
+
+    :param name: a file name or path
+    :type  name: str
+    :rtype: int
+    """
+    if os.path.splitext(name)[1].lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
 
 def unzip_epub_to_dir(path_to_epub, destdir):
     f = open(pathof(path_to_epub), 'rb')
@@ -76,11 +116,243 @@ def epub_zip_up_book_contents(ebook_path, epub_filepath):
     files.remove('mimetype')
     for file in files:
         filepath = os.path.join(ebook_path, file)
-        outzip.write(pathof(filepath),pathof(file),zipfile.ZIP_DEFLATED)
+        outzip.write(pathof(filepath),pathof(file),compress_type_for(file))
     outzip.close()
 
 
 
+# size of the chunks used to copy ZIP members
+ZIP_CHUNK_SIZE = 1024 * 1024
+
+# signature and size of the local file header of a ZIP member
+ZIP_LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+ZIP_LOCAL_HEADER_SIZE = 30
+
+# flag bit set if sizes and CRC follow the member data
+ZIP_FLAG_DATA_DESCRIPTOR = 0x08
+
+
+def zip_copy_raw(src_zip, info, dst_zip):
+    """
+    Copy the member described by info from src_zip to dst_zip,
+    without decompressing and recompressing it:
+    its compressed bytes are streamed verbatim, in chunks.
+
+    :param src_zip: the source ZIP file, open for reading
+    :type  src_zip: zipfile.ZipFile
+    :param info: the member of src_zip
+    :type  info: zipfile.ZipInfo
+    :param dst_zip: the destination ZIP file, open for writing
+    :type  dst_zip: zipfile.ZipFile
+    """
+    src = src_zip.fp
+    src.seek(info.header_offset)
+    header = src.read(ZIP_LOCAL_HEADER_SIZE)
+    if header[:4] != ZIP_LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipfile('bad local file header for %s' % info.filename)
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    src.seek(info.header_offset + ZIP_LOCAL_HEADER_SIZE + name_length + extra_length)
+
+    def iter_chunks():
+        remaining = info.compress_size
+        while remaining > 0:
+            chunk = src.read(min(ZIP_CHUNK_SIZE, remaining))
+            if len(chunk) == 0:
+                raise zipfile.BadZipfile('truncated member %s' % info.filename)
+            remaining -= len(chunk)
+            yield chunk
+
+    zinfo = copy.copy(info)
+    # sizes and CRC are known, so they go in the local header
+    zinfo.flag_bits &= ~ZIP_FLAG_DATA_DESCRIPTOR
+    if hasattr(zipfile, '_strip_extra'):
+        # the ZIP64 extra field is rebuilt by FileHeader() if needed
+        zinfo.extra = zipfile._strip_extra(zinfo.extra, (1,))
+    zip_write_raw(dst_zip, zinfo, iter_chunks())
+
+
+def zip_compress(job):
+    """
+    Compress the data of a new ZIP member, and return
+    a (zinfo, compressed) tuple, ready for zip_write_raw().
+
+    Deflating happens outside the ZipFile object,
+    so that several members can be compressed
+    in parallel, by a pool of threads.
+
+    :param job: a (name, data, compress_type, compresslevel) tuple,
+                where compresslevel is None for the zlib default
+    :type  job: tuple
+    :rtype: tuple
+    """
+    name, data, compress_type, compresslevel = job
+    zinfo = zipfile.ZipInfo(name, date_time=time.localtime(time.time())[:6])
+    zinfo.compress_type = compress_type
+    zinfo.external_attr = 0o600 << 16
+    zinfo.file_size = len(data)
+    zinfo.CRC = zlib.crc32(data) & 0xffffffff
+    if compress_type == zipfile.ZIP_DEFLATED:
+        if compresslevel is None:
+            compresslevel = zlib.Z_DEFAULT_COMPRESSION
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+        data = compressor.compress(data) + compressor.flush()
+    elif compress_type != zipfile.ZIP_STORED:
+        raise ValueError('unsupported compression method %d' % compress_type)
+    zinfo.compress_size = len(data)
+    return (zinfo, data)
+
+
+def zip_write_raw(dst_zip, zinfo, chunks):
+    """
+    Append a member to dst_zip, given its ZipInfo,
+    with CRC and sizes already set, and its compressed bytes.
+
+    :param dst_zip: the destination ZIP file, open for writing
+    :type  dst_zip: zipfile.ZipFile
+    :param zinfo: the member
+    :type  zinfo: zipfile.ZipInfo
+    :param chunks: the compressed bytes, in chunks
+    :type  chunks: iterable of bytes
+    """
+    dst = dst_zip.fp
+    zinfo.header_offset = dst.tell()
+    dst.write(zinfo.FileHeader())
+    for chunk in chunks:
+        dst.write(chunk)
+    dst_zip.filelist.append(zinfo)
+    dst_zip.NameToInfo[zinfo.filename] = zinfo
+    if hasattr(dst_zip, 'start_dir'):
+        dst_zip.start_dir = dst.tell()
+    dst_zip._didModify = True
+
+
+
+class EpubZip(object):
+    """
+    An EPUB file, accessed in place, without extracting it.
+
+    Members are read lazily from the ZIP file, and can be
+    streamed with open(); written and removed members are kept
+    aside until save() writes a new EPUB file, where only the
+    written members are compressed again, while the unchanged
+    ones (e.g., audio files) are copied raw from this one.
+    Written media (see STORED_EXTENSIONS) are stored,
+    the other written members are deflated, optionally
+    in parallel and with the given compression level.
+
+    :param path_to_epub: the path of the EPUB file
+    :type  path_to_epub: str
+    """
+
+    def __init__(self, path_to_epub):
+        self.path = path_to_epub
+        self.zip_obj = ZipFile(pathof(path_to_epub), 'r')
+        self.infos = self.zip_obj.infolist()
+        self.names = set([info.filename for info in self.infos])
+        self.written = {}
+        self.added = []
+        self.removed = set()
+
+    def namelist(self):
+        names = [info.filename for info in self.infos if info.filename not in self.removed]
+        return names + [name for name in self.added if name not in self.removed]
+
+    def exists(self, name):
+        return (name in self.names or name in self.written) and (name not in self.removed)
+
+    def is_modified(self):
+        return len(self.written) > 0 or len(self.removed) > 0
+
+    def open(self, name):
+        """
+        Return a binary file object reading the given member,
+        decompressing it on the fly.
+        """
+        if name in self.removed:
+            raise KeyError(name)
+        if name in self.written:
+            return io.BytesIO(self.written[name])
+        return self.zip_obj.open(name, 'r')
+
+    def read(self, name):
+        if name in self.removed:
+            raise KeyError(name)
+        if name in self.written:
+            return self.written[name]
+        return self.zip_obj.read(name)
+
+    def write(self, name, data):
+        if name not in self.names and name not in self.written:
+            self.added.append(name)
+        self.written[name] = data
+        self.removed.discard(name)
+
+    def remove(self, name):
+        if name in self.written:
+            del self.written[name]
+        if name in self.added:
+            self.added.remove(name)
+        if name in self.names:
+            self.removed.add(name)
+
+    def save(self, epub_filepath, compresslevel=None, workers=0):
+        """
+        Write the EPUB file, with its current members,
+        to epub_filepath, which must not be the path of this file.
+
+        The written members are compressed by a pool of workers
+        threads, if workers is positive, while the members
+        before them are being written.
+
+        :param epub_filepath: the path of the new EPUB file
+        :type  epub_filepath: str
+        :param compresslevel: the zlib compression level (0-9),
+                              or None for the zlib default
+        :type  compresslevel: int
+        :param workers: the number of compressing threads
+        :type  workers: int
+        """
+        names = self.namelist()
+        if 'mimetype' not in names:
+            raise Exception('mimetype file is missing')
+        names.remove('mimetype')
+        names = ['mimetype'] + names
+        jobs = []
+        for name in names:
+            if name in self.written:
+                compress_type = zipfile.ZIP_STORED if name == 'mimetype' else compress_type_for(name)
+                jobs.append((name, self.written[name], compress_type, compresslevel))
+        pool = None
+        if workers > 0 and len(jobs) > 1:
+            pool = ThreadPool(processes=workers)
+            compressed = pool.imap(zip_compress, jobs)
+        else:
+            compressed = (zip_compress(job) for job in jobs)
+        outzip = ZipFile(pathof(epub_filepath), 'w', allowZip64=True)
+        try:
+            for name in names:
+                if name in self.written:
+                    zinfo, data = next(compressed)
+                    zip_write_raw(outzip, zinfo, [data])
+                else:
+                    zip_copy_raw(self.zip_obj, self.zip_obj.getinfo(name), outzip)
+        finally:
+            outzip.close()
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+    def close(self):
+        self.zip_obj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+
 def build_container_xml(relative_path_to_opf):
     opf_path = unicode_str(relative_path_to_opf)
     container = '<?xml version="1.0" encoding="UTF-8"?>\n'
@@ -151,3 +423,66 @@ def Idpf_mangle_fonts(encryption_key, data):
     key = cycle(iter(map(bord, encryption_key)))
     encrypt = b''.join([bchr(bord(x)^next(key)) for x in crypt])
     return encrypt + data[1040:]
+
+
+
+# number of leading bytes obfuscated by each algorithm
+ADOBE_MANGLE_LENGTH = 1024
+IDPF_MANGLE_LENGTH = 1040
+
+
+if hasattr(int, 'from_bytes'):
+    def bytes_to_int(data):
+        return int.from_bytes(data, 'big')
+
+    def int_to_bytes(value, length):
+        return value.to_bytes(length, 'big')
+else:
+    def bytes_to_int(data):
+        return int(binascii.hexlify(data), 16)
+
+    def int_to_bytes(value, length):
+        return binascii.unhexlify('%0*x' % (2 * length, value))
+
+
+def mangle_fonts(encryption_key, fonts, length):
+    """
+    Obfuscate (or deobfuscate) the given fonts, XORing
+    their first length bytes with the encryption key,
+    repeated as needed, and return the list of the results.
+
+    Each obfuscated block is XORed as a single integer,
+    and the repeated key is computed once for all the fonts,
+    instead of processing each byte as a Python object,
+    as Adobe_mangle_fonts() and Idpf_mangle_fonts() do.
+
+    :param encryption_key: the encryption key
+    :type  encryption_key: bytes
+    :param fonts: the font data
+    :type  fonts: list of bytes
+    :param length: the number of bytes to be obfuscated
+    :type  length: int
+    :rtype: list of bytes
+    """
+    key = encryption_key * (length // len(encryption_key) + 1)
+    key_value = bytes_to_int(key[:length])
+    mangled = []
+    for data in fonts:
+        if isinstance(data, text_type):
+            raise TypeError('font data must be a byte string')
+        size = min(len(data), length)
+        if size == 0:
+            mangled.append(data)
+            continue
+        # the key applies from the first byte, so drop its tail
+        block = bytes_to_int(data[:size]) ^ (key_value >> (8 * (length - size)))
+        mangled.append(int_to_bytes(block, size) + data[size:])
+    return mangled
+
+
+def Adobe_mangle_fonts_bulk(encryption_key, fonts):
+    return mangle_fonts(encryption_key, fonts, ADOBE_MANGLE_LENGTH)
+
+
+def Idpf_mangle_fonts_bulk(encryption_key, fonts):
+    return mangle_fonts(encryption_key, fonts, IDPF_MANGLE_LENGTH)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+from __future__ import absolute_import
+from __future__ import print_function
+import hashlib
+import io
+import json
+import os
+
+from diagnostics import Diagnostics
+
+__author__ = "Alberto Pettarin"
+__copyright__ = "Copyright 2015-2016, Alberto Pettarin (www.albertopettarin.it)"
+__license__ = "MIT"
+__version__ = "0.0.3"
+__email__ = "alberto@albertopettarin.it"
+__status__ = "Production"
+
+class MOCache(object):
+    """
+    A persistent cache of MOEdit results,
+    stored as one JSON file per entry in the given directory.
+
+    Entries are keyed on a hash of the input XHTML code,
+    the MOEdit settings and the operation, and of the version
+    of the plugin and of the format of the entries,
+    so that a changed file, changed settings or an upgrade
+    (possibly changing the MOEdit results) produce a miss.
+    The total size of the entries is kept under max_size bytes
+    by evicting the least recently used entries in trim().
+
+    :param directory: the path of the cache directory
+    :type  directory: str
+    :param max_size: the maximum total size of the entries, in bytes
+    :type  max_size: int
+    """
+
+    EXTENSION = ".json"
+
+    # increment it when the format of the entries changes
+    FORMAT = 2
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    @classmethod
+    def get_key(cls, settings, operation, data):
+        """
+        Return the cache key for the given job.
+
+        :param settings: the MOEdit constructor arguments
+        :type  settings: dict
+        :param operation: the requested operation
+        :type  operation: str
+        :param data: the source code
+        :type  data: bytes
+        :rtype: str
+        """
+        ctx = hashlib.sha1()
+        ctx.update(("%s/%d" % (__version__, cls.FORMAT)).encode("utf-8"))
+        ctx.update(b"\x00")
+        ctx.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+        ctx.update(b"\x00")
+        ctx.update(operation.encode("utf-8"))
+        ctx.update(b"\x00")
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        ctx.update(data)
+        return ctx.hexdigest()
+
+    def get_path(self, key):
+        """
+        Return the path of the file storing the entry with the given key.
+
+        :param key: the cache key
+        :type  key: str
+        :rtype: str
+        """
+        return os.path.join(self.directory, key + self.EXTENSION)
+
+    def get(self, key):
+        """
+        Return the (diagnostics, out_data, touched) tuple
+        stored for the given key, or None if not cached.
+
+        :param key: the cache key
+        :type  key: str
+        :rtype: tuple
+        """
+        path = self.get_path(key)
+        try:
+            with io.open(path, "r", encoding="utf-8") as file_obj:
+                entry = json.load(file_obj)
+            diagnostics = Diagnostics.from_dict(entry["diagnostics"])
+            # mark the entry as recently used
+            os.utime(path, None)
+        except (IOError, OSError, ValueError, KeyError):
+            # KeyError: an entry written by a previous version
+            self.misses += 1
+            return None
+        self.hits += 1
+        return (diagnostics, entry["out_data"], entry["touched"])
+
+    def put(self, key, result):
+        """
+        Store the given (diagnostics, out_data, touched) tuple
+        for the given key.
+        Failures are ignored, as the cache is only an optimization.
+
+        :param key: the cache key
+        :type  key: str
+        :param result: the result to be stored
+        :type  result: tuple
+        """
+        diagnostics, out_data, touched = result
+        if isinstance(out_data, bytes):
+            out_data = out_data.decode("utf-8")
+        entry = {"diagnostics": diagnostics.to_dict(), "out_data": out_data, "touched": touched}
+        path = self.get_path(key)
+        # the cache might be shared by several processes
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            with io.open(tmp_path, "wb") as file_obj:
+                file_obj.write(json.dumps(entry).encode("utf-8"))
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(tmp_path, path)
+        except (IOError, OSError):
+            pass
+
+    def trim(self):
+        """
+        Delete the least recently used entries,
+        until their total size is at most max_size bytes,
+        and return the number of deleted entries.
+
+        :rtype: int
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if name.endswith(self.EXTENSION):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        deleted = 0
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                deleted += 1
+            except OSError:
+                pass
+            total -= size
+        return deleted
@@ -4,9 +4,19 @@
 
 from __future__ import absolute_import
 from __future__ import print_function
+import collections
 import sys
 import re
 
+from compatibility_utils import unicode_str
+from diagnostics import Diagnostics
+from tagscanner import StartTagDocument
+from tagscanner import collect_ids
+from tagscanner import iter_start_tags
+from tagscanner import splice
+from timing import NULL_TIMER
+from timing import PhaseTimer
+
 __author__ = "Alberto Pettarin"
 __copyright__ = "Copyright 2015-2016, Alberto Pettarin (www.albertopettarin.it)"
 __license__ = "MIT"
@@ -14,7 +24,83 @@ __version__ = "0.0.3"
 __email__ = "alberto@albertopettarin.it"
 __status__ = "Production"
 
-class MOEdit():
+class MORules(object):
+    """
+    The matching rules of MOEdit, compiled once per set of settings:
+    a frozenset of the tag names to process,
+    the MO/no MO class values, and the compiled MO id regex.
+
+    Use MORules.compile() to get a (shared) instance:
+    the instances are cached by settings, keeping
+    the MAX_COMPILED most recently used ones.
+
+    :param tags: the list of tag names to process
+    :type  tags: list of str
+    :param mo_class: the value of the MO class
+    :type  mo_class: str
+    :param nomo_class: the value of the "no MO" class
+    :type  nomo_class: str
+    :param id_regex: the regex string to match id values generated by this plugin
+    :type  id_regex: str
+    """
+
+    __slots__ = ["tags", "mo_class", "nomo_class", "id_pattern"]
+
+    MAX_COMPILED = 16
+
+    COMPILED = collections.OrderedDict()
+
+    def __init__(self, tags, mo_class, nomo_class, id_regex):
+        self.tags = frozenset(tags)
+        self.mo_class = mo_class
+        self.nomo_class = nomo_class
+        self.id_pattern = re.compile(id_regex)
+
+    @classmethod
+    def compile(cls, tags, mo_class, nomo_class, id_regex):
+        """
+        Return the MORules object for the given settings,
+        creating it only if it is not cached.
+
+        :rtype: MORules
+        """
+        key = (frozenset(tags), mo_class, nomo_class, id_regex)
+        rules = cls.COMPILED.pop(key, None)
+        if rules is None:
+            rules = cls(tags, mo_class, nomo_class, id_regex)
+            while len(cls.COMPILED) >= cls.MAX_COMPILED:
+                cls.COMPILED.popitem(last=False)
+        cls.COMPILED[key] = rules
+        return rules
+
+    def classify(self, elem):
+        """
+        Return a (classes, has_mo, has_nomo) tuple, where classes
+        is a new list with the classes of the given element (possibly, empty),
+        and has_mo/has_nomo tell whether the "MO"/"no MO" class
+        is among them, computed in a single pass.
+
+        :param elem: the element
+        :type  elem: elem
+        :rtype: tuple
+        """
+        classes = elem.attrs.get("class")
+        if classes is None:
+            return ([], False, False)
+        if not isinstance(classes, list):
+            classes = [classes]
+        has_mo = False
+        has_nomo = False
+        for c in classes:
+            if c == self.mo_class:
+                has_mo = True
+            elif c == self.nomo_class:
+                has_nomo = True
+        return (list(classes), has_mo, has_nomo)
+
+
+
+class MOEdit(object):
     """
     A class to add/remove MO attributes from a given XHTML file.
 
@@ -30,8 +116,64 @@ class MOEdit():
     :type  id_format: str
     :param existing_ids_only: if 1 (True), add MO class only to tags with (pre-existing) MO ID
     :type  existing_ids_only: int
+    :param engine: the engine used to process the XHTML code:
+                   ENGINE_SOUP parses it into a full (gumbo) soup,
+                   ENGINE_STREAM only tokenizes the start tags of the given tags,
+                   leaving the rest of the source code untouched
+    :type  engine: str
+    :param id_allocator: if not None, new id values are taken from it,
+                         and existing MO id values are kept,
+                         instead of renumbering the elements of each file from 1
+    :type  id_allocator: IdAllocator
+    :param timer: if not None, the timer recording the time spent
+                  in the parse, mutate and serialize phases
+    :type  timer: PhaseTimer
     """
 
+    ENGINE_SOUP = "soup"
+    ENGINE_STREAM = "stream"
+
+    # this is a workaround for Sigil < 0.9.2
+    # see https://github.com/Sigil-Ebook/Sigil/issues/169
+    SELF_CLOSING_TAGS = [
+        #"area",
+        #"base",
+        "br",
+        "col",
+        #"command",
+        "embed",
+        "hr",
+        "img",
+        "input",
+        #"keygen",
+        "link",
+        "meta",
+        #"param",
+        #"source",
+        "track",
+        #"wbr",
+    ]
+    SELF_CLOSING_PATTERN = re.compile(r"></(?:%s)>" % ("|".join(SELF_CLOSING_TAGS)))
+
+    OPERATION_ADD = "add"
+    OPERATION_REMOVE = "remove"
+    OPERATION_REMOVE_MO_CLASS = "remove_mo_class"
+
+    __slots__ = [
+        "tags",
+        "mo_class",
+        "nomo_class",
+        "id_regex",
+        "id_format",
+        "existing_ids_only",
+        "rules",
+        "id_pattern",
+        "engine",
+        "id_allocator",
+        "timer",
+        "touched",
+    ]
+
     def __init__(
             self,
             tags,
@@ -39,7 +181,10 @@ class MOEdit():
             nomo_class,
             id_regex,
             id_format,
-            existing_ids_only
+            existing_ids_only,
+            engine=ENGINE_SOUP,
+            id_allocator=None,
+            timer=None
     ):
         self.tags = tags
         self.mo_class = mo_class
@@ -47,24 +192,12 @@ class MOEdit():
         self.id_regex = id_regex
         self.id_format = id_format
         self.existing_ids_only = (existing_ids_only == 1)
-        self.id_pattern = re.compile(self.id_regex)
-
-    @classmethod
-    def get_classes(cls, elem):
-        """
-        Return a set object, containing the classes
-        of the given element (possibly, empty).
-
-        :param elem: the element
-        :type  elem: elem
-        :rtype: set of str
-        """
-        classes = []
-        if "class" in elem.attrs:
-            classes = elem.attrs["class"]
-            if not isinstance(classes, list):
-                classes = [classes]
-        return set(classes)
+        self.rules = MORules.compile(tags, mo_class, nomo_class, id_regex)
+        self.id_pattern = self.rules.id_pattern
+        self.engine = engine
+        self.id_allocator = id_allocator
+        self.timer = timer if timer is not None else NULL_TIMER
+        self.touched = 0
 
     @classmethod
     def remove_id_attribute(cls, elem):
@@ -105,7 +238,7 @@ class MOEdit():
         :type  elem: elem
         :rtype: bool
         """
-        return self.mo_class in self.get_classes(elem)
+        return self.rules.classify(elem)[1]
 
     def has_nomo_class(self, elem):
         """
@@ -115,7 +248,7 @@ class MOEdit():
         :type  elem: elem
         :rtype: bool
         """
-        return self.nomo_class in self.get_classes(elem)
+        return self.rules.classify(elem)[2]
 
     def add_mo_class(self, elem):
         """
@@ -124,9 +257,10 @@ class MOEdit():
         :param elem: the element
         :type  elem: elem
         """
-        classes = self.get_classes(elem)
-        classes.add(self.mo_class)
-        elem.attrs["class"] = list(classes)
+        classes, has_mo, has_nomo = self.rules.classify(elem)
+        if not has_mo:
+            classes.append(self.mo_class)
+            elem.attrs["class"] = classes
 
     def remove_mo_class(self, elem):
         """
@@ -138,55 +272,89 @@ class MOEdit():
         :param elem: the element
         :type  elem: elem
         """
-        classes = self.get_classes(elem)
-        if self.mo_class in classes:
-            classes.remove(self.mo_class)
+        classes = [c for c in self.rules.classify(elem)[0] if c != self.mo_class]
         if len(classes) > 0:
-            elem.attrs["class"] = list(classes)
+            elem.attrs["class"] = classes
         else:
             del elem.attrs["class"]
 
     def add_mo_attributes(self, data):
         """
         Add MO attributes to tags in the given XHTML file,
-        and return the resulting XHTML string.
+        and return the resulting (diagnostics, out_data) tuple,
+        where diagnostics is a Diagnostics object
+        and out_data is the resulting XHTML string.
+        The number of elements actually modified
+        is stored in self.touched.
 
         :param data: the source code
         :type  data: str
-        :rtype: str
+        :rtype: tuple (Diagnostics, str)
         """
-        import sigil_gumbo_bs4_adapter as gumbo_bs4
-        msgs = []
-        soup = gumbo_bs4.parse(data)
+        diagnostics = Diagnostics()
+        add_diagnostic = diagnostics.add
+        self.timer.reset()
+        soup = self.parse_xhtml_code(data)
+        # the stream engine tokenizes the source code in find_all()
+        nodes = soup.find_all()
+        self.timer.lap("parse")
+        elements = []
+        modified = set()
+        tags = self.rules.tags
         i = 1
-        for node in soup.find_all():
-            if node.name in self.tags:
-                new_id = self.id_format % (i)
-                i += 1
-                if self.has_nomo_class(node):
-                    msgs.append(("WARN", "element '%s' with class 'nomo' => ignoring (it would be '%s')" % (node.name, new_id)))
+        for node in nodes:
+            if node.name in tags:
+                elements.append(node)
+                classes, has_mo, has_nomo = self.rules.classify(node)
+                if self.id_allocator is None:
+                    new_id = self.id_format % (i)
+                    i += 1
+                else:
+                    new_id = self.id_allocator.peek_id()
+                if has_nomo:
+                    add_diagnostic(Diagnostics.NOMO_IGNORED, node.name, None, new_id)
                 else:
                     add = True
                     if self.existing_ids_only:
                         if self.has_mo_id(node):
-                            msgs.append(("INFO", "element '%s' with MO id '%s' => adding class '%s'" % (node.name, node.attrs["id"], self.mo_class)))
+                            add_diagnostic(Diagnostics.CLASS_ADDED_TO_MO_ID, node.name, node.attrs["id"], self.mo_class)
                         else:
-                            msgs.append(("WARN", "element '%s' without MO id => not adding class '%s'" % (node.name, self.mo_class)))
+                            add_diagnostic(Diagnostics.NO_MO_ID, node.name, None, self.mo_class)
                             add = False
                     elif self.has_id_not_mo(node):
-                        msgs.append(("WARN", "element '%s' with id '%s' => not changing (it would be '%s')" % (node.name, node.attrs["id"], new_id)))
+                        add_diagnostic(Diagnostics.ID_NOT_MO_NOT_CHANGED, node.name, node.attrs["id"], new_id)
+                    elif (self.id_allocator is not None) and (self.has_mo_id(node)):
+                        old_id = node.attrs["id"]
+                        if self.id_allocator.keep_id(old_id):
+                            add_diagnostic(Diagnostics.MO_ID_KEPT, node.name, old_id)
+                        else:
+                            # e.g., a copy-pasted paragraph
+                            new_id = self.id_allocator.next_id()
+                            add_diagnostic(Diagnostics.MO_ID_REPLACED, node.name, old_id, new_id)
+                            node.attrs["id"] = new_id
+                            modified.add(len(elements) - 1)
                     else:
-                        msgs.append(("INFO", "element '%s' => setting id '%s'" % (node.name, new_id)))
+                        if self.id_allocator is not None:
+                            new_id = self.id_allocator.next_id()
+                        add_diagnostic(Diagnostics.ID_SET, node.name, new_id)
                         node.attrs["id"] = new_id
-                    if add:
-                        self.add_mo_class(node)
-        out_data = self.output_xhtml_code(soup)
-        return (msgs, out_data)
+                        modified.add(len(elements) - 1)
+                    if add and (not has_mo):
+                        classes.append(self.mo_class)
+                        node.attrs["class"] = classes
+                        modified.add(len(elements) - 1)
+        self.timer.lap("mutate")
+        out_data, self.touched = self.splice_xhtml_code(soup, data, elements, modified)
+        self.timer.lap("serialize")
+        return (diagnostics, out_data)
 
     def remove_mo_attributes(self, data, remove_class=True, remove_id=True):
         """
         Remove MO attributes to tags in the given XHTML file,
-        and return the resulting XHTML string.
+        and return the resulting (diagnostics, out_data) tuple,
+        as add_mo_attributes() does.
+        The number of elements actually modified
+        is stored in self.touched.
 
         :param data: the source code
         :type  data: str
@@ -194,29 +362,135 @@ class MOEdit():
         :type  remove_class: bool
         :param remove_id: remove the MO id attribute
         :type  remove_id: bool
+        :rtype: tuple (Diagnostics, str)
         """
-        msgs = []
+        self.touched = 0
         if (not remove_class) and (not remove_id):
-            return (msgs, data)
-        import sigil_gumbo_bs4_adapter as gumbo_bs4
-        soup = gumbo_bs4.parse(data)
-        for node in soup.find_all():
-            if node.name in self.tags:
-                if self.has_mo_class(node):
+            return (Diagnostics(), data)
+        diagnostics = Diagnostics()
+        add_diagnostic = diagnostics.add
+        self.timer.reset()
+        soup = self.parse_xhtml_code(data)
+        # the stream engine tokenizes the source code in find_all()
+        nodes = soup.find_all()
+        self.timer.lap("parse")
+        elements = []
+        modified = set()
+        tags = self.rules.tags
+        for node in nodes:
+            if node.name in tags:
+                elements.append(node)
+                if self.rules.classify(node)[1]:
                     if remove_class:
                         self.remove_mo_class(node)
-                        msgs.append(("INFO", "removed class 'mo' from element '%s'" % (node.name)))
+                        modified.add(len(elements) - 1)
+                        add_diagnostic(Diagnostics.CLASS_REMOVED, node.name)
                     if remove_id:
                         if (self.existing_ids_only) and (self.has_mo_id(node)):
-                            msgs.append(("WARN", "element '%s' with MO id '%s' => not removing" % (node.name, node.attrs["id"])))
+                            add_diagnostic(Diagnostics.MO_ID_NOT_REMOVED, node.name, node.attrs["id"])
                         elif self.has_mo_id(node):
                             old_id = node.attrs["id"]
                             self.remove_id_attribute(node)
-                            msgs.append(("INFO", "removed id '%s' from element '%s'" % (old_id, node.name)))
+                            modified.add(len(elements) - 1)
+                            add_diagnostic(Diagnostics.ID_REMOVED, node.name, old_id)
                         elif self.has_id_not_mo(node):
-                            msgs.append(("WARN", "element '%s' with id '%s' => not removing" % (node.name, node.attrs["id"])))
-        out_data = self.output_xhtml_code(soup) 
-        return (msgs, out_data)
+                            add_diagnostic(Diagnostics.ID_NOT_MO_NOT_REMOVED, node.name, node.attrs["id"])
+        self.timer.lap("mutate")
+        out_data, self.touched = self.splice_xhtml_code(soup, data, elements, modified)
+        self.timer.lap("serialize")
+        return (diagnostics, out_data)
+
+    @classmethod
+    def soup_engine_available(cls):
+        """
+        Return True if the sigil_gumbo_bs4_adapter module,
+        needed by the soup engine and bundled with Sigil,
+        can be imported.
+
+        :rtype: bool
+        """
+        try:
+            import sigil_gumbo_bs4_adapter
+        except ImportError:
+            return False
+        return True
+
+    def parse_xhtml_code(self, data):
+        """
+        Parse the given XHTML source code with the selected engine,
+        and return the resulting soup object.
+
+        :param data: the source code
+        :type  data: str
+        :rtype: gumbo_bs4 soup or StartTagDocument
+        """
+        if self.engine == self.ENGINE_STREAM:
+            return StartTagDocument(data, names=self.rules.tags)
+        import sigil_gumbo_bs4_adapter as gumbo_bs4
+        return gumbo_bs4.parse(data)
+
+    def splice_xhtml_code(self, soup, data, elements, modified):
+        """
+        Return a tuple (out_data, touched), where out_data is
+        the XHTML source code resulting from the changes made
+        to the given elements of soup, and touched is the number
+        of elements whose attributes actually changed.
+
+        Instead of serializing the whole soup,
+        the id and class attributes of the modified elements
+        are spliced into the corresponding start tags
+        of the original source code, so that the rest
+        of the source code is left untouched.
+        If no element was modified, the source code
+        is returned unchanged.
+        If the start tags found in the source code
+        cannot be matched one-to-one with the elements
+        (e.g., because the parser fixed malformed markup),
+        the whole soup is serialized instead.
+
+        :param soup: the soup object
+        :type  soup: gumbo_bs4 soup or StartTagDocument
+        :param data: the source code soup was parsed from
+        :type  data: str
+        :param elements: the elements with a name in tags, in document order
+        :type  elements: list of elem
+        :param modified: the indices (in elements) of the modified elements
+        :type  modified: set of int
+        :rtype: tuple
+        """
+        if isinstance(soup, StartTagDocument):
+            data = soup.data
+        else:
+            data = unicode_str(data)
+        if len(modified) == 0:
+            return (data, 0)
+        if isinstance(soup, StartTagDocument):
+            tags = elements
+        else:
+            tags = list(iter_start_tags(data, self.rules.tags))
+            if len(tags) != len(elements):
+                return (self.output_xhtml_code(soup), len(modified))
+            for tag, node in zip(tags, elements):
+                if tag.name != node.name:
+                    return (self.output_xhtml_code(soup), len(modified))
+        edits = []
+        touched = 0
+        for index in modified:
+            tag = tags[index]
+            if tag is not elements[index]:
+                node = elements[index]
+                for key in ["id", "class"]:
+                    if key in node.attrs:
+                        tag.attrs[key] = node.attrs[key]
+                    elif key in tag.attrs:
+                        del tag.attrs[key]
+                if ("class" in tag.attrs) and (not isinstance(tag.attrs["class"], list)):
+                    tag.attrs["class"] = tag.attrs["class"].split()
+            tag_edits = tag.get_edits()
+            if len(tag_edits) > 0:
+                touched += 1
+                edits.extend(tag_edits)
+        return (splice(data, edits), touched)
 
     @classmethod
     def output_xhtml_code(cls, soup):
@@ -225,38 +499,19 @@ class MOEdit():
         the corresponding XHTML source code as a string (bytes).
 
         :param soup: the soup object
-        :type  soup: gumbo_bs4 soup
+        :type  soup: gumbo_bs4 soup or StartTagDocument
         :rtype: str
         """
+        if isinstance(soup, StartTagDocument):
+            return soup.serialize()
         out_data = soup.serialize_xhtml()
-        self_closing_tags = [
-            #"area",
-            #"base",
-            "br",
-            "col",
-            #"command",
-            "embed",
-            "hr",
-            "img",
-            "input",
-            #"keygen",
-            "link",
-            "meta",
-            #"param",
-            #"source",
-            "track",
-            #"wbr",
-        ]
         #out_data = soup.prettyprint_xhtml(
         #    indent_level=0,
         #    eventual_encoding="utf-8",
         #    formatter="minimal",
         #    indent_chars="  "
         #)
-        # this is a workaround for Sigil < 0.9.2
-        # see https://github.com/Sigil-Ebook/Sigil/issues/169
-        for tag in self_closing_tags:
-            out_data = out_data.replace("></%s>" % (tag), "/>")
+        out_data = cls.SELF_CLOSING_PATTERN.sub("/>", out_data)
 
         # this is a workaround for Sigil >= 0.9.3
         bad = """<!DOCTYPE html PUBLIC ""
@@ -266,5 +521,157 @@ class MOEdit():
 
         return out_data
 
+    def apply_operation(self, operation, data):
+        """
+        Apply the given operation to the given XHTML file,
+        and return the resulting (diagnostics, out_data) tuple.
+        If the operation is not known, out_data is None.
+        The number of elements actually modified
+        is stored in self.touched.
+
+        :param operation: the requested operation
+        :type  operation: str
+        :param data: the source code
+        :type  data: str
+        :rtype: tuple
+        """
+        if operation == self.OPERATION_ADD:
+            return self.add_mo_attributes(data)
+        elif operation == self.OPERATION_REMOVE:
+            return self.remove_mo_attributes(data, remove_class=True, remove_id=True)
+        elif operation == self.OPERATION_REMOVE_MO_CLASS:
+            return self.remove_mo_attributes(data, remove_class=True, remove_id=False)
+        self.touched = 0
+        return (Diagnostics(), None)
+
+
+
+class IdAllocator(object):
+    """
+    Allocate id values unique across a book.
+
+    The id values are generated from id_format
+    with an increasing counter, skipping the ones
+    already used in the book.
+    The id values emitted during the run, either allocated
+    or kept (see keep_id()), are recorded, so that
+    an existing id value is kept only once.
+
+    :param id_format: the format string (with a "%d" placeholder) to generate id values
+    :type  id_format: str
+    :param used_ids: the id values already used in the book
+    :type  used_ids: set of str
+    """
+
+    __slots__ = ["id_format", "used_ids", "emitted_ids", "counter"]
+
+    def __init__(self, id_format, used_ids=None):
+        self.id_format = id_format
+        self.used_ids = set() if used_ids is None else set(used_ids)
+        self.emitted_ids = set()
+        self.counter = 1
+
+    @classmethod
+    def from_book(cls, bk, id_format):
+        """
+        Create an IdAllocator, reading the id values
+        used in all the text files of the given book.
+
+        :param bk: the book container
+        :type  bk: BookContainer
+        :param id_format: the format string (with a "%d" placeholder) to generate id values
+        :type  id_format: str
+        :rtype: IdAllocator
+        """
+        allocator = cls(id_format)
+        for mid, href in bk.text_iter():
+            allocator.used_ids.update(collect_ids(bk.readfile(mid)))
+        return allocator
+
+    def peek_id(self):
+        """
+        Return the id value that next_id() would return,
+        without allocating it.
+
+        :rtype: str
+        """
+        while (self.id_format % (self.counter)) in self.used_ids:
+            self.counter += 1
+        return self.id_format % (self.counter)
+
+    def next_id(self):
+        """
+        Allocate a new id value, and return it.
+
+        :rtype: str
+        """
+        new_id = self.peek_id()
+        self.used_ids.add(new_id)
+        self.emitted_ids.add(new_id)
+        self.counter += 1
+        return new_id
+
+    def keep_id(self, old_id):
+        """
+        Record that the given existing id value is kept,
+        and return True, unless it was already emitted
+        during this run, in which case return False,
+        and the element must get a new id value.
+
+        :param old_id: the existing id value
+        :type  old_id: str
+        :rtype: bool
+        """
+        if old_id in self.emitted_ids:
+            return False
+        self.used_ids.add(old_id)
+        self.emitted_ids.add(old_id)
+        return True
+
 
 
+def process_xhtml(job, id_allocator=None):
+    """
+    Apply an operation to an XHTML file, as described by job,
+    and return the resulting (diagnostics, out_data, touched) tuple,
+    where diagnostics is a Diagnostics object,
+    and touched is the number of elements actually modified.
+
+    This function is defined at module level, so that it can be
+    sent to the worker processes of a multiprocessing pool.
+    It does not access the Sigil book container.
+
+    :param job: a (settings, operation, data) tuple, where settings
+                is a dict with the MOEdit constructor arguments
+    :type  job: tuple
+    :param id_allocator: the book-wide id allocator, if any;
+                         as it is shared across files,
+                         it can only be used in the main process
+    :type  id_allocator: IdAllocator
+    :rtype: tuple
+    """
+    settings, operation, data = job
+    moedit = MOEdit(id_allocator=id_allocator, **settings)
+    diagnostics, out_data = moedit.apply_operation(operation, data)
+    return (diagnostics, out_data, moedit.touched)
+
+
+def process_xhtml_timed(job, id_allocator=None):
+    """
+    Like process_xhtml(), but return a (result, phases) tuple,
+    where result is the (diagnostics, out_data, touched) tuple
+    and phases is the dict of the wall and CPU time
+    spent in the parse, mutate and serialize phases
+    (see PhaseTimer.to_dict()).
+
+    :param job: a (settings, operation, data) tuple, as in process_xhtml()
+    :type  job: tuple
+    :param id_allocator: the book-wide id allocator, if any
+    :type  id_allocator: IdAllocator
+    :rtype: tuple
+    """
+    settings, operation, data = job
+    timer = PhaseTimer()
+    moedit = MOEdit(id_allocator=id_allocator, timer=timer, **settings)
+    diagnostics, out_data = moedit.apply_operation(operation, data)
+    return ((diagnostics, out_data, moedit.touched), timer.to_dict())
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+from __future__ import absolute_import
+from __future__ import print_function
+import re
+import xml.etree.ElementTree as ElementTree
+
+from compatibility_utils import unescapeit
+from compatibility_utils import unicode_str
+from tagscanner import iter_start_tags
+
+__author__ = "Alberto Pettarin"
+__copyright__ = "Copyright 2015-2016, Alberto Pettarin (www.albertopettarin.it)"
+__license__ = "MIT"
+__version__ = "0.0.3"
+__email__ = "alberto@albertopettarin.it"
+__status__ = "Production"
+
+DC_NS = "http://purl.org/dc/elements/1.1/"
+OPF_NS = "http://www.idpf.org/2007/opf"
+
+# the namespace prefixes which can be used in lookups
+PREFIXES = {
+    "dc": DC_NS,
+    "opf": OPF_NS,
+}
+
+# the XML declaration, if any, preceding the metadata element
+XML_DECLARATION_PATTERN = re.compile(r"^\s*<\?xml[^>]*\?>")
+
+# a namespace declaration, in the package element
+# group 1: prefix (None for the default namespace),
+# group 2, 3: double quoted, single quoted namespace
+NS_DECLARATION_PATTERN = re.compile(r"""\sxmlns(?::([A-Za-z_][\w.-]*))?\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+
+# a prefixed element or attribute name
+# group 1: prefix
+PREFIXED_NAME_PATTERN = re.compile(r"""(?:</?|\s)([A-Za-z_][\w.-]*):[A-Za-z_][\w.-]*(?=[\s/>=])""")
+
+# the namespace given to the prefixes not declared anywhere
+# (e.g., "calibre:"), so that the metadata can still be parsed
+UNDECLARED_NS = "urn:x-undeclared-prefix:%s"
+
+# an element with text content, for the tolerant scan
+# group 1: prefix, group 2: local name, group 3: text
+ELEMENT_PATTERN = re.compile(r"<(?:([A-Za-z_][\w.-]*):)?([A-Za-z_][\w.-]*)(?:\s[^>]*)?>([^<]*)</")
+
+# the text content following a start tag, for the tolerant scan
+TEXT_PATTERN = re.compile(r"([^<]*)<")
+
+class MetadataIndex(object):
+    """
+    An index of the metadata of a book,
+    built once from the metadata element of the OPF file.
+
+    Metadata elements are indexed by their qualified name,
+    in ElementTree notation (e.g., "{http://purl.org/dc/elements/1.1/}language"),
+    EPUB 3 meta elements by their property attribute
+    (e.g., "dcterms:modified" or "media:duration"),
+    and EPUB 2 meta elements by their name attribute.
+
+    Meta elements with a refines attribute are indexed
+    separately, by the id they refine and by their property.
+
+    The metadata element is parsed with the namespace declarations
+    of the package element, if given; prefixes declared nowhere
+    get a placeholder namespace, instead of making the parse fail.
+
+    :param metadata_xml: the metadata element of the OPF file
+    :type  metadata_xml: str
+    :param package_tag: the start tag of the package element of the OPF file
+    :type  package_tag: str
+    """
+
+    def __init__(self, metadata_xml=None, package_tag=None):
+        self.values = {}
+        self.refines = {}
+        self.ids = {}
+        if metadata_xml is not None:
+            self.parse(metadata_xml, package_tag)
+
+    @classmethod
+    def from_book(cls, bk):
+        """
+        Return the index of the metadata of the given book.
+        Raise ElementTree.ParseError if it cannot be parsed.
+
+        :param bk: the book container
+        :type  bk: BookContainer
+        :rtype: MetadataIndex
+        """
+        package_tag = bk.getpackagetag() if hasattr(bk, "getpackagetag") else None
+        return cls(bk.getmetadataxml(), package_tag)
+
+    @classmethod
+    def scan(cls, metadata_xml):
+        """
+        Return the index of the given metadata element,
+        built with a tolerant scan of its source code,
+        for metadata which cannot be parsed as XML.
+
+        :param metadata_xml: the metadata element of the OPF file
+        :type  metadata_xml: str
+        :rtype: MetadataIndex
+        """
+        index = cls()
+        index.parse_tolerant(metadata_xml)
+        return index
+
+    @classmethod
+    def get_wrapper(cls, data, package_tag):
+        """
+        Return the format string of a wrapper element,
+        declaring the namespaces of the given package element,
+        the usual ones, and a placeholder namespace
+        for each other prefix used in data.
+
+        :param data: the metadata element
+        :type  data: str
+        :param package_tag: the start tag of the package element, if any
+        :type  package_tag: str
+        :rtype: str
+        """
+        namespaces = {None: OPF_NS}
+        namespaces.update(PREFIXES)
+        for prefix, double_quoted, single_quoted in NS_DECLARATION_PATTERN.findall(unicode_str(package_tag or "")):
+            namespaces[prefix or None] = double_quoted or single_quoted
+        for prefix in set(PREFIXED_NAME_PATTERN.findall(data)):
+            if (prefix not in namespaces) and (prefix not in ["xml", "xmlns"]):
+                namespaces[prefix] = UNDECLARED_NS % (prefix)
+        declarations = ['xmlns="%s"' % (namespaces.pop(None))]
+        for prefix in sorted(namespaces):
+            declarations.append('xmlns:%s="%s"' % (prefix, namespaces[prefix].replace("&", "&amp;").replace('"', "&quot;")))
+        return "<wrapper %s>%%s</wrapper>" % (" ".join(declarations))
+
+    def add(self, key, value, refines=None, elem_id=None):
+        """
+        Index the given value.
+
+        :param key: the key (see the class description)
+        :type  key: str
+        :param value: the value
+        :type  value: str
+        :param refines: the refines attribute, if any
+        :type  refines: str
+        :param elem_id: the id of the element, if any
+        :type  elem_id: str
+        """
+        if (refines is not None) and refines.startswith("#"):
+            self.refines.setdefault(refines[1:], {}).setdefault(key, []).append(value)
+        else:
+            self.values.setdefault(key, []).append(value)
+        if elem_id is not None:
+            self.ids[elem_id] = (key, value)
+
+    def parse(self, metadata_xml, package_tag=None):
+        """
+        Index the given metadata element.
+        Raise ElementTree.ParseError if it cannot be parsed.
+
+        :param metadata_xml: the metadata element of the OPF file
+        :type  metadata_xml: str
+        :param package_tag: the start tag of the package element of the OPF file
+        :type  package_tag: str
+        """
+        data = XML_DECLARATION_PATTERN.sub("", unicode_str(metadata_xml))
+        root = ElementTree.fromstring((self.get_wrapper(data, package_tag) % (data)).encode("utf-8"))
+        for metadata in root:
+            for elem in metadata:
+                value = (elem.text or "").strip()
+                if elem.tag in ["meta", "{%s}meta" % (OPF_NS)]:
+                    key = elem.get("property")
+                    if key is None:
+                        key = elem.get("name")
+                        value = (elem.get("content") or "").strip()
+                    if key is None:
+                        continue
+                else:
+                    key = elem.tag
+                self.add(key, value, elem.get("refines"), elem.get("id"))
+
+    def parse_tolerant(self, metadata_xml):
+        """
+        Index the given metadata element, scanning its source code:
+        elements with text content are indexed by their local name,
+        as Dublin Core elements unless they have a prefix
+        other than "dc", and meta elements as parse() does.
+
+        :param metadata_xml: the metadata element of the OPF file
+        :type  metadata_xml: str
+        """
+        data = unicode_str(metadata_xml)
+        for prefix, local, text in ELEMENT_PATTERN.findall(data):
+            if local in ["meta", "metadata"]:
+                continue
+            if prefix in ["", "dc"]:
+                key = "{%s}%s" % (DC_NS, local)
+            else:
+                key = self.expand("%s:%s" % (prefix, local))
+            self.add(key, unescapeit(text).strip())
+        for tag in iter_start_tags(data, frozenset(["meta", "opf:meta"])):
+            key = tag.attrs.get("property")
+            if key is not None:
+                # the text content follows the start tag
+                match = TEXT_PATTERN.match(data, tag.end)
+                value = unescapeit(match.group(1)).strip() if match is not None else ""
+            else:
+                key = tag.attrs.get("name")
+                value = tag.attrs.get("content", "").strip()
+            if key is not None:
+                self.add(key, value, tag.attrs.get("refines"), tag.attrs.get("id"))
+
+    @classmethod
+    def expand(cls, name):
+        """
+        Return the key of the given name in the index.
+
+        A name with a known prefix ("dc:language") is expanded
+        to its qualified name, a name without a prefix ("language")
+        is taken as a Dublin Core element, and any other name
+        (a qualified name, or a meta property or name) is returned as is.
+
+        :param name: the name
+        :type  name: str
+        :rtype: str
+        """
+        if name.startswith("{"):
+            return name
+        if ":" in name:
+            prefix, local = name.split(":", 1)
+            if prefix in PREFIXES:
+                return "{%s}%s" % (PREFIXES[prefix], local)
+            return name
+        return "{%s}%s" % (DC_NS, name)
+
+    def get_all(self, name):
+        """
+        Return the list of the non-empty values of the given name,
+        in document order.
+        A name without a prefix which is not a Dublin Core element
+        is looked up as a meta name, too (e.g., "cover").
+
+        :param name: the name (see expand())
+        :type  name: str
+        :rtype: list of str
+        """
+        values = self.values.get(self.expand(name))
+        if values is None:
+            values = self.values.get(name, [])
+        return [value for value in values if len(value) > 0]
+
+    def get(self, name, default=None):
+        """
+        Return the first non-empty value of the given name,
+        or default if there is none.
+
+        :param name: the name (see expand())
+        :type  name: str
+        :param default: the default value
+        :type  default: str
+        :rtype: str
+        """
+        values = self.get_all(name)
+        if len(values) == 0:
+            return default
+        return values[0]
+
+    def get_refinements(self, target_id, name):
+        """
+        Return the list of the values of the meta elements
+        with the given property (or name) refining the element,
+        or the manifest item, with the given id.
+
+        :param target_id: the id of the refined element or item
+        :type  target_id: str
+        :param name: the property
+        :type  name: str
+        :rtype: list of str
+        """
+        return list(self.refines.get(target_id, {}).get(name, []))
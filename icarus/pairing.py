@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+from __future__ import absolute_import
+from __future__ import print_function
+import io
+import os
+import re
+
+__author__ = "Alberto Pettarin"
+__copyright__ = "Copyright 2015-2016, Alberto Pettarin (www.albertopettarin.it)"
+__license__ = "MIT"
+__version__ = "0.0.3"
+__email__ = "alberto@albertopettarin.it"
+__status__ = "Production"
+
+NUMBER_PATTERN = re.compile(r"\d+")
+
+PAIR_SEPARATOR = "<->"
+
+def get_stem(href):
+    """
+    Return the basename of the given href, without extension.
+
+    :param href: the href path
+    :type  href: str
+    :rtype: str
+    """
+    base = os.path.basename(href)
+    if "." in base:
+        base = ".".join(base.split(".")[:-1])
+    return base
+
+
+def get_common_prefix(stems):
+    """
+    Return the longest common prefix of the given stems,
+    shortened so that it does not end inside a number.
+
+    :param stems: the stems
+    :type  stems: list of str
+    :rtype: str
+    """
+    if len(stems) < 2:
+        return ""
+    prefix = os.path.commonprefix(stems)
+    while (len(prefix) > 0) and prefix[-1].isdigit():
+        prefix = prefix[:-1]
+    return prefix
+
+
+class Pairing(object):
+    """
+    The result of pairing text files with audio files.
+
+    :param pairs: the (t_href, a_href) pairs, in text file order
+    :type  pairs: list of tuple
+    :param unmatched: the hrefs of the files without a match
+    :type  unmatched: list of str
+    :param ambiguous: the lists of hrefs of the files
+                      sharing the same key with other files
+    :type  ambiguous: list of list of str
+    """
+
+    def __init__(self, pairs, unmatched, ambiguous):
+        self.pairs = pairs
+        self.unmatched = unmatched
+        self.ambiguous = ambiguous
+
+    def get_report(self):
+        """
+        Return the lines reporting the unmatched and ambiguous files.
+
+        :rtype: list of str
+        """
+        report = []
+        for href in self.unmatched:
+            report.append("unmatched: %s" % (href))
+        for hrefs in self.ambiguous:
+            report.append("ambiguous: %s" % (", ".join(hrefs)))
+        return report
+
+
+
+class PairingEngine(object):
+    """
+    Pair the text files of a book with its audio files,
+    indexing both by a key computed from their hrefs,
+    according to the given strategy:
+
+    * "first_number": the first number in the basename
+      (the basename, if it has no number);
+    * "all_numbers": the tuple of all the numbers in the basename
+      (the basename, if it has no number);
+    * "common_prefix": the basename, without the prefix
+      common to all the text files (respectively, audio files);
+    * "mapping": the explicit pairs listed in a mapping file,
+      one "text href <-> audio href" pair per line.
+
+    Files sharing a key with another file of the same kind
+    are not paired, but reported as ambiguous.
+
+    :param strategy: the pairing strategy
+    :type  strategy: str
+    :param mapping_path: the path of the mapping file,
+                         for the "mapping" strategy
+    :type  mapping_path: str
+    """
+
+    STRATEGY_ALL_NUMBERS = "all_numbers"
+    STRATEGY_COMMON_PREFIX = "common_prefix"
+    STRATEGY_FIRST_NUMBER = "first_number"
+    STRATEGY_MAPPING = "mapping"
+
+    STRATEGIES = [
+        STRATEGY_FIRST_NUMBER,
+        STRATEGY_ALL_NUMBERS,
+        STRATEGY_COMMON_PREFIX,
+        STRATEGY_MAPPING
+    ]
+
+    def __init__(self, strategy, mapping_path=None):
+        if strategy not in self.STRATEGIES:
+            raise ValueError("unknown pairing strategy '%s'" % (strategy))
+        self.strategy = strategy
+        self.mapping_path = mapping_path
+
+    @classmethod
+    def key_first_number(cls, stem):
+        """
+        Return the first number in the given stem, as an int,
+        or the stem itself if it does not contain numbers.
+
+        :param stem: the basename, without extension
+        :type  stem: str
+        :rtype: int or str
+        """
+        match = NUMBER_PATTERN.search(stem)
+        if match is None:
+            return stem
+        return int(match.group(0))
+
+    @classmethod
+    def key_all_numbers(cls, stem):
+        """
+        Return the tuple of the numbers in the given stem, as ints,
+        or the stem itself if it does not contain numbers.
+
+        :param stem: the basename, without extension
+        :type  stem: str
+        :rtype: tuple of int or str
+        """
+        numbers = tuple(int(number) for number in NUMBER_PATTERN.findall(stem))
+        if len(numbers) == 0:
+            return stem
+        return numbers
+
+    def get_keys(self, hrefs):
+        """
+        Return the list of the keys of the given hrefs.
+
+        :param hrefs: the hrefs
+        :type  hrefs: list of str
+        :rtype: list
+        """
+        stems = [get_stem(href) for href in hrefs]
+        if self.strategy == self.STRATEGY_FIRST_NUMBER:
+            return [self.key_first_number(stem) for stem in stems]
+        if self.strategy == self.STRATEGY_ALL_NUMBERS:
+            return [self.key_all_numbers(stem) for stem in stems]
+        prefix = get_common_prefix(stems)
+        return [stem[len(prefix):] for stem in stems]
+
+    def read_mapping(self):
+        """
+        Return the list of (t_href, a_href) pairs
+        listed in the mapping file.
+        Empty lines and lines starting with "#" are ignored.
+
+        :rtype: list of tuple
+        """
+        pairs = []
+        with io.open(self.mapping_path, "r", encoding="utf-8") as file_obj:
+            for line in file_obj:
+                line = line.strip()
+                if (len(line) == 0) or line.startswith("#"):
+                    continue
+                arr = line.split(PAIR_SEPARATOR)
+                if len(arr) != 2:
+                    raise ValueError("invalid line in mapping file: '%s'" % (line))
+                pairs.append((arr[0].strip(), arr[1].strip()))
+        return pairs
+
+    def index(self, hrefs):
+        """
+        Return the list of the keys of the given hrefs,
+        and a dict mapping each key to the list
+        of the hrefs with that key.
+
+        :param hrefs: the hrefs
+        :type  hrefs: list of str
+        :rtype: tuple
+        """
+        keys = self.get_keys(hrefs)
+        index = {}
+        for key, href in zip(keys, hrefs):
+            index.setdefault(key, []).append(href)
+        return (keys, index)
+
+    def pair(self, t_hrefs, a_hrefs):
+        """
+        Pair the given text files with the given audio files.
+
+        :param t_hrefs: the hrefs of the text files, in book order
+        :type  t_hrefs: list of str
+        :param a_hrefs: the hrefs of the audio files
+        :type  a_hrefs: list of str
+        :rtype: Pairing
+        """
+        if self.strategy == self.STRATEGY_MAPPING:
+            t_keys = t_hrefs
+            t_index, a_index = self.index_mapping(t_hrefs, a_hrefs)
+        else:
+            t_keys, t_index = self.index(t_hrefs)
+            a_keys, a_index = self.index(a_hrefs)
+        ambiguous = []
+        seen = set()
+        for hrefs in list(t_index.values()) + list(a_index.values()):
+            if (len(hrefs) > 1) and (tuple(hrefs) not in seen):
+                seen.add(tuple(hrefs))
+                ambiguous.append(hrefs)
+        pairs = []
+        matched = set()
+        for key, t_href in zip(t_keys, t_hrefs):
+            a_list = a_index.get(key, [])
+            if (len(t_index.get(key, [])) == 1) and (len(a_list) == 1):
+                pairs.append((t_href, a_list[0]))
+                matched.add(t_href)
+                matched.add(a_list[0])
+        unmatched = [href for href in t_hrefs + a_hrefs if href not in matched]
+        return Pairing(pairs, unmatched, ambiguous)
+
+    def index_mapping(self, t_hrefs, a_hrefs):
+        """
+        Index the pairs listed in the mapping file
+        which refer to the given text and audio files,
+        using the text file href as the key.
+
+        Return the text and audio indices, as in index():
+        a text file listed more than once in the mapping file,
+        with different audio files, is associated to all of them
+        in the audio index; an audio file listed with more than
+        one text file makes those text files share the same key.
+
+        :param t_hrefs: the hrefs of the text files
+        :type  t_hrefs: list of str
+        :param a_hrefs: the hrefs of the audio files
+        :type  a_hrefs: list of str
+        :rtype: tuple
+        """
+        t_set = set(t_hrefs)
+        a_set = set(a_hrefs)
+        t_index = {}
+        a_index = {}
+        t_by_a = {}
+        for t_href, a_href in self.read_mapping():
+            if (t_href in t_set) and (a_href in a_set):
+                t_list = t_by_a.setdefault(a_href, [])
+                if t_href not in t_list:
+                    t_list.append(t_href)
+                a_list = a_index.setdefault(t_href, [])
+                if a_href not in a_list:
+                    a_list.append(a_href)
+        for t_list in t_by_a.values():
+            for t_href in t_list:
+                merged = t_index.setdefault(t_href, [])
+                merged.extend([t for t in t_list if t not in merged])
+        return (t_index, a_index)
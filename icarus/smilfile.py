@@ -0,0 +1,500 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+from __future__ import absolute_import
+from __future__ import print_function
+from array import array
+import posixpath
+import re
+import zipfile
+
+from compatibility_utils import unicode_str
+from tagscanner import iter_start_tags
+from tagscanner import splice
+
+__author__ = "Alberto Pettarin"
+__copyright__ = "Copyright 2015-2016, Alberto Pettarin (www.albertopettarin.it)"
+__license__ = "MIT"
+__version__ = "0.0.3"
+__email__ = "alberto@albertopettarin.it"
+__status__ = "Production"
+
+SMIL_MIME = "application/smil+xml"
+
+SMIL_HEADER = """<smil xmlns="http://www.w3.org/ns/SMIL" xmlns:epub="http://www.idpf.org/2007/ops" version="3.0">
+ <body>
+  <seq id="seq1" epub:textref="../%s">"""
+SMIL_ROW = """   <par id="%s"><text src="../%s#%s"/><audio clipBegin="%s" clipEnd="%s" src="../%s"/></par>"""
+SMIL_FOOTER = """  </seq>
+ </body>
+</smil>"""
+
+def format_clock(seconds):
+    """
+    Format the given time value as a SMIL clock value,
+    in seconds with millisecond precision (e.g., "12.345").
+
+    :param seconds: the time value, in seconds
+    :type  seconds: float
+    :rtype: str
+    """
+    return "%.3f" % (seconds)
+
+
+def build_smil(t_href, a_href, fragments):
+    """
+    Return the SMIL code, as UTF-8 bytes, synchronizing
+    the text file t_href with the audio file a_href,
+    with a par element per (identifier, begin, end) fragment.
+
+    :param t_href: the path of the text file, relative to OEBPS
+    :type  t_href: str
+    :param a_href: the path of the audio file, relative to OEBPS
+    :type  a_href: str
+    :param fragments: the (identifier, begin, end) fragments
+    :type  fragments: list of tuple
+    :rtype: bytes
+    """
+    return SmilTimings.from_fragments(t_href, a_href, fragments).serialize()
+
+
+# a SMIL clock value: full/partial clock value or timecount
+# group 1: hours, group 2: minutes, group 3: seconds (clock values)
+# group 4: timecount, group 5: metric
+CLOCK_PATTERN = re.compile(r"^\s*(?:(?:(\d+):)?(\d+):(\d+(?:\.\d*)?)|(\d+(?:\.\d*)?|\.\d+)(h|min|s|ms)?)\s*$")
+
+CLOCK_METRICS = {
+    None: 1.0,
+    "h": 3600.0,
+    "min": 60.0,
+    "s": 1.0,
+    "ms": 0.001,
+}
+
+def format_clock_like(seconds, value):
+    """
+    Format the given time value as a SMIL clock value
+    in the same syntax of the given clock value
+    (full or partial clock value, timecount with or without metric),
+    with millisecond precision.
+
+    :param seconds: the time value, in seconds
+    :type  seconds: float
+    :param value: the clock value to imitate (e.g., "0:00:01.500")
+    :type  value: str
+    :rtype: str
+    """
+    match = CLOCK_PATTERN.match(value)
+    if match is None:
+        return format_clock(seconds)
+    hours, minutes, old_seconds, timecount, metric = match.groups()
+    if minutes is not None:
+        milliseconds = int(round(seconds * 1000))
+        minutes, milliseconds = divmod(milliseconds, 60000)
+        if (hours is not None) or (minutes >= 60):
+            hours, minutes = divmod(minutes, 60)
+            return "%d:%02d:%06.3f" % (hours, minutes, milliseconds / 1000.0)
+        return "%02d:%06.3f" % (minutes, milliseconds / 1000.0)
+    if metric == "ms":
+        return "%dms" % (int(round(seconds * 1000)))
+    if metric is not None:
+        # h and min timecounts would need more decimals
+        return "%ss" % (format_clock(seconds))
+    return format_clock(seconds)
+
+
+def parse_clock(value):
+    """
+    Parse the given SMIL clock value, and return it in seconds,
+    or None if it is not a valid clock value.
+
+    :param value: the clock value (e.g., "1.5", "0:00:01.500", "1500ms")
+    :type  value: str
+    :rtype: float
+    """
+    match = CLOCK_PATTERN.match(value)
+    if match is None:
+        return None
+    hours, minutes, seconds, timecount, metric = match.groups()
+    if timecount is not None:
+        return float(timecount) * CLOCK_METRICS[metric]
+    return int(hours or 0) * 3600.0 + int(minutes) * 60.0 + float(seconds)
+
+
+def resolve_src(smil_directory, src):
+    """
+    Split the given src attribute value of a SMIL file
+    in the given directory into the path of the referenced file,
+    relative to the same base as smil_directory, and its fragment.
+
+    :param smil_directory: the directory of the SMIL file
+    :type  smil_directory: str
+    :param src: the attribute value (e.g., "../Text/p001.xhtml#f000001")
+    :type  src: str
+    :rtype: tuple
+    """
+    path, sep, fragment = src.partition("#")
+    return (posixpath.normpath(posixpath.join(smil_directory, path)), fragment)
+
+
+# the start tags of a par element and of its children
+SMIL_PAR_TAGS = frozenset(["par", "text", "audio"])
+
+def iter_pars(data):
+    """
+    Scan the given SMIL code, and yield a (par, text, audio) tuple
+    of StartTag objects for each par element, in document order,
+    with its text and audio children in either order.
+    text or audio is None if the par element does not have it,
+    and par is None for text and audio elements outside a par element.
+
+    :param data: the SMIL code
+    :type  data: str
+    :rtype: generator of tuple
+    """
+    par = None
+    text = None
+    audio = None
+    for tag in iter_start_tags(data, SMIL_PAR_TAGS):
+        name = tag.name
+        if (name == "par") or ((name == "text") and (text is not None)) or ((name == "audio") and (audio is not None)):
+            if (par is not None) or (text is not None) or (audio is not None):
+                yield (par, text, audio)
+            par = None
+            text = None
+            audio = None
+        if name == "par":
+            par = tag
+        elif name == "text":
+            text = tag
+        else:
+            audio = tag
+    if (par is not None) or (text is not None) or (audio is not None):
+        yield (par, text, audio)
+
+
+def scan_smil(data, smil_directory):
+    """
+    Scan the given SMIL code, and return the list
+    of its par elements, in document order, each being a
+    (t_href, fragment, a_href, clip_begin, clip_end) tuple,
+    with t_href and a_href resolved against smil_directory,
+    and the clip values in seconds (None if missing or invalid).
+
+    :param data: the SMIL code
+    :type  data: str or bytes (UTF-8)
+    :param smil_directory: the directory of the SMIL file
+    :type  smil_directory: str
+    :rtype: list of tuple
+    """
+    pars = []
+    for par, text, audio in iter_pars(unicode_str(data)):
+        if (text is None) or (audio is None):
+            continue
+        t_href, fragment = resolve_src(smil_directory, text.attrs.get("src", ""))
+        a_href = resolve_src(smil_directory, audio.attrs.get("src", ""))[0]
+        clip_begin = parse_clock(audio.attrs.get("clipbegin", "0"))
+        clip_end = parse_clock(audio.attrs["clipend"]) if "clipend" in audio.attrs else None
+        pars.append((t_href, fragment, a_href, clip_begin, clip_end))
+    return pars
+
+
+def read_smil_source(job):
+    """
+    Read and scan a SMIL file, as described by job,
+    and return the resulting (msgs, name, data, pars) tuple,
+    where data is the SMIL code (None if it cannot be read),
+    and pars is the list returned by scan_smil().
+
+    This function is defined at module level, so that it can be
+    sent to the worker processes of a multiprocessing pool.
+    It does not access the Sigil book container.
+
+    :param job: a (path, member, smil_directory) tuple,
+                where member is the name of the SMIL file
+                inside the ZIP file at path, or None
+                if path is the SMIL file itself
+    :type  job: tuple
+    :rtype: tuple
+    """
+    path, member, smil_directory = job
+    name = posixpath.basename(member) if member is not None else posixpath.basename(path.replace("\\", "/"))
+    try:
+        if member is not None:
+            zip_obj = zipfile.ZipFile(path, "r")
+            try:
+                data = zip_obj.read(member)
+            finally:
+                zip_obj.close()
+        else:
+            with open(path, "rb") as file_obj:
+                data = file_obj.read()
+        pars = scan_smil(data, smil_directory)
+    except (IOError, OSError, zipfile.BadZipfile, KeyError, UnicodeDecodeError) as exc:
+        return ([("ERROR", "unable to read SMIL file: %s" % (exc))], name, None, [])
+    return ([], name, data, pars)
+
+
+def check_smil(pars, id_index):
+    """
+    Check the par elements of a SMIL file, as returned by scan_smil(),
+    and return the list of the (msg_type, msg_text) issues found.
+
+    Each text fragment must be an id of the referenced text file,
+    as listed in id_index, and the audio clips must be monotonic:
+    each clip must not end before it begins,
+    nor begin before the end of the previous clip of the same audio file.
+
+    :param pars: the par elements
+    :type  pars: list of tuple
+    :param id_index: a dict mapping the path of each text file of the book
+                     to the set of its id values
+    :type  id_index: dict
+    :rtype: list of tuple
+    """
+    msgs = []
+    if len(pars) == 0:
+        msgs.append(("ERROR", "no par elements"))
+    last_end = {}
+    for i, (t_href, fragment, a_href, clip_begin, clip_end) in enumerate(pars, 1):
+        if t_href not in id_index:
+            msgs.append(("ERROR", "par %d: text file '%s' not in the book" % (i, t_href)))
+        elif fragment not in id_index[t_href]:
+            msgs.append(("ERROR", "par %d: id '%s' not in text file '%s'" % (i, fragment, t_href)))
+        if (clip_begin is None) or (clip_end is None):
+            msgs.append(("ERROR", "par %d: missing or invalid clip values" % (i)))
+            continue
+        if clip_end < clip_begin:
+            msgs.append(("ERROR", "par %d: clip ends (%s) before it begins (%s)" % (i, format_clock(clip_end), format_clock(clip_begin))))
+        if clip_begin < last_end.get(a_href, 0.0):
+            msgs.append(("ERROR", "par %d: clip begins (%s) before the end of the previous one (%s)" % (i, format_clock(clip_begin), format_clock(last_end[a_href]))))
+        last_end[a_href] = max(clip_end, last_end.get(a_href, 0.0))
+    return msgs
+
+
+def parse_clocks(values, default=None):
+    """
+    Parse the given SMIL clock values, and return them
+    as an array of doubles, in seconds.
+    Empty values are replaced by default.
+    Raise ValueError if a value is not a valid clock value.
+
+    :param values: the clock values
+    :type  values: sequence of str
+    :param default: the value of missing clock values
+    :type  default: str
+    :rtype: array
+    """
+    try:
+        # fast path: plain timecount values, as written by aeneas and icarus
+        return array("d", map(float, values))
+    except ValueError:
+        pass
+    seconds = array("d")
+    for value in values:
+        clock = parse_clock(value or default or "")
+        if clock is None:
+            raise ValueError("invalid clock value '%s'" % (value))
+        seconds.append(clock)
+    return seconds
+
+
+class SmilTimings(object):
+    """
+    The timings of a SMIL file synchronizing a text file
+    with an audio file, stored as a struct of arrays:
+    the lists of the par ids (None if missing)
+    and of the text fragment ids, and two arrays
+    of doubles with the clip begin and end values, in seconds.
+
+    The par elements are not kept as Python objects,
+    so that books with hundreds of thousands of them
+    can be parsed, shifted and serialized quickly.
+
+    The timings parsed from a SMIL file keep its source code,
+    the offsets of the clipBegin/clipEnd attributes
+    of each par, and their original values,
+    so that serialize() rewrites only those attributes.
+
+    :param t_href: the path of the text file, relative to OEBPS
+    :type  t_href: str
+    :param a_href: the path of the audio file, relative to OEBPS
+    :type  a_href: str
+    """
+
+    __slots__ = [
+        "t_href",
+        "a_href",
+        "par_ids",
+        "ids",
+        "clip_begins",
+        "clip_ends",
+        "source",
+        "clip_spans",
+        "clip_values",
+    ]
+
+    def __init__(self, t_href, a_href):
+        self.t_href = t_href
+        self.a_href = a_href
+        self.par_ids = []
+        self.ids = []
+        self.clip_begins = array("d")
+        self.clip_ends = array("d")
+        self.source = None
+        self.clip_spans = array("l")
+        self.clip_values = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_fragments(cls, t_href, a_href, fragments):
+        """
+        Build the timings from a list of (identifier, begin, end) fragments.
+
+        :param t_href: the path of the text file, relative to OEBPS
+        :type  t_href: str
+        :param a_href: the path of the audio file, relative to OEBPS
+        :type  a_href: str
+        :param fragments: the (identifier, begin, end) fragments
+        :type  fragments: list of tuple
+        :rtype: SmilTimings
+        """
+        timings = cls(t_href, a_href)
+        for i, (identifier, begin, end) in enumerate(fragments, 1):
+            timings.par_ids.append("%06d" % (i))
+            timings.ids.append(identifier)
+            timings.clip_begins.append(begin)
+            timings.clip_ends.append(end)
+        return timings
+
+    @classmethod
+    def parse(cls, data, smil_directory):
+        """
+        Parse the given SMIL code, and return its timings.
+
+        The par elements are found by the start tag scanner
+        (see iter_pars()), and the columns of their attribute values
+        are converted into the arrays in bulk, without building a tree.
+        If the SMIL code has no par elements, the returned timings
+        are empty, with t_href and a_href set to None.
+        Raise ValueError if a par element does not have
+        both a text and an audio element (or if they are outside a par),
+        if the SMIL code references more than one text or audio file,
+        or if a clip value is missing or invalid.
+
+        :param data: the SMIL code
+        :type  data: str or bytes (UTF-8)
+        :param smil_directory: the directory of the SMIL file
+        :type  smil_directory: str
+        :rtype: SmilTimings
+        """
+        timings = cls(None, None)
+        source = unicode_str(data)
+        rows = []
+        spans = array("l")
+        pars = 0
+        for par, text, audio in iter_pars(source):
+            # text and audio elements outside a par count as a par
+            pars += 1
+            if (par is None) or (text is None) or (audio is None):
+                continue
+            t_src, sep, identifier = text.attrs.get("src", "").partition("#")
+            # a missing clipBegin attribute is inserted after the last attribute
+            begin_span = audio.spans.get("clipbegin", (audio.attrs_end, audio.attrs_end))
+            end_span = audio.spans.get("clipend", (audio.attrs_end, audio.attrs_end))
+            spans.extend([begin_span[0], begin_span[1], end_span[0], end_span[1]])
+            rows.append((
+                par.attrs.get("id"),
+                t_src,
+                identifier,
+                audio.attrs.get("src", ""),
+                audio.attrs.get("clipbegin", ""),
+                audio.attrs.get("clipend", ""),
+            ))
+        if len(rows) != pars:
+            # rewriting the file would leave some clips unchanged
+            raise ValueError("%d par elements, but only %d with both a text and an audio element" % (pars, len(rows)))
+        if len(rows) == 0:
+            return timings
+        par_ids, t_srcs, ids, a_srcs, clip_begins, clip_ends = zip(*rows)
+        if len(set(t_srcs)) > 1:
+            raise ValueError("more than one text file referenced")
+        if len(set(a_srcs)) > 1:
+            raise ValueError("more than one audio file referenced")
+        if "" in clip_ends:
+            raise ValueError("missing clipEnd value for id '%s'" % (ids[clip_ends.index("")]))
+        timings.t_href = resolve_src(smil_directory, t_srcs[0])[0]
+        timings.a_href = resolve_src(smil_directory, a_srcs[0])[0]
+        timings.par_ids = list(par_ids)
+        timings.ids = list(ids)
+        timings.clip_begins = parse_clocks(clip_begins, default="0")
+        timings.clip_ends = parse_clocks(clip_ends)
+        timings.source = source
+        timings.clip_spans = spans
+        timings.clip_values = [clip_begins, clip_ends]
+        return timings
+
+    def shift(self, offset=0.0, scale=1.0):
+        """
+        Rescale and shift all the clip values in place,
+        mapping each value t to t * scale + offset,
+        clamped at zero.
+
+        :param offset: the offset, in seconds
+        :type  offset: float
+        :param scale: the scale factor
+        :type  scale: float
+        """
+        # NOTE without numpy there is no vectorized arithmetic on arrays:
+        #      a comprehension per array is the fastest option,
+        #      and the (rare) clamping pass uses a conditional
+        #      expression, about twice as fast as calling max()
+        for name in ["clip_begins", "clip_ends"]:
+            values = array("d", [value * scale + offset for value in getattr(self, name)])
+            if (len(values) > 0) and (min(values) < 0.0):
+                values = array("d", [value if value > 0.0 else 0.0 for value in values])
+            setattr(self, name, values)
+
+    def serialize(self):
+        """
+        Return the SMIL code of the timings, as UTF-8 bytes.
+
+        If the timings were parsed from a SMIL file,
+        its source code is returned, with only the clipBegin/clipEnd
+        attributes rewritten, in the syntax of the original values.
+        Otherwise, the SMIL code is built with a par element
+        per fragment, numbered from 1.
+
+        :rtype: bytes
+        """
+        if self.source is not None:
+            return self.splice_clips().encode("utf-8")
+        t_href = self.t_href
+        a_href = self.a_href
+        rows = [
+            SMIL_ROW % (par_id or "%06d" % (i), t_href, identifier, "%.3f" % (begin), "%.3f" % (end), a_href)
+            for i, par_id, identifier, begin, end in zip(range(1, len(self.ids) + 1), self.par_ids, self.ids, self.clip_begins, self.clip_ends)
+        ]
+        rows.insert(0, SMIL_HEADER % (t_href))
+        rows.append(SMIL_FOOTER)
+        return "\n".join(rows).encode("utf-8")
+
+    def splice_clips(self):
+        """
+        Return the source code of the parsed SMIL file,
+        with the clipBegin/clipEnd attributes
+        replaced by the current clip values.
+
+        :rtype: str
+        """
+        spans = self.clip_spans
+        old_begins, old_ends = self.clip_values
+        edits = []
+        for i, (begin, end) in enumerate(zip(self.clip_begins, self.clip_ends)):
+            j = 4 * i
+            edits.append((spans[j], spans[j + 1], ' clipBegin="%s"' % (format_clock_like(begin, old_begins[i]))))
+            edits.append((spans[j + 2], spans[j + 3], ' clipEnd="%s"' % (format_clock_like(end, old_ends[i]))))
+        return splice(self.source, edits)
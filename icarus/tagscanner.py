@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+from __future__ import absolute_import
+from __future__ import print_function
+import re
+
+from compatibility_utils import unicode_str
+from compatibility_utils import unescapeit
+
+__author__ = "Alberto Pettarin"
+__copyright__ = "Copyright 2015-2016, Alberto Pettarin (www.albertopettarin.it)"
+__license__ = "MIT"
+__version__ = "0.0.3"
+__email__ = "alberto@albertopettarin.it"
+__status__ = "Production"
+
+# the markup constructs that can start with "<"
+# group 1: comment, group 2: CDATA section, group 3: end tag,
+# group 4: doctype or processing instruction, group 5: start tag name
+MARKUP_PATTERN = re.compile(r"<(?:(!--)|(!\[CDATA\[)|(/)|([!?])|([A-Za-z][^\s/>]*))")
+
+# one attribute, with its leading whitespace
+# group 1: name, group 2, 3, 4: double quoted, single quoted, unquoted value
+ATTRIBUTE_PATTERN = re.compile(r"""\s+([^\s"'>/=]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'=<>`]+)))?""")
+
+# the end of a start tag
+TAG_CLOSE_PATTERN = re.compile(r"\s*(/?)>")
+
+# the rest of a start tag we are not interested in
+TAG_REST_PATTERN = re.compile(r"""(?:\s+[^\s"'>/=]+(?:\s*=\s*(?:"[^"]*"|'[^']*'|[^\s"'=<>`]+))?)*\s*/?>""")
+
+# an id attribute, anywhere in the source code
+# group 1, 2, 3: double quoted, single quoted, unquoted value
+ID_ATTRIBUTE_PATTERN = re.compile(r"""\sid\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'=<>`/]+))""")
+
+# elements whose contents must not be scanned for tags
+RAW_TEXT_END_PATTERNS = {
+    "script": re.compile(r"</script\s*>", re.IGNORECASE),
+    "style": re.compile(r"</style\s*>", re.IGNORECASE),
+}
+
+class StartTag(object):
+    """
+    A start tag found in an XHTML source string.
+
+    The attributes are exposed as a dict, like BeautifulSoup does,
+    with the "class" attribute split into a list of class names.
+    The attrs dict can be modified: the modifications
+    are turned into edits of the source string by get_edits().
+
+    :param name: the (lowercased) tag name
+    :type  name: str
+    :param start: the offset of the "<" character
+    :type  start: int
+    :param end: the offset just after the ">" character
+    :type  end: int
+    :param attrs_end: the offset just after the last attribute
+    :type  attrs_end: int
+    :param spans: a dict mapping each attribute name to
+                  a (start, end, value) tuple, where start
+                  includes the whitespace preceding the attribute
+    :type  spans: dict
+    """
+
+    __slots__ = ["name", "start", "end", "attrs_end", "spans", "attrs"]
+
+    def __init__(self, name, start, end, attrs_end, spans):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.attrs_end = attrs_end
+        self.spans = spans
+        self.attrs = dict((key, span[2]) for key, span in spans.items())
+        if "class" in self.attrs:
+            self.attrs["class"] = self.attrs["class"].split()
+
+    @classmethod
+    def escape_value(cls, value):
+        """
+        Escape the given attribute value,
+        so that it can be enclosed in double quotes.
+
+        :param value: the attribute value
+        :type  value: str
+        :rtype: str
+        """
+        return value.replace("&", "&amp;").replace("<", "&lt;").replace('"', "&quot;")
+
+    @classmethod
+    def merge_classes(cls, old, new):
+        """
+        Return the class names in new, keeping the order
+        they had in old and appending the ones not in old.
+
+        :param old: the original class names
+        :type  old: list of str
+        :param new: the current class names
+        :type  new: list of str
+        :rtype: list of str
+        """
+        new_set = set(new)
+        merged = [c for c in old if c in new_set]
+        for c in new:
+            if c not in merged:
+                merged.append(c)
+        return merged
+
+    def get_edits(self):
+        """
+        Return the list of (start, end, replacement) edits
+        which apply the changes made to attrs to the source string.
+        Attributes whose value did not change are left untouched;
+        a class attribute is considered changed only if
+        its set of class names changed.
+
+        :rtype: list of tuple
+        """
+        edits = []
+        for key, (start, end, value) in self.spans.items():
+            if key not in self.attrs:
+                edits.append((start, end, ""))
+                continue
+            new_value = self.attrs[key]
+            if key == "class":
+                if not isinstance(new_value, list):
+                    new_value = [new_value]
+                old_classes = value.split()
+                if set(old_classes) == set(new_value):
+                    continue
+                new_value = " ".join(self.merge_classes(old_classes, new_value))
+            elif new_value == value:
+                continue
+            edits.append((start, end, ' %s="%s"' % (key, self.escape_value(new_value))))
+        added = []
+        for key in sorted(self.attrs):
+            if key not in self.spans:
+                new_value = self.attrs[key]
+                if isinstance(new_value, list):
+                    new_value = " ".join(new_value)
+                added.append(' %s="%s"' % (key, self.escape_value(new_value)))
+        if len(added) > 0:
+            edits.append((self.attrs_end, self.attrs_end, "".join(added)))
+        return edits
+
+
+def skip_past(data, marker, pos):
+    """
+    Return the offset just after the first occurrence
+    of marker in data, starting at pos,
+    or the length of data if marker does not occur.
+
+    :rtype: int
+    """
+    index = data.find(marker, pos)
+    if index < 0:
+        return len(data)
+    return index + len(marker)
+
+
+def iter_start_tags(data, names=None):
+    """
+    Scan the given XHTML source string, and yield a StartTag
+    for each start tag whose name is in names (or for every
+    start tag, if names is None).
+
+    Comments, CDATA sections, doctype declarations,
+    processing instructions, end tags and the contents
+    of script/style elements are skipped.
+    Malformed start tags are skipped as well.
+
+    :param data: the source code
+    :type  data: str
+    :param names: the tag names to report
+    :type  names: set of str
+    :rtype: generator of StartTag
+    """
+    pos = 0
+    while True:
+        match = MARKUP_PATTERN.search(data, pos)
+        if match is None:
+            return
+        comment, cdata, end_tag, declaration, name = match.groups()
+        if comment is not None:
+            pos = skip_past(data, "-->", match.end())
+        elif cdata is not None:
+            pos = skip_past(data, "]]>", match.end())
+        elif name is None:
+            pos = skip_past(data, ">", match.end())
+        else:
+            name = name.lower()
+            if (names is not None) and (name not in names):
+                rest = TAG_REST_PATTERN.match(data, match.end())
+                if rest is None:
+                    pos = match.end()
+                    continue
+                pos = rest.end()
+                self_closing = data[pos - 2] == "/"
+            else:
+                spans = {}
+                attrs_end = match.end()
+                while True:
+                    attr = ATTRIBUTE_PATTERN.match(data, attrs_end)
+                    if attr is None:
+                        break
+                    key = attr.group(1).lower()
+                    if key not in spans:
+                        value = attr.group(2)
+                        if value is None:
+                            value = attr.group(3)
+                        if value is None:
+                            value = attr.group(4)
+                        if value is None:
+                            value = ""
+                        elif "&" in value:
+                            value = unescapeit(value)
+                        spans[key] = (attrs_end, attr.end(), value)
+                    attrs_end = attr.end()
+                close = TAG_CLOSE_PATTERN.match(data, attrs_end)
+                if close is None:
+                    pos = match.end()
+                    continue
+                pos = close.end()
+                self_closing = (close.group(1) == "/")
+                yield StartTag(name, match.start(), pos, attrs_end, spans)
+            if (name in RAW_TEXT_END_PATTERNS) and (not self_closing):
+                raw_end = RAW_TEXT_END_PATTERNS[name].search(data, pos)
+                if raw_end is None:
+                    return
+                pos = raw_end.end()
+
+
+def collect_ids(data):
+    """
+    Return the set of the id values in the given XHTML source string.
+
+    This is a quick scan of the source code:
+    it might return some spurious values
+    (e.g., from comments), but it does not miss
+    any id attribute value.
+
+    :param data: the source code
+    :type  data: str or bytes (UTF-8)
+    :rtype: set of str
+    """
+    ids = set()
+    for match in ID_ATTRIBUTE_PATTERN.finditer(unicode_str(data)):
+        value = match.group(1)
+        if value is None:
+            value = match.group(2)
+        if value is None:
+            value = match.group(3)
+        if "&" in value:
+            value = unescapeit(value)
+        ids.add(value)
+    return ids
+
+
+def splice(data, edits):
+    """
+    Apply the given (start, end, replacement) edits
+    to the given string, and return the resulting string.
+    The edits must not overlap.
+    If there are no edits, data is returned as it is.
+
+    :param data: the source string
+    :type  data: str
+    :param edits: the edits
+    :type  edits: list of tuple
+    :rtype: str
+    """
+    if len(edits) == 0:
+        return data
+    pieces = []
+    pos = 0
+    for start, end, replacement in sorted(edits):
+        pieces.append(data[pos:start])
+        pieces.append(replacement)
+        pos = end
+    pieces.append(data[pos:])
+    return "".join(pieces)
+
+
+class StartTagDocument(object):
+    """
+    A lightweight replacement for the soup object,
+    which only tokenizes the start tags with the given names.
+
+    find_all() returns the StartTag objects, whose attrs
+    can be modified, and serialize() applies those modifications
+    to the original source code, which is otherwise copied unchanged.
+
+    :param data: the source code
+    :type  data: str or bytes (UTF-8)
+    :param names: the tag names to process
+    :type  names: list of str
+    """
+
+    __slots__ = ["data", "names", "tags"]
+
+    def __init__(self, data, names=None):
+        self.data = unicode_str(data)
+        self.names = None if names is None else frozenset(names)
+        self.tags = None
+
+    def find_all(self):
+        """
+        Return the list of StartTag objects.
+
+        :rtype: list of StartTag
+        """
+        if self.tags is None:
+            self.tags = list(iter_start_tags(self.data, self.names))
+        return self.tags
+
+    def get_edits(self):
+        """
+        Return the list of edits corresponding to
+        the modifications made to the StartTag objects.
+
+        :rtype: list of tuple
+        """
+        edits = []
+        for tag in self.find_all():
+            edits.extend(tag.get_edits())
+        return edits
+
+    def serialize(self):
+        """
+        Return the source code, with the modified start tags rewritten.
+
+        :rtype: str
+        """
+        return splice(self.data, self.get_edits())
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:ts=4:sw=4:softtabstop=4:smarttab:expandtab
+
+from __future__ import absolute_import
+from __future__ import print_function
+import collections
+import io
+import json
+import os
+import time
+
+__author__ = "Alberto Pettarin"
+__copyright__ = "Copyright 2015-2016, Alberto Pettarin (www.albertopettarin.it)"
+__license__ = "MIT"
+__version__ = "0.0.3"
+__email__ = "alberto@albertopettarin.it"
+__status__ = "Production"
+
+if hasattr(time, "process_time"):
+    cpu_time = time.process_time
+else:
+    # Python 2
+    cpu_time = time.clock
+
+class PhaseTimer(object):
+    """
+    Accumulate the wall and CPU time spent in named phases.
+
+    lap(name) adds the time elapsed since the previous lap,
+    or since the timer was created or reset, to the given phase,
+    so that a sequence of phases is timed by a lap after each one.
+    CPU time is the one of the current process.
+    """
+
+    def __init__(self):
+        self.phases = collections.OrderedDict()
+        self.reset()
+
+    def reset(self):
+        self.wall = time.time()
+        self.cpu = cpu_time()
+
+    def lap(self, name):
+        wall = time.time()
+        cpu = cpu_time()
+        self.add(name, wall - self.wall, cpu - self.cpu)
+        self.wall = wall
+        self.cpu = cpu
+
+    def add(self, name, wall, cpu):
+        entry = self.phases.setdefault(name, [0.0, 0.0])
+        entry[0] += wall
+        entry[1] += cpu
+
+    def update(self, phases):
+        """
+        Add the given phases, as returned by to_dict().
+
+        :param phases: the phases
+        :type  phases: dict
+        """
+        for name, entry in phases.items():
+            self.add(name, entry["wall"], entry["cpu"])
+
+    def to_dict(self):
+        """
+        Return an (ordered) dict mapping each phase name
+        to a dict with its "wall" and "cpu" times, in seconds.
+
+        :rtype: dict
+        """
+        return collections.OrderedDict(
+            (name, {"wall": wall, "cpu": cpu}) for name, (wall, cpu) in self.phases.items()
+        )
+
+
+
+class NullTimer(object):
+    """
+    A timer which does not time anything,
+    used when no timing is requested.
+    """
+
+    def reset(self):
+        pass
+
+    def lap(self, name):
+        pass
+
+
+
+NULL_TIMER = NullTimer()
+
+class TimingReport(object):
+    """
+    The timings of an operation: the phases of each file,
+    the phases of the operation as a whole (timer),
+    and their totals, written as a JSON file.
+
+    :param operation: the name of the operation
+    :type  operation: str
+    """
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.start = time.time()
+        # milliseconds, as operations can be run in the same second
+        self.stamp = "%s_%03d" % (time.strftime("%Y%m%d_%H%M%S", time.localtime(self.start)), int(self.start * 1000) % 1000)
+        self.timer = PhaseTimer()
+        self.files = collections.OrderedDict()
+        self.details = collections.OrderedDict()
+        self.profile_path = None
+
+    def get_file_timer(self, href):
+        """
+        Return the timer of the file with the given href,
+        creating it if needed.
+
+        :param href: the href of the file
+        :type  href: str
+        :rtype: PhaseTimer
+        """
+        if href not in self.files:
+            self.files[href] = PhaseTimer()
+        return self.files[href]
+
+    def to_dict(self):
+        """
+        Return the report, as a dict.
+
+        :rtype: dict
+        """
+        total = PhaseTimer()
+        for timer in self.files.values():
+            total.update(timer.to_dict())
+        total.update(self.timer.to_dict())
+        return collections.OrderedDict([
+            ("operation", self.operation),
+            ("started", self.stamp),
+            ("elapsed", time.time() - self.start),
+            ("total", total.to_dict()),
+            ("operation_phases", self.timer.to_dict()),
+            ("files", collections.OrderedDict((href, timer.to_dict()) for href, timer in self.files.items())),
+            ("details", self.details),
+            ("profile", self.profile_path),
+        ])
+
+    def get_path(self, directory, extension):
+        """
+        Return the path of a file of this report in the given directory,
+        e.g. "20151216_180203_042_icarus_add_timings.json".
+
+        :param directory: the directory
+        :type  directory: str
+        :param extension: the extension of the file
+        :type  extension: str
+        :rtype: str
+        """
+        return os.path.join(directory, "%s_icarus_%s_timings%s" % (self.stamp, self.operation, extension))
+
+    def write(self, directory):
+        """
+        Write the report as a JSON file in the given directory,
+        and return its path.
+
+        :param directory: the directory
+        :type  directory: str
+        :rtype: str
+        """
+        path = self.get_path(directory, ".json")
+        with io.open(path, "wb") as file_obj:
+            file_obj.write(json.dumps(self.to_dict(), indent=1).encode("utf-8"))
+        return path
@@ -0,0 +1,16 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+"""
+Make the icarus modules (imported as top-level modules,
+as Sigil does) and the benchmark helpers importable by the tests.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+for directory in ["icarus", "benchmark"]:
+    sys.path.insert(0, os.path.join(ROOT, directory))
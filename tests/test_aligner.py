@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import absolute_import
+from __future__ import print_function
+import re
+
+from aligner import align_pair
+from aligner import get_mo_ids
+from moedit import IdAllocator
+from moedit import MOEdit
+from synthetic import audio_href
+from synthetic import generate_book
+from synthetic import text_href
+
+PARAGRAPHS = 4
+
+def get_tasks(chapters=2):
+    # some elements have a pre-existing MO id, kept with the book id scope,
+    # so that the id values are not sorted in document order
+    bk = generate_book(chapters=chapters, paragraphs=PARAGRAPHS, ids=0.5, classes=0.0, audio_size=16)
+    id_allocator = IdAllocator.from_book(bk, "f%06d")
+    moedit = MOEdit(["h1", "p"], "mo", "nomo", r"f[0-9]{6}", "f%06d", 0, engine=MOEdit.ENGINE_STREAM, id_allocator=id_allocator)
+    tasks = []
+    for chapter in range(1, chapters + 1):
+        t_href = text_href(chapter)
+        diagnostics, t_data = moedit.add_mo_attributes(bk.readfile(bk.href_to_id(t_href)))
+        tasks.append({
+            "language": "en",
+            "mo_class": "mo",
+            "t_href": t_href,
+            "t_data": t_data,
+            "a_href": audio_href(chapter),
+            "a_path": None,
+            "a_data": b"",
+            "s_name": "c%04d.smil" % (chapter),
+        })
+    return tasks
+
+def test_get_mo_ids_document_order():
+    tasks = get_tasks()
+    for task in tasks:
+        ids = get_mo_ids(task["t_data"], "mo")
+        # the heading and each paragraph, in the order they appear in the file
+        assert len(ids) == 1 + PARAGRAPHS
+        assert ids == re.findall(r'<(?:h1|p)\b[^>]*\bid="([^"]+)"', task["t_data"])
+    assert any(ids != sorted(ids) for ids in [get_mo_ids(task["t_data"], "mo") for task in tasks])
+
+def test_align_pair_stub():
+    for task in get_tasks():
+        msgs, s_name, smil = align_pair(("stub", task))
+        assert s_name == task["s_name"]
+        assert ("INFO", "aligned %d MO elements" % (1 + PARAGRAPHS)) in msgs
+        assert [msg for msg in msgs if msg[0] != "INFO"] == []
+        smil = smil.decode("utf-8")
+        assert 'epub:textref="../%s"' % (task["t_href"]) in smil
+        pars = re.findall(r'<text src="\.\./([^"#]+)#([^"]+)"/><audio clipBegin="([^"]+)" clipEnd="([^"]+)" src="\.\./([^"]+)"/>', smil)
+        ids = get_mo_ids(task["t_data"], "mo")
+        assert [par[1] for par in pars] == ids
+        assert [(par[2], par[3]) for par in pars] == [("%.3f" % (i), "%.3f" % (i + 1)) for i in range(len(ids))]
+        assert set(par[0] for par in pars) == set([task["t_href"]])
+        assert set(par[4] for par in pars) == set([task["a_href"]])
+
+def test_align_pair_unknown_aligner():
+    task = get_tasks(chapters=1)[0]
+    msgs, s_name, smil = align_pair(("nonexistent", task))
+    assert smil is None
+    assert msgs[0][0] == "ERROR"
+
+def test_align_pair_without_mo_elements():
+    task = get_tasks(chapters=1)[0]
+    task["mo_class"] = "other"
+    msgs, s_name, smil = align_pair(("stub", task))
+    assert smil is None
+    assert msgs == [("ERROR", "no MO elements in file '%s'" % (task["t_href"]))]
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import absolute_import
+from __future__ import print_function
+import random
+
+import pytest
+
+from epub_utils import ADOBE_MANGLE_LENGTH
+from epub_utils import Adobe_mangle_fonts
+from epub_utils import Adobe_mangle_fonts_bulk
+from epub_utils import IDPF_MANGLE_LENGTH
+from epub_utils import Idpf_mangle_fonts
+from epub_utils import Idpf_mangle_fonts_bulk
+
+SCHEMES = [
+    (Adobe_mangle_fonts, Adobe_mangle_fonts_bulk, ADOBE_MANGLE_LENGTH),
+    (Idpf_mangle_fonts, Idpf_mangle_fonts_bulk, IDPF_MANGLE_LENGTH),
+]
+
+def random_bytes(rnd, size):
+    return bytes(bytearray(rnd.getrandbits(8) for i in range(size)))
+
+def get_fonts(length):
+    rnd = random.Random(length)
+    sizes = [0, 1, 2, length // 2, length - 1, length, length + 1, 3 * length]
+    return [random_bytes(rnd, size) for size in sizes]
+
+@pytest.mark.parametrize("per_byte, bulk, length", SCHEMES)
+# 16 and 20 bytes are the sizes of the Adobe and IDPF keys
+@pytest.mark.parametrize("key_size", [1, 7, 16, 20, 1023, 1024, 1040, 1041, 2048])
+def test_bulk_equals_per_byte(per_byte, bulk, length, key_size):
+    key = random_bytes(random.Random(key_size), key_size)
+    fonts = get_fonts(length)
+    assert bulk(key, fonts) == [per_byte(key, data) for data in fonts]
+
+@pytest.mark.parametrize("per_byte, bulk, length", SCHEMES)
+def test_short_fonts(per_byte, bulk, length):
+    key = random_bytes(random.Random(0), 20)
+    for size in [0, 1, length - 1]:
+        data = random_bytes(random.Random(size), size)
+        mangled = bulk(key, [data])[0]
+        assert len(mangled) == size
+        assert mangled == per_byte(key, data)
+
+@pytest.mark.parametrize("per_byte, bulk, length", SCHEMES)
+def test_only_header_mangled(per_byte, bulk, length):
+    key = random_bytes(random.Random(1), 16)
+    data = random_bytes(random.Random(2), 2 * length)
+    mangled = bulk(key, [data])[0]
+    assert mangled[length:] == data[length:]
+    assert mangled[:length] != data[:length]
+
+@pytest.mark.parametrize("per_byte, bulk, length", SCHEMES)
+def test_mangle_twice_is_identity(per_byte, bulk, length):
+    key = random_bytes(random.Random(3), 16)
+    fonts = get_fonts(length)
+    assert bulk(key, bulk(key, fonts)) == fonts
+    assert [per_byte(key, per_byte(key, data)) for data in fonts] == fonts
+
+@pytest.mark.parametrize("per_byte, bulk, length", SCHEMES)
+def test_text_fonts_rejected(per_byte, bulk, length):
+    with pytest.raises(TypeError):
+        bulk(b"key", [u"not bytes"])
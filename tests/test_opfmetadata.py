@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import absolute_import
+from __future__ import print_function
+import xml.etree.ElementTree as ElementTree
+
+import pytest
+
+from opfmetadata import MetadataIndex
+
+PACKAGE_TAG = '<package xmlns="http://www.idpf.org/2007/opf" xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:calibre="http://calibre.kovidgoyal.net/2009/metadata" unique-identifier="id" version="3.0">'
+
+METADATA = """<metadata xmlns:opf="http://www.idpf.org/2007/opf">
+    <dc:identifier id="id">urn:uuid:1234</dc:identifier>
+    <dc:title id="t1">Title</dc:title>
+    <dc:language>it</dc:language>
+    <meta property="dcterms:modified">2016-01-01T00:00:00Z</meta>
+    <meta refines="#t1" property="title-type">main</meta>
+    <meta name="cover" content="cover.jpg"/>
+    <meta name="calibre:series" content="Series"/>
+    <calibre:custom>value</calibre:custom>
+  </metadata>"""
+
+def check_index(index):
+    assert index.get("identifier") == "urn:uuid:1234"
+    assert index.get("language") == "it"
+    assert index.get("dc:title") == "Title"
+    assert index.get("dcterms:modified") == "2016-01-01T00:00:00Z"
+    assert index.get("cover") == "cover.jpg"
+    assert index.get_refinements("t1", "title-type") == ["main"]
+
+def test_parse_with_package_declarations():
+    index = MetadataIndex(METADATA, PACKAGE_TAG)
+    check_index(index)
+    assert index.get("{http://calibre.kovidgoyal.net/2009/metadata}custom") == "value"
+
+def test_parse_undeclared_prefix():
+    # the calibre prefix is declared nowhere
+    check_index(MetadataIndex(METADATA))
+
+def test_scan_malformed_metadata():
+    data = METADATA.replace("<dc:title", "<dc:title & ")
+    with pytest.raises(ElementTree.ParseError):
+        MetadataIndex(data, PACKAGE_TAG)
+    index = MetadataIndex.scan(data)
+    assert index.get("language") == "it"
+    assert index.get("identifier") == "urn:uuid:1234"
+    assert index.get("dcterms:modified") == "2016-01-01T00:00:00Z"
+    assert index.get("cover") == "cover.jpg"
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import absolute_import
+from __future__ import print_function
+import pytest
+
+from smilfile import SmilTimings
+from smilfile import check_smil
+from smilfile import format_clock_like
+from smilfile import scan_smil
+
+SMIL = """<?xml version="1.0" encoding="UTF-8"?>
+<smil xmlns="http://www.w3.org/ns/SMIL" xmlns:epub="http://www.idpf.org/2007/ops" version="3.0">
+ <body>
+  <seq id="s1" epub:textref="../Text/p001.xhtml">
+   <par id="p1"><text src="../Text/p001.xhtml#f000001"/><audio clipBegin="0.000" clipEnd="1.500" src="../Audio/p001.mp3"/></par>
+   <par id="p2">
+    <audio src="../Audio/p001.mp3" clipEnd="0:00:03.000" clipBegin="0:00:01.500"></audio>
+    <text src="../Text/p001.xhtml#f000002"></text>
+   </par>
+   <par id="p3"><audio clipBegin="3s" clipEnd="2500ms" src="../Audio/p001.mp3"/><text src="../Text/p001.xhtml#f000003"/></par>
+  </seq>
+ </body>
+</smil>
+"""
+
+SMIL_EMPTY = """<smil xmlns="http://www.w3.org/ns/SMIL" xmlns:epub="http://www.idpf.org/2007/ops" version="3.0">
+ <body>
+  <seq id="s1" epub:textref="../Text/p001.xhtml">
+  </seq>
+ </body>
+</smil>
+"""
+
+def test_scan_smil_either_order():
+    assert scan_smil(SMIL, "Misc") == [
+        ("Text/p001.xhtml", "f000001", "Audio/p001.mp3", 0.0, 1.5),
+        ("Text/p001.xhtml", "f000002", "Audio/p001.mp3", 1.5, 3.0),
+        ("Text/p001.xhtml", "f000003", "Audio/p001.mp3", 3.0, 2.5),
+    ]
+
+def test_check_smil_audio_before_text():
+    id_index = {"Text/p001.xhtml": set(["f000001", "f000002"])}
+    msgs = check_smil(scan_smil(SMIL, "Misc"), id_index)
+    assert msgs == [
+        ("ERROR", "par 3: id 'f000003' not in text file 'Text/p001.xhtml'"),
+        ("ERROR", "par 3: clip ends (2.500) before it begins (3.000)"),
+    ]
+
+def test_smil_timings_parse():
+    timings = SmilTimings.parse(SMIL, "Misc")
+    assert timings.t_href == "Text/p001.xhtml"
+    assert timings.a_href == "Audio/p001.mp3"
+    assert timings.par_ids == ["p1", "p2", "p3"]
+    assert timings.ids == ["f000001", "f000002", "f000003"]
+    assert list(timings.clip_begins) == [0.0, 1.5, 3.0]
+    assert list(timings.clip_ends) == [1.5, 3.0, 2.5]
+
+def test_smil_timings_parse_without_pars():
+    timings = SmilTimings.parse(SMIL_EMPTY, "Misc")
+    assert len(timings) == 0
+    assert timings.t_href is None
+
+def test_smil_timings_parse_errors():
+    for data in [
+        SMIL.replace("../Audio/p001.mp3\" clipEnd", "../Audio/p002.mp3\" clipEnd"),
+        SMIL.replace(' clipEnd="1.500"', ""),
+        SMIL.replace('clipEnd="1.500"', 'clipEnd="x"'),
+    ]:
+        with pytest.raises(ValueError):
+            SmilTimings.parse(data, "Misc")
+
+def test_smil_timings_parse_par_mismatch():
+    for data in [
+        SMIL.replace('<text src="../Text/p001.xhtml#f000001"/>', ""),
+        SMIL.replace('<par id="p1">', "").replace("</par>", "", 1),
+    ]:
+        with pytest.raises(ValueError):
+            SmilTimings.parse(data, "Misc")
+
+def test_smil_timings_serialize_in_place():
+    timings = SmilTimings.parse(SMIL, "Misc")
+    timings.shift(offset=0.5, scale=2.0)
+    assert timings.serialize().decode("utf-8") == SMIL.replace(
+        'clipBegin="0.000" clipEnd="1.500"', 'clipBegin="0.500" clipEnd="3.500"'
+    ).replace(
+        'clipEnd="0:00:03.000" clipBegin="0:00:01.500"', 'clipEnd="0:00:06.500" clipBegin="0:00:03.500"'
+    ).replace(
+        'clipBegin="3s" clipEnd="2500ms"', 'clipBegin="6.500s" clipEnd="5500ms"'
+    )
+
+def test_smil_timings_serialize_missing_clip_begin():
+    timings = SmilTimings.parse(SMIL.replace('clipBegin="0.000" ', ""), "Misc")
+    timings.shift(offset=1.0)
+    assert '<audio clipEnd="2.500" src="../Audio/p001.mp3" clipBegin="1.000"/>' in timings.serialize().decode("utf-8")
+
+def test_format_clock_like():
+    assert format_clock_like(1.5, "0.000") == "1.500"
+    assert format_clock_like(61.25, "00:01.000") == "01:01.250"
+    assert format_clock_like(3661.25, "59:00.000") == "1:01:01.250"
+    assert format_clock_like(3661.25, "0:00:00") == "1:01:01.250"
+    assert format_clock_like(1.5, "10ms") == "1500ms"
+    assert format_clock_like(90.0, "1.5min") == "90.000s"